@@ -120,6 +120,12 @@ valid_special_attrs = ["action.hash", "action.key", "action.name", "action.raw"]
 valid_special_prefixes = ["action."]
 _api_inst = None
 
+# The last stage of an operation completed by this process along with the
+# identity of the plan file it saved.  A "pkg remote" server asked to perform
+# the following stage continues with the plan it still holds rather than
+# loading it again.
+_api_plan_state = None
+
 tmpdirs = []
 tmpfiles = []
 
@@ -279,7 +285,8 @@ def usage(usage_error=None, cmd=None, retcode=EXIT_BADOPT, full=False,
             "            [-o attribute ...] [-s sort_key] [-t action_type ...]\n"
             "            [pkg_fmri_pattern ...]")
         adv_usage["search"] = _(
-            "[-HIaflpr] [-o attribute ...] [-s repo_uri] query")
+            "[-HIaflpr] [--cache] [-o attribute ...] [-s repo_uri]\n"
+            "            query")
 
         adv_usage["verify"] = _("[-Hqv] [--parsable version] [--unpackaged]\n"
             "            [--unpackaged-only] [pkg_fmri_pattern ...]")
@@ -1771,6 +1778,16 @@ def __api_plan_file(api_inst):
         plandir = api_inst.img_plandir
         return os.path.join(plandir, "plandesc")
 
+def __api_plan_id(api_inst):
+        """Return a tuple identifying the current PlanDescription save file,
+        or None if there isn't one."""
+
+        try:
+                st = os.stat(__api_plan_file(api_inst))
+        except OSError:
+                return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
 def __api_plan_save(api_inst):
         """Save an image plan to a file."""
 
@@ -1800,6 +1817,20 @@ def __api_plan_save(api_inst):
 def __api_plan_load(api_inst, stage, origins):
         """Loan an image plan from a file."""
 
+        global _api_plan_state
+
+        # if we saved or prepared the plan ourselves, and it hasn't changed
+        # since, then the api instance already holds it.
+        prev = { API_STAGE_PREPARE: API_STAGE_PLAN,
+            API_STAGE_EXECUTE: API_STAGE_PREPARE }[stage]
+        plan_state, _api_plan_state = _api_plan_state, None
+        if plan_state is not None and \
+            plan_state == (prev, __api_plan_id(api_inst)):
+                pkg_timer.record("reusing plan", logger=logger)
+                if stage == API_STAGE_EXECUTE:
+                        __api_plan_delete(api_inst)
+                return
+
         # load an existing plan
         path = __api_plan_file(api_inst)
         plan = api.PlanDescription()
@@ -1849,8 +1880,11 @@ def __api_op(_op, _api_inst, _accept=False, _li_ignore=None, _noexecute=False,
         assignment and will be passed directly on to the api
         interfaces being invoked."""
 
+        global _api_plan_state
+
         if _stage in [API_STAGE_DEFAULT, API_STAGE_PLAN]:
                 # create a new plan
+                _api_plan_state = None
                 rv = __api_plan(_op=_op, _api_inst=_api_inst,
                     _accept=_accept, _li_ignore=_li_ignore,
                     _noexecute=_noexecute, _omit_headers=_omit_headers,
@@ -1870,6 +1904,8 @@ def __api_op(_op, _api_inst, _accept=False, _li_ignore=None, _noexecute=False,
                         # consumer from creating a noop plan and then
                         # preparing and executing it.)
                         __api_plan_save(_api_inst)
+                        _api_plan_state = (API_STAGE_PLAN,
+                            __api_plan_id(_api_inst))
                 # for pkg verify
                 if _op == PKG_OP_FIX and _noexecute and _quiet_plan:
                         return _verify_exit_code(_api_inst)
@@ -1890,6 +1926,8 @@ def __api_op(_op, _api_inst, _accept=False, _li_ignore=None, _noexecute=False,
                 if ret_code != EXIT_OK:
                         return ret_code
                 if _stage == API_STAGE_PREPARE:
+                        _api_plan_state = (API_STAGE_PREPARE,
+                            __api_plan_id(_api_inst))
                         return EXIT_OK
 
         ret_code = __api_execute_plan(_op, _api_inst)
@@ -1907,6 +1945,8 @@ class RemoteDispatch(object):
 
         def __dispatch(self, op, pwargs):
 
+                global _api_plan_state
+
                 pkg_timer.record("rpc dispatch wait", logger=logger)
 
                 # if we were called with no arguments then pwargs will be []
@@ -1934,9 +1974,11 @@ class RemoteDispatch(object):
 
                 # if we're starting a new operation, reset the api.  we do
                 # this just in case our parent updated our linked image
-                # metadata.
+                # metadata.  this also discards any plan we were holding on
+                # to for a following stage.
                 if stage in [API_STAGE_DEFAULT, API_STAGE_PLAN]:
                         _api_inst.reset()
+                        _api_plan_state = None
 
                 if "pargs" not in pwargs:
                         pwargs["pargs"] = []
@@ -1986,7 +2028,7 @@ def remote(op, api_inst, pargs, ctlfd):
         os.close(ctlfd)
         ctlfd = ctlfd_new
 
-        rpc_server = pipeutils.PipedRPCServer(ctlfd)
+        rpc_server = pipeutils.PipedRPCServer(ctlfd, framing=True)
         rpc_server.register_introspection_functions()
         rpc_server.register_instance(RemoteDispatch())
 
@@ -3034,7 +3076,7 @@ def search(api_inst, args):
         search_prefixes = valid_special_prefixes[:]
         search_prefixes.extend(["search."])
 
-        opts, pargs = getopt.getopt(args, "Haflo:prs:I")
+        opts, pargs = getopt.getopt(args, "Haflo:prs:I", ["cache"])
 
         default_attrs_action = ["search.match_type", "action.name",
             "search.match", "pkg.shortfmri"]
@@ -3049,6 +3091,7 @@ def search(api_inst, args):
         prune_versions = True
         return_actions = True
         use_default_attrs = True
+        use_cache = False
 
         for opt, arg in opts:
                 if opt == "-H":
@@ -3072,6 +3115,8 @@ def search(api_inst, args):
                             "origin": misc.parse_uri(arg, cwd=orig_cwd) })
                 elif opt == "-I":
                         case_sensitive = True
+                elif opt == "--cache":
+                        use_cache = True
 
         if not local and not remote:
                 remote = True
@@ -3119,7 +3164,8 @@ def search(api_inst, args):
                         searches.append(api_inst.local_search(query))
                 if remote:
                         searches.append(api_inst.remote_search(query,
-                            servers=servers, prune_versions=prune_versions))
+                            servers=servers, prune_versions=prune_versions,
+                            use_cache=use_cache))
                 # By default assume we don't find anything.
                 retcode = EXIT_OOPS
 
@@ -5028,12 +5074,19 @@ def history_list(api_inst, args):
                 if not omit_headers:
                         msg(history_fmt.format(*headers))
 
+        # Listings that only use these columns can be produced from the
+        # history index without loading each operation's history file.
+        summary_cols = set(["be", "be_uuid", "client", "finish", "operation",
+            "outcome", "reason", "start", "time"])
+        summary = not long_format and not show_notes and \
+            summary_cols.issuperset(columns)
+
         def gen_entries():
                 """Error handler for history generation; avoids need to indent
                 and clobber formatting of logic below."""
                 try:
                         for he in api_inst.gen_history(limit=display_limit,
-                            times=time_vals):
+                            times=time_vals, summary=summary):
                                 yield he
                 except api_errors.HistoryException as e:
                         error(str(e), cmd="history")
@@ -156,7 +156,8 @@ def usage(text=None, retcode=2, full=False):
 Usage: /usr/lib/pkg.depotd [-a address] [-d inst_root] [-p port] [-s threads]
            [-t socket_timeout] [--cfg] [--content-root]
            [--disable-ops op[/1][,...]] [--debug feature_list]
-           [--image-root dir] [--log-access dest] [--log-errors dest]
+           [--image-root dir] [--index-jobs jobs] [--log-access dest]
+           [--log-errors dest]
            [--mirror] [--nasty] [--nasty-sleep] [--proxy-base url]
            [--readonly] [--ssl-cert-file] [--ssl-dialog] [--ssl-key-file]
            [--sort-file-max-size size] [--writable-root dir]
@@ -196,6 +197,9 @@ Usage: /usr/lib/pkg.depotd [-a address] [-d inst_root] [-p port] [-s threads]
                         hash=sha256, hash=sha1+sha512_256, hash=sha512_256
         --image-root    The path to the image whose file information will be
                         used as a cache for file data.
+        --index-jobs    The number of processes used to read package manifests
+                        when updating the search indexes.  The default value
+                        is 1.
         --log-access    The destination for any access related information
                         logged by the depot process.  Possible values are:
                         stderr, stdout, none, or an absolute pathname.  The
@@ -294,8 +298,9 @@ if __name__ == "__main__":
         try:
                 long_opts = ["add-content", "cfg=", "cfg-file=",
                     "content-root=", "debug=", "disable-ops=", "exit-ready",
-                    "help", "image-root=", "log-access=", "log-errors=",
-                    "llmirror", "mirror", "nasty=", "nasty-sleep=",
+                    "help", "image-root=", "index-jobs=", "log-access=",
+                    "log-errors=", "llmirror", "mirror", "nasty=",
+                    "nasty-sleep=",
                     "proxy-base=", "readonly", "rebuild", "refresh-index",
                     "set-property=", "ssl-cert-file=", "ssl-dialog=",
                     "ssl-key-file=", "sort-file-max-size=", "writable-root="]
@@ -378,6 +383,8 @@ if __name__ == "__main__":
                                 exit_ready = True
                         elif opt == "--image-root":
                                 ivalues["pkg"]["image_root"] = arg
+                        elif opt == "--index-jobs":
+                                ivalues["pkg"]["index_jobs"] = arg
                         elif opt.startswith("--log-"):
                                 prop = "log_{0}".format(opt.lstrip("--log-"))
                                 ivalues["pkg"][prop] = arg
@@ -855,9 +862,11 @@ if __name__ == "__main__":
         try:
                 sort_file_max_size = dconf.get_property("pkg",
                     "sort_file_max_size")
+                index_jobs = dconf.get_property("pkg", "index_jobs")
 
                 repo = sr.Repository(cfgpathname=repo_config_file,
-                    log_obj=cherrypy, mirror=mirror, properties=repo_props,
+                    index_jobs=index_jobs, log_obj=cherrypy, mirror=mirror,
+                    properties=repo_props,
                     read_only=readonly, root=inst_root,
                     sort_file_max_size=sort_file_max_size,
                     writable_root=writable_root)
@@ -96,6 +96,14 @@ class GlobalSettings(object):
                 except ValueError:
                         pass
 
+                # publisher metadata directory of the parent image when
+                # running as a linked image child; publisher catalogs already
+                # refreshed by the parent are used from here instead of being
+                # retrieved again.  remove it from the environment so that
+                # only direct children see it.
+                self.client_parent_catalog_root = os.environ.pop(
+                    "PKG_PARENT_CATALOG_ROOT", None)
+
                 self.client_name = None
                 self.client_args = sys.argv[:]
                 # Default maximum number of redirects received before
@@ -114,6 +122,9 @@ class GlobalSettings(object):
                 # Maximum number of transient errors before we abort an
                 # endpoint.
                 self.pkg_client_max_consecutive_error_default = 4
+                # Default number of processes used by the solver to evaluate
+                # candidate solutions; 1 means the solver runs serially.
+                self.pkg_solver_jobs_default = 1
 
                 # The location within the image of the cache for pkg.sysrepo(1M)
                 self.sysrepo_pub_cache_path = \
@@ -163,6 +174,14 @@ class GlobalSettings(object):
                 except ValueError:
                         self.PKG_CLIENT_MAX_REDIRECT = \
                             self.pkg_client_max_redirect_default
+                try:
+                        # Number of processes the solver may use to evaluate
+                        # candidate solutions concurrently.
+                        self.PKG_SOLVER_JOBS = max(1, int(
+                            os.environ.get("PKG_SOLVER_JOBS",
+                            self.pkg_solver_jobs_default)))
+                except ValueError:
+                        self.PKG_SOLVER_JOBS = self.pkg_solver_jobs_default
                 self.reset_logging()
 
         def __get_error_log_handler(self):
@@ -59,7 +59,6 @@ import copy
 import datetime
 import errno
 import fnmatch
-import glob
 import os
 import shutil
 import simplejson as json
@@ -2544,12 +2543,12 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 except ValueError as e:
                         raise apx.HistoryRequestException(e)
 
-        def __get_history_paths(self, time_val, utc_now):
+        def __get_history_paths(self, time_val, utc_now, all_entries):
                 """Given a local timestamp, either as a discrete value, or a
                 range of values, formatted as '<timestamp>-<timestamp>', and a
-                path to find history xml files, return an array of paths that
-                match that timestamp.  utc_now is the current time expressed in
-                UTC"""
+                sorted list of history filenames, return an array of filenames
+                that match that timestamp.  utc_now is the current time
+                expressed in UTC"""
 
                 files = []
                 if len(time_val) > 20 or time_val.startswith("now-"):
@@ -2568,27 +2567,29 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                                 raise apx.HistoryRequestException(_("Start "
                                     "time must be older than finish time: "
                                     "{0}").format(time_val))
-                        files = self.__get_history_range(start, finish)
+                        files = self.__get_history_range(start, finish,
+                            all_entries)
                 else:
                         # there can be multiple event files per timestamp
                         prefix = self.__utc_format(time_val, utc_now)
-                        files = glob.glob(os.path.join(self._img.history.path,
-                            "{0}*".format(prefix)))
+                        files = [
+                            entry for entry in all_entries
+                            if entry.startswith(prefix)
+                        ]
                 if not files:
                         raise apx.HistoryRequestException(_("No history "
                             "entries found for {0}").format(time_val))
                 return files
 
-        def __get_history_range(self, start, finish):
+        @staticmethod
+        def __get_history_range(start, finish, all_entries):
                 """Given a start and finish date, formatted as UTC date strings
-                as per __utc_format(), return a list of history filenames that
-                fall within that date range.  A range of two equal dates is
-                the equivalent of just retrieving history for that single date
-                string."""
+                as per __utc_format(), and a sorted list of history filenames,
+                return a list of history filenames that fall within that date
+                range.  A range of two equal dates is the equivalent of just
+                retrieving history for that single date string."""
 
                 entries = []
-                all_entries = sorted(os.listdir(self._img.history.path))
-
                 for entry in all_entries:
                         # our timestamps are always 16 character datestamps
                         basename = os.path.basename(entry)[:16]
@@ -2599,7 +2600,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                                 entries.append(entry)
                 return entries
 
-        def gen_history(self, limit=None, times=misc.EmptyI):
+        def gen_history(self, limit=None, times=misc.EmptyI, summary=False):
                 """A generator function that returns History objects up to the
                 limit specified matching the times specified.
 
@@ -2607,7 +2608,25 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 number of entries to return.
 
                 'times' is a list of timestamp or timestamp range strings to
-                restrict the returned entries to."""
+                restrict the returned entries to.
+
+                'summary' is an optional boolean value indicating that only the
+                operation's name, start and end time, result, boot environment
+                and client name are needed.  Entries recorded in the history
+                index are then returned without loading their history files."""
+
+                try:
+                        all_entries = sorted(os.listdir(
+                            self._img.history.path))
+                except EnvironmentError as e:
+                        if e.errno == errno.ENOENT:
+                                # No history to list.
+                                return
+                        raise apx._convert_error(e)
+
+                index = {}
+                if summary:
+                        index = self._img.history.load_index()
 
                 # Make entries a set to cope with multiple overlapping ranges or
                 # times.
@@ -2615,34 +2634,9 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                 utc_now = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
                 for time_val in times:
-                        # Ranges are 19 chars of timestamp, a '-', and
-                        # another timestamp.
-                        if len(time_val) > 20 or time_val.startswith("now-"):
-                                if time_val.startswith("now-"):
-                                        start = utc_now
-                                        finish = self.__utc_format(time_val[4:],
-                                            utc_now)
-                                else:
-                                        start = self.__utc_format(time_val[:19],
-                                            utc_now)
-                                        finish = self.__utc_format(
-                                            time_val[20:], utc_now)
-                                if start > finish:
-                                        raise apx.HistoryRequestException(
-                                            _("Start time must be older than "
-                                            "finish time: {0}").format(
-                                            time_val))
-                                files = self.__get_history_range(start, finish)
-                        else:
-                                # There can be multiple entries per timestamp.
-                                prefix = self.__utc_format(time_val, utc_now)
-                                files = glob.glob(os.path.join(
-                                    self._img.history.path, "{0}*".format(
-                                    prefix)))
-
                         try:
                                 files = self.__get_history_paths(time_val,
-                                    utc_now)
+                                    utc_now, all_entries)
                                 entries.update(files)
                         except ValueError:
                                 raise apx.HistoryRequestException(_("Invalid "
@@ -2652,13 +2646,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                                     "%Y-%m-%dT%H:%M:%S").format(time_val))
 
                 if not times:
-                        try:
-                                entries = os.listdir(self._img.history.path)
-                        except EnvironmentError as e:
-                                if e.errno == errno.ENOENT:
-                                        # No history to list.
-                                        return
-                                raise apx._convert_error(e)
+                        entries = all_entries
 
                 entries = sorted(entries)
                 if limit:
@@ -2675,7 +2663,8 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         try:
                                 yield history.History(
                                     root_dir=self._img.history.root_dir,
-                                    filename=entry, uuid_be_dic=uuid_be_dic)
+                                    filename=entry, uuid_be_dic=uuid_be_dic,
+                                    summary=index.get(entry))
                         except apx.HistoryLoadException as e:
                                 if e.parse_failure:
                                         # Ignore corrupt entries.
@@ -2906,6 +2895,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
                                 if not self._img.linked.nothingtodo():
                                         self._img.linked.syncmd()
+                                self._img.linked.save_digest()
                         except RuntimeError as e:
                                 if self.__new_be == True:
                                         be.restore_image()
@@ -4818,7 +4808,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
 
         @_LockedGenerator()
         def remote_search(self, query_str_and_args_lst, servers=None,
-            prune_versions=True):
+            prune_versions=True, use_cache=False):
                 """This function takes a list of Query objects, and optionally
                 a list of servers to search against.  It performs each query
                 against each server and yields the results in turn.  If no
@@ -4829,6 +4819,14 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 forms: the old deprecated form of a publisher, in a
                 dictionary, or a Publisher object.
 
+                If 'use_cache' is True, the responses of configured publisher
+                origins are cached in the image, keyed by origin, query, and
+                the last modification time of the publisher's catalog, and
+                repeated searches are answered from that cache.  Refreshing
+                the publisher's catalog therefore invalidates its entries.
+                Changes made to a repository since the publisher's catalog
+                was last refreshed are not reflected in cached results.
+
                 A call to this function returns a generator that holds
                 API locks.  Callers must either iterate through all of the
                 results, or call close() on the resulting object.  Otherwise
@@ -4882,7 +4880,7 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                                         pub = publisher.RepositoryURI(origin)
                                         repo = publisher.Repository(
                                             origins=[pub])
-                                slist.append((pub, repo, origin))
+                                slist.append((pub, repo, origin, None))
                                 continue
 
                         # Must be a publisher object.
@@ -4890,12 +4888,24 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         if not osets:
                                 continue
                         for repo in osets:
-                                slist.append((entry, repo, entry.prefix))
+                                slist.append((entry, repo, entry.prefix,
+                                    self.__search_cache_key(entry, repo,
+                                    query_str_and_args_lst, use_cache)))
 
-                for pub, alt_repo, descriptive_name in slist:
+                for pub, alt_repo, descriptive_name, cache_key in slist:
                         if self.__canceling:
                                 raise apx.CanceledException()
 
+                        res = None
+                        if cache_key:
+                                res = self._img.get_cached_search(cache_key)
+                        if res is not None:
+                                for ret in self.__filter_search_results(res,
+                                    pub, prune_versions, incorp_info,
+                                    inst_stems):
+                                        yield ret
+                                continue
+
                         try:
                                 res = self._img.transport.do_search(pub,
                                     query_str_and_args_lst,
@@ -4926,28 +4936,17 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                                 if not self.validate_response(res, 1):
                                         invalid.append(descriptive_name)
                                         continue
-                                for line in res:
-                                        pfmri, ret = self.__parse_v_1(line, pub,
-                                            1)
-                                        pstem = pfmri.pkg_name
-                                        pver = pfmri.version
-                                        # Skip this package if a newer version
-                                        # is already installed and version
-                                        # pruning is enabled.
-                                        if prune_versions and \
-                                            pstem in inst_stems and \
-                                            pver < inst_stems[pstem]:
-                                                continue
-                                        # Return this result if version pruning
-                                        # is disabled, the package is not
-                                        # incorporated, or the version of the
-                                        # package matches the incorporation.
-                                        if not prune_versions or \
-                                            pstem not in incorp_info or \
-                                            pfmri.version.is_successor(
-                                                incorp_info[pstem],
-                                                pkg.version.CONSTRAINT_AUTO):
-                                                yield ret
+                                lines = []
+                                if cache_key:
+                                        res = self.__record_lines(res, lines)
+                                for ret in self.__filter_search_results(res,
+                                    pub, prune_versions, incorp_info,
+                                    inst_stems):
+                                        yield ret
+                                # Only complete responses are cached.
+                                if cache_key:
+                                        self._img.cache_search(cache_key,
+                                            lines)
 
                         except apx.CanceledException:
                                 raise
@@ -4959,6 +4958,54 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                         raise apx.ProblematicSearchServers(failed,
                             invalid, unsupported)
 
+        @staticmethod
+        def __search_cache_key(pub, repo, queries, use_cache):
+                """Returns the string identifying the response of the origins
+                in 'repo' to 'queries' in the search cache, or None if the
+                response should not be cached."""
+
+                if not use_cache:
+                        return None
+                cat = pub.catalog
+                if not cat or not cat.last_modified:
+                        return None
+                return json.dumps([pub.prefix,
+                    sorted(str(o.uri) for o in repo.origins),
+                    [str(q) for q in queries],
+                    cat.last_modified.isoformat()])
+
+        @staticmethod
+        def __record_lines(res, lines):
+                """Yields each line of 'res' after appending it to 'lines'."""
+
+                for line in res:
+                        lines.append(line)
+                        yield line
+
+        def __filter_search_results(self, res, pub, prune_versions,
+            incorp_info, inst_stems):
+                """Parses the response lines in 'res' and yields the results
+                that are not pruned by the installed and incorporated versions
+                of packages."""
+
+                for line in res:
+                        pfmri, ret = self.__parse_v_1(line, pub, 1)
+                        pstem = pfmri.pkg_name
+                        pver = pfmri.version
+                        # Skip this package if a newer version is already
+                        # installed and version pruning is enabled.
+                        if prune_versions and pstem in inst_stems and \
+                            pver < inst_stems[pstem]:
+                                continue
+                        # Return this result if version pruning is disabled,
+                        # the package is not incorporated, or the version of
+                        # the package matches the incorporation.
+                        if not prune_versions or \
+                            pstem not in incorp_info or \
+                            pfmri.version.is_successor(incorp_info[pstem],
+                            pkg.version.CONSTRAINT_AUTO):
+                                yield ret
+
         def get_incorp_info(self):
                 """This function returns a mapping of package stems to the
                 version at which they are incorporated, if they are
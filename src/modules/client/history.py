@@ -28,8 +28,10 @@ import copy
 import errno
 import os
 import shutil
+import simplejson as json
 import six
 import sys
+import tempfile
 import traceback
 import xml.dom.minidom as xmini
 
@@ -79,6 +81,10 @@ RESULT_FAILED_UNKNOWN = ["Failed", "Unknown"]
 # Operations that are discarded, not saved, when recorded by history.
 DISCARDED_OPERATIONS = ["contents", "info", "list"]
 
+# The name of the file, kept alongside the history directory, that indexes the
+# operations recorded in it.
+INDEX_FILE = "history.index.v1"
+
 # Cross-reference table for errors and results.  Entries should be ordered
 # most-specific to least-specific.
 error_results = {
@@ -388,7 +394,8 @@ class History(object):
                         # Discard it now that it is no longer needed.
                         del ops[-1]
 
-        def __init__(self, root_dir=".", filename=None, uuid_be_dic=None):
+        def __init__(self, root_dir=".", filename=None, uuid_be_dic=None,
+            summary=None):
                 """'root_dir' should be the path of the directory where the
                 history directory can be found (or created if it doesn't
                 exist).  'filename' should be the name of an XML file
@@ -397,6 +404,9 @@ class History(object):
                 information, as produced by
                 pkg.client.bootenv.BootEnv.get_uuid_be_dic(), otherwise that
                 method is called each time a History object is created.
+                'summary', if supplied, should be the record for 'filename'
+                returned by load_index(); only the information it contains is
+                loaded and the XML file is not read.
                 """
                 # Since this is a read-only attribute normally, we have to
                 # bypass our setattr override by calling object.
@@ -407,7 +417,10 @@ class History(object):
                 self.client_name = pkg.client.global_settings.client_name
 
                 self.root_dir = root_dir
-                if filename:
+                if filename and summary:
+                        self.__load_summary(filename, summary,
+                            uuid_be_dic=uuid_be_dic)
+                elif filename:
                         self.__load(filename, uuid_be_dic=uuid_be_dic)
 
         def __str__(self):
@@ -421,6 +434,12 @@ class History(object):
                 """
                 return os.path.join(self.root_dir, "history")
 
+        @property
+        def index_path(self):
+                """The pathname of the index of the operations found in the
+                history directory."""
+                return os.path.join(self.root_dir, INDEX_FILE)
+
         @property
         def pathname(self):
                 """Returns the pathname that the history information was read
@@ -582,6 +601,39 @@ class History(object):
                 except Exception as e:
                         raise apx.HistoryLoadException(e)
 
+        def __load_summary(self, filename, rec, uuid_be_dic=None):
+                """Loads the summary of the operation stored in the file
+                self.path/{filename} from its history index record 'rec'."""
+
+                # Ensure all previous information is discarded.
+                self.clear()
+
+                try:
+                        if not uuid_be_dic:
+                                uuid_be_dic = bootenv.BootEnv.get_uuid_be_dic()
+                except apx.ApiException:
+                        uuid_be_dic = {}
+
+                fname, start_time, end_time, name, result, be, be_uuid, \
+                    client_name = rec
+                self.client_name = client_name
+
+                op = _HistoryOperation()
+                op.name = name
+                op.start_time = start_time
+                op.end_time = end_time
+                op.result = result.split(", ")
+                if len(op.result) == 1:
+                        op.result.append("None")
+                op.be = be
+                op.be_uuid = be_uuid
+                if be and be_uuid:
+                        op.current_be = uuid_be_dic.get(be_uuid, be)
+                self.__operations.append({
+                    "pathname": os.path.join(self.path, filename),
+                    "operation": op
+                })
+
         def __serialize_client_data(self, d):
                 """Internal function used to serialize current client data
                 using the supplied 'd' (xml.dom.minidom) object.
@@ -713,6 +765,7 @@ class History(object):
                                 d.writexml(f,
                                     encoding=sys.getdefaultencoding())
                                 f.close()
+                                self.__append_index(pathname)
                                 return
                         except EnvironmentError as e:
                                 if e.errno == errno.EEXIST:
@@ -740,6 +793,101 @@ class History(object):
                         except Exception as e:
                                 raise apx.HistoryStoreException(e)
 
+        def __append_index(self, pathname):
+                """Appends a record describing the current operation, which was
+                just written to 'pathname', to the index.  If there is no index
+                yet, it is first created with records for the operations
+                already in the history directory."""
+
+                rec = [os.path.basename(pathname), self.operation_start_time,
+                    self.operation_end_time, self.operation_name,
+                    ", ".join(self.operation_result), self.operation_be,
+                    self.operation_be_uuid, self.client_name]
+                try:
+                        if not os.path.exists(self.index_path):
+                                self.__create_index(rec[0])
+                        with open(self.index_path, "a") as f:
+                                f.write(json.dumps(rec) + "\n")
+                except EnvironmentError:
+                        # The XML files are authoritative; operations missing
+                        # from the index are loaded from them instead.
+                        pass
+
+        def __create_index(self, exclude):
+                """Creates the index with records for every operation in the
+                history directory other than the one stored in the file
+                'exclude'.  This only happens once for each image, as the
+                first operation is saved by a client that maintains the index,
+                and operations are saved with the image locked."""
+
+                names = sorted(
+                    n for n in os.listdir(self.path)
+                    if n.endswith(".xml") and n != exclude
+                )
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self.index_path))
+                try:
+                        os.fchmod(fd, misc.PKG_FILE_MODE)
+                        with os.fdopen(fd, "w") as f:
+                                for n in names:
+                                        rec = self.__index_record(n)
+                                        if rec:
+                                                f.write(json.dumps(rec) + "\n")
+                        portable.rename(tmp_path, self.index_path)
+                except:
+                        portable.remove(tmp_path)
+                        raise
+
+        def __index_record(self, filename):
+                """Returns the index record for the operation stored in the
+                history file 'filename', or None if it can't be parsed."""
+
+                try:
+                        d = xmini.parse(os.path.join(self.path, filename))
+                        root = d.documentElement
+                        client = root.getElementsByTagName("client")[0]
+                        op = root.getElementsByTagName("operation")[0]
+                except KeyboardInterrupt:
+                        raise
+                except Exception:
+                        return None
+                return [filename, op.getAttribute("start_time"),
+                    op.getAttribute("end_time"), op.getAttribute("name"),
+                    op.getAttribute("result"), op.getAttribute("be") or None,
+                    op.getAttribute("be_uuid") or None,
+                    client.getAttribute("name")]
+
+        def load_index(self):
+                """Returns a dictionary mapping the names of files in the
+                history directory to the records the index holds for them.
+                Each record is a list of the form [filename, start_time,
+                end_time, name, result, be, be_uuid, client_name], which is
+                enough to summarize the operation without reading its XML
+                file.
+
+                A record is appended to the index as each operation is saved,
+                so operations saved by older clients since the index was
+                created, or when it could not be written, have no record; it
+                may also have records for files that have since been
+                removed."""
+
+                recs = {}
+                try:
+                        with open(self.index_path, "r") as f:
+                                for l in f:
+                                        try:
+                                                rec = json.loads(l)
+                                        except ValueError:
+                                                # Ignore a truncated record.
+                                                continue
+                                        if isinstance(rec, list) and \
+                                            len(rec) == 8:
+                                                recs[rec[0]] = rec
+                except EnvironmentError:
+                        # The index is only an optimization.
+                        pass
+                return recs
+
         def purge(self, be_name=None, be_uuid=None):
                 """Removes all history information by deleting the directory
                 indicated by the value self.path and then creates a new history
@@ -751,6 +899,7 @@ class History(object):
 
                 try:
                         shutil.rmtree(self.path)
+                        portable.remove(self.index_path)
                 except KeyboardInterrupt:
                         raise
                 except EnvironmentError as e:
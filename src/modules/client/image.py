@@ -89,6 +89,10 @@ img_root_prefix = "var/pkg"
 
 IMG_PUB_DIR = "publisher"
 
+# The maximum number of bytes of remote search results kept in the image's
+# search cache before the least recently used entries are discarded.
+SEARCH_CACHE_MAX_SIZE = 8 * 1024 * 1024
+
 class Image(object):
         """An Image object is a directory tree containing the laid-down contents
         of a self-consistent graph of Packages.
@@ -383,6 +387,98 @@ in the environment or by setting simulate_cmdpath in DebugValues.""")
                 return self.__user_cache_dir or \
                     os.path.join(self.imgdir, IMG_PUB_DIR)
 
+        @property
+        def search_cache_dir(self):
+                """The path to the directory that holds cached remote search
+                results."""
+
+                return os.path.join(self.__action_cache_dir, "search")
+
+        @property
+        def solver_cache_dir(self):
+                """The path to the directory that holds the catalog data cached
+                by the package solver, or None if alternate package sources
+                are in use.  Their packages are merged into the known catalog
+                only in memory, so data derived from it must not be cached."""
+
+                if self.__alt_pkg_pub_map:
+                        return None
+                return os.path.join(self.__action_cache_dir, "solver")
+
+        def __search_cache_path(self, key):
+                """Returns the path of the search cache entry for 'key'."""
+
+                return os.path.join(self.search_cache_dir,
+                    hashlib.sha1(misc.force_bytes(key)).hexdigest())
+
+        def get_cached_search(self, key):
+                """Returns the list of response lines cached for the remote
+                search identified by the string 'key', or None if no such
+                entry exists.  A successful lookup marks the entry as recently
+                used."""
+
+                path = self.__search_cache_path(key)
+                try:
+                        with open(path, "rb") as f:
+                                # The first line holds the key itself so that
+                                # hash collisions are never returned as hits.
+                                if misc.force_str(f.readline()) != \
+                                    key + "\n":
+                                        return None
+                                lines = [misc.force_str(l) for l in f]
+                        os.utime(path, None)
+                except EnvironmentError as e:
+                        if e.errno in (errno.ENOENT, errno.EACCES,
+                            errno.EROFS):
+                                return None
+                        raise
+                return lines
+
+        def cache_search(self, key, lines):
+                """Stores the response lines of the remote search identified by
+                the string 'key' in the search cache, discarding the least
+                recently used entries if the cache has grown beyond
+                SEARCH_CACHE_MAX_SIZE bytes.  Failures due to permissions or a
+                read-only filesystem are ignored."""
+
+                cdir = self.search_cache_dir
+                tmp = None
+                try:
+                        if not os.path.exists(cdir):
+                                os.makedirs(cdir)
+                        fd, tmp = tempfile.mkstemp(prefix=".tmp", dir=cdir)
+                        with os.fdopen(fd, "wb") as f:
+                                f.write(misc.force_bytes(key + "\n"))
+                                for l in lines:
+                                        f.write(misc.force_bytes(l))
+                        portable.rename(tmp, self.__search_cache_path(key))
+                        tmp = None
+
+                        entries = []
+                        total = 0
+                        for name in os.listdir(cdir):
+                                if name.startswith(".tmp"):
+                                        continue
+                                path = os.path.join(cdir, name)
+                                st = os.stat(path)
+                                entries.append((st.st_mtime, st.st_size, path))
+                                total += st.st_size
+                        entries.sort()
+                        while entries and total > SEARCH_CACHE_MAX_SIZE:
+                                mtime, size, path = entries.pop(0)
+                                portable.remove(path)
+                                total -= size
+                except EnvironmentError as e:
+                        if e.errno not in (errno.ENOENT, errno.EACCES,
+                            errno.EROFS):
+                                raise
+                finally:
+                        if tmp:
+                                try:
+                                        os.unlink(tmp)
+                                except EnvironmentError:
+                                        pass
+
         @contextmanager
         def locked_op(self, op, allow_unprivileged=False, new_history_op=True):
                 """Helper method for executing an image-modifying operation
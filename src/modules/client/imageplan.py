@@ -649,7 +649,9 @@ class ImagePlan(object):
                             variants,
                             avoid_set,
                             self.image.linked.parent_fmris(),
-                            self.__progtrack)
+                            self.__progtrack,
+                            cache_dir=self.image.solver_cache_dir,
+                            jobs=global_settings.PKG_SOLVER_JOBS)
 
                         if reject_set:
                                 self.__set_pkg_actuators(reject_set,
@@ -1237,7 +1239,9 @@ class ImagePlan(object):
                             self.image.get_variants(),
                             self.image.avoid_set_get(),
                             self.image.linked.parent_fmris(),
-                            self.__progtrack)
+                            self.__progtrack,
+                            cache_dir=self.image.solver_cache_dir,
+                            jobs=global_settings.PKG_SOLVER_JOBS)
 
                         # check for triggered ops
                         self.__set_pkg_actuators(pkgs_to_uninstall,
@@ -1313,7 +1317,9 @@ class ImagePlan(object):
                             self.image.get_variants(),
                             self.image.avoid_set_get(),
                             self.image.linked.parent_fmris(),
-                            self.__progtrack)
+                            self.__progtrack,
+                            cache_dir=self.image.solver_cache_dir,
+                            jobs=global_settings.PKG_SOLVER_JOBS)
 
                         if reject_set:
                                 self.__set_pkg_actuators(reject_set,
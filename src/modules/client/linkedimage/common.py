@@ -43,6 +43,8 @@ are also defined here:
 # standard python classes
 import collections
 import copy
+import errno
+import hashlib
 import operator
 import os
 import select
@@ -124,6 +126,21 @@ PATH_PFACETS    = os.path.join(__DATA_DIR, "linked_pfacets")
 PATH_PPKGS     = os.path.join(__DATA_DIR, "linked_ppkgs")
 PATH_PROP      = os.path.join(__DATA_DIR, "linked_prop")
 PATH_PUBS      = os.path.join(__DATA_DIR, "linked_ppubs")
+PATH_DIGEST    = os.path.join(__DATA_DIR, "linked_digest")
+
+# files which describe an image's linked image data, configuration, and
+# installed packages.  a digest of their contents is saved (in PATH_DIGEST)
+# so that we can tell if an image has changed since we last checked if it
+# was in sync.
+STATE_PATHS = [
+    PATH_PFACETS,
+    PATH_PPKGS,
+    PATH_PROP,
+    PATH_PUBS,
+    "pkg5.image",
+    "cfg_cache",
+    os.path.join("state", "installed", "catalog.attrs"),
+]
 
 #
 # we define PATH_TRANSFORM_NONE as a tuple instead of just None because this
@@ -463,8 +480,14 @@ class LinkedImage(object):
                 self.__path_prop = None
                 self.__path_ppubs = None
                 self.__path_pfacets = None
+                self.__path_digest = None
+                self.__paths_state = None
                 self.__img_insync = True
 
+                # encoding of the parent metadata most recently pushed to our
+                # children, see pmd_encode()
+                self.__pmd_enc = None
+
                 # initialize with no properties
                 self.__update_props()
 
@@ -511,6 +534,11 @@ class LinkedImage(object):
                 self.__path_prop = os.path.join(imgdir, PATH_PROP)
                 self.__path_ppubs = os.path.join(imgdir, PATH_PUBS)
                 self.__path_pfacets = os.path.join(imgdir, PATH_PFACETS)
+                self.__path_digest = os.path.join(imgdir, PATH_DIGEST)
+                self.__paths_state = [
+                    os.path.join(imgdir, path)
+                    for path in STATE_PATHS
+                ]
 
                 # if this isn't a reset, then load data from the image
                 if first_pass:
@@ -970,6 +998,7 @@ class LinkedImage(object):
                         # if any linked image metadata files exist they need
                         # to be deleted.
                         paths = [
+                            self.__path_digest,
                             self.__path_pfacets,
                             self.__path_ppkgs,
                             self.__path_ppubs,
@@ -1109,6 +1138,10 @@ class LinkedImage(object):
         def syncmd(self):
                 """Write in-memory linked image state to disk."""
 
+                # our saved state digest is out of date once we write new
+                # data, see save_digest().
+                path_unlink(self.__path_digest, noent_ok=True)
+
                 # create a list of metadata file paths
                 paths = [
                     self.__path_pfacets,
@@ -1489,7 +1522,25 @@ class LinkedImage(object):
                 self.__update_props(props)
 
         def __insync(self):
-                """Determine if an image is in sync with its constraints."""
+                """Determine if an image is in sync with its constraints.  If
+                neither our linked image metadata nor our installed packages
+                have changed since save_digest() was last called, then we
+                return the result it saved."""
+
+                assert self.ischild()
+
+                digest = load_digest(self.__path_digest)
+                if digest is not None and \
+                    digest.get("md") == self.__md_digest():
+                        state = state_digest("/", self.__paths_state)
+                        if state is not None and digest.get("state") == state:
+                                return digest.get("insync") is True
+
+                return self.__insync_check()
+
+        def __insync_check(self):
+                """Determine if an image is in sync with its constraints by
+                comparing its installed packages with those in its parent."""
 
                 assert self.ischild()
 
@@ -1532,6 +1583,54 @@ class LinkedImage(object):
                                 return False
                 return True
 
+        def __md_digest(self):
+                """Return a digest of our in-memory linked image metadata.
+                This matches the digest our parent computes for the metadata
+                it pushes to us, see LinkedImageChild`__md_digest()."""
+
+                props = rm_dict_ent(self.__props, temporal_props)
+                return md_digest(props,
+                    md_encode((self.__ppubs, self.__ppkgs, self.__pfacets)))
+
+        def pmd_encode(self, pmd):
+                """Return the encoding of the parent metadata tuple 'pmd'
+                used to compute digests of the linked image metadata pushed
+                to our children.  The same metadata is pushed to all our
+                children, so we only encode it once."""
+
+                if self.__pmd_enc is None or self.__pmd_enc[0] is not pmd:
+                        self.__pmd_enc = (pmd, md_encode(pmd))
+                return self.__pmd_enc[1]
+
+        def save_digest(self):
+                """Save a digest of our linked image metadata and of the
+                files which describe our linked image metadata and installed
+                packages, along with whether we're currently in sync with our
+                parent.  This is done after we execute an operation so that
+                subsequent audits of this image, by ourselves or our parent,
+                can skip comparing our installed packages with our parent's
+                if nothing has changed."""
+
+                state = None
+                if self.ischild():
+                        state = state_digest("/", self.__paths_state)
+                if state is None:
+                        path_unlink(self.__path_digest, noent_ok=True)
+                        return
+
+                digest = {
+                    "md": self.__md_digest(),
+                    "state": state,
+                    "insync": self.__insync_check(),
+                }
+
+                # the digest is only an optimization, so don't fail the
+                # operation if we can't save it.
+                try:
+                        save_data(self.__path_digest, digest)
+                except (apx.ApiException, EnvironmentError):
+                        pass
+
         def audit_self(self, latest_md=True):
                 """If the current image is a child image, this function
                 audits the current image to see if it's in sync with its
@@ -2345,6 +2444,11 @@ class LinkedImage(object):
                 """Initialize child objects used during recursive packaging
                 operations."""
 
+                # shut down any "pkg remote" processes left running for the
+                # children of a previous operation.
+                for lic in six.itervalues(self.__lic_dict):
+                        lic.child_op_fini()
+
                 self.__lic_ignore = li_ignore
                 self.__lic_dict = self.__children_init(li_ignore=li_ignore)
 
@@ -2744,12 +2848,25 @@ class LinkedImageChild(object):
                 self.__path_prop = os.path.join(imgdir, PATH_PROP)
                 self.__path_ppubs = os.path.join(imgdir, PATH_PUBS)
                 self.__path_pfacets = os.path.join(imgdir, PATH_PFACETS)
+                self.__path_digest = os.path.join(imgdir, PATH_DIGEST)
+                self.__paths_state = [
+                    os.path.join(imgdir, path)
+                    for path in STATE_PATHS
+                ]
 
                 # initialize a linked image child plugin
                 self.__plugin = \
                     pkg.client.linkedimage.p_classes_child[lin.lin_type](self)
 
-                self.__pkg_remote = pkg.client.pkgremote.PkgRemote()
+                # Children with the same publisher configuration as ours
+                # can use the catalogs we've already refreshed.
+                # W0212 Access to a protected member
+                # pylint: disable=W0212
+                catalog_root = os.path.join(self.__img.imgdir,
+                    self.__img._get_publisher_meta_dir())
+                # pylint: enable=W0212
+                self.__pkg_remote = pkg.client.pkgremote.PkgRemote(
+                    catalog_root=catalog_root)
                 self.__child_op_rvtuple = None
                 self.__child_op = None
 
@@ -2855,6 +2972,13 @@ class LinkedImageChild(object):
                 linked image metadata files, or if we should access temporary
                 versions (which have ".<runid>" appended to them."""
 
+                return self.__push_data(self.child_path, self.__path_prop,
+                    self.__pushed_props(), tmp, test)
+
+        def __pushed_props(self):
+                """Return the linked image properties we push to a child
+                image."""
+
                 # make a copy of the props we want to push
                 props = self.__props.copy()
                 assert PROP_PARENT_PATH not in props
@@ -2862,9 +2986,7 @@ class LinkedImageChild(object):
                 self.__plugin.munge_props(props)
 
                 # delete temporal properties
-                props = rm_dict_ent(props, temporal_props)
-                return self.__push_data(self.child_path, self.__path_prop,
-                    props, tmp, test)
+                return rm_dict_ent(props, temporal_props)
 
         def __push_ppubs(self, ppubs, tmp=False, test=False):
                 """Sync linked image parent publisher data to a child image.
@@ -2883,6 +3005,11 @@ class LinkedImageChild(object):
                 linked image metadata files, or if we should access temporary
                 versions (which have ".<runid>" appended to them."""
 
+                # if the child saved a digest of the metadata we're about to
+                # push, and it hasn't changed since, then it isn't changing.
+                if self.__digest_valid(pmd) is not None:
+                        return False
+
                 # unpack parent metadata tuple
                 ppubs, ppkgs, pfacets = pmd
 
@@ -2894,6 +3021,39 @@ class LinkedImageChild(object):
                 return (props_updated or ppkgs_updated or pubs_updated or
                     pfacets_updated)
 
+        def __md_digest(self, pmd):
+                """Return a digest of the linked image metadata we push to a
+                child image.  This matches the digest the child computes for
+                its metadata, see LinkedImage`__md_digest()."""
+
+                return md_digest(self.__pushed_props(),
+                    self.__linked.pmd_encode(pmd))
+
+        def __digest_valid(self, pmd):
+                """If a child image saved a digest of the linked image
+                metadata we push to it (in 'pmd'), and neither that metadata
+                nor its installed packages have changed since, return the
+                saved digest.  Otherwise return None."""
+
+                digest = load_digest(self.__path_digest, root=self.child_path)
+                if digest is None or \
+                    digest.get("md") != self.__md_digest(pmd):
+                        return None
+
+                state = state_digest(self.child_path, self.__paths_state)
+                if state is None or digest.get("state") != state:
+                        return None
+                return digest
+
+        def __insync(self, pmd):
+                """Check if a child image saved a digest which shows that it
+                is in sync with the linked image metadata we push to it (in
+                'pmd').  This lets us avoid recursing into the child to audit
+                it."""
+
+                digest = self.__digest_valid(pmd)
+                return digest is not None and digest.get("insync") is True
+
         def __child_op_setup_syncmd(self, pmd, ignore_syncmd_nop=True,
             tmp=False, test=False, stage=pkgdefs.API_STAGE_DEFAULT):
                 """Prepare to perform an operation on a child image by syncing
@@ -3225,6 +3385,12 @@ class LinkedImageChild(object):
                         # the update failed
                         return
 
+                # check if the child can tell us it's in sync
+                if self.__insync(_pmd):
+                        self.__child_op_rvtuple = \
+                            LI_RVTuple(pkgdefs.EXIT_OK, None, None)
+                        return
+
                 # setup recursion into the child image
                 self.__pkg_remote.setup(self.child_path,
                     pkgdefs.PKG_OP_AUDIT_LINKED,
@@ -3241,6 +3407,13 @@ class LinkedImageChild(object):
                 self.__child_op_rvtuple = None
                 self.__child_op = None
 
+        def child_op_fini(self):
+                """Public interface to release the process kept running to
+                perform the remaining stages of an operation on a child
+                image."""
+
+                self.__pkg_remote.close()
+
         def child_op_setup(self, _pkg_op, _pmd, _progtrack, _ignore_syncmd_nop,
             _syncmd_tmp, **kwargs):
                 """Public interface to setup an operation that we'd like to
@@ -3600,6 +3773,61 @@ def save_data(path, data, root="/", catch_exception=True):
                         raise apx._convert_error(e)
                 raise e
 
+def md_encode(md):
+        """Encode a sequence of linked image metadata in a canonical form
+        that can be used to compute digests.  Each piece of metadata is
+        normalized the same way LinkedImageChild`__push_data() does before it
+        compares metadata, so metadata it considers equal encodes the
+        same."""
+
+        rv = []
+        for data in md:
+                data = json.loads(json.dumps(data,
+                    cls=pkg.client.linkedimage.PkgEncoder))
+                if isinstance(data, list):
+                        data = sorted(data)
+                rv.append(json.dumps(data, sort_keys=True))
+        return misc.force_bytes("\n".join(rv))
+
+def md_digest(props, pmd_enc):
+        """Return a digest of a child image's linked image properties and the
+        encoded parent metadata (see md_encode()) saved in it."""
+
+        h = hashlib.sha1(md_encode([props]))
+        h.update(b"\n")
+        h.update(pmd_enc)
+        return h.hexdigest()
+
+def state_digest(root, paths):
+        """Return a digest of the contents of the files in an image which
+        describe its configuration and installed packages (STATE_PATHS).  If
+        any of them can't be read return None."""
+
+        h = hashlib.sha1()
+        for path in paths:
+                try:
+                        fd = ar.ar_open(root, path, os.O_RDONLY)
+                        with os.fdopen(fd, "rb") as fobj:
+                                h.update(hashlib.sha1(fobj.read()).digest())
+                except OSError as e:
+                        if e.errno != errno.ENOENT:
+                                return None
+                        h.update(b"\0")
+        return h.hexdigest()
+
+def load_digest(path, root="/"):
+        """Load a digest saved by LinkedImage`save_digest().  If it's missing
+        or can't be read return None."""
+
+        try:
+                digest = load_data(path, missing_ok=True, root=root,
+                    decode=False)
+        except (apx.ApiException, EnvironmentError, ValueError):
+                return None
+        if not isinstance(digest, dict):
+                return None
+        return digest
+
 def load_data(path, missing_ok=False, root="/", decode=True,
     catch_exception=False):
         """Load JSON encoded linked image metadata from a file."""
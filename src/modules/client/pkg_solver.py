@@ -27,8 +27,13 @@
 """Provides the interfaces and exceptions needed to determine which packages
 should be installed, updated, or removed to perform a requested operation."""
 
+import errno
+import hashlib
 import operator
+import os
+import simplejson as json
 import six
+import tempfile
 import time
 
 import pkg.actions
@@ -38,6 +43,7 @@ import pkg.client.api_errors as api_errors
 import pkg.client.image
 import pkg.fmri
 import pkg.misc as misc
+import pkg.portable as portable
 import pkg.solver
 import pkg.version           as version
 
@@ -87,6 +93,63 @@ _TRIM_EXPLICIT_INSTALL = 22        # pkg.depend.explicit-install is true.
 _TRIM_SYNCED_INC = 23              # incorporation must be in sync with parent
 _TRIM_MAX = 24                     # number of trim constants
 
+# The name of the file in the solver cache directory that holds the data
+# derived from the catalog by previous solver runs.
+_INPUT_CACHE_FILE = "inputs.v3"
+
+# The maximum number of candidate solutions evaluated in each iteration of the
+# solver when more than one job is allowed.  This is deliberately independent
+# of the number of jobs so that the solution found is too.
+_MAX_CANDIDATES = 16
+
+# The solver inherited by the worker processes evaluating candidate solutions,
+# and the number of clauses added by the parent since the worker was started
+# that have been applied to it.
+_candidate_solver = None
+_candidate_applied = 0
+
+def _candidate_init(solver):
+        """Initializer for worker processes evaluating candidate solutions;
+        'solver' is inherited from the parent rather than pickled."""
+
+        global _candidate_solver
+        _candidate_solver = solver
+
+def _candidate_solve(args):
+        """Solves the clauses of the worker's solver along with the unit clause
+        'lit'.  'args' is a tuple of the form (offset, clauses, lit), where
+        'clauses' are the clauses the parent has added since the worker was
+        started, beginning with the one numbered 'offset'; those not yet
+        applied to the worker's solver are added to it first.
+
+        Returns a tuple of (pid, applied, vector), where 'pid' is the process
+        id of the worker, 'applied' is the number of clauses it has applied,
+        and 'vector' is the solution as a list of variable ids or None if
+        there is no such solution."""
+
+        global _candidate_solver, _candidate_applied
+
+        offset, clauses, lit = args
+        for c in clauses[_candidate_applied - offset:]:
+                _candidate_applied += 1
+                if _candidate_solver is not None and \
+                    not _candidate_solver.add_clause(c):
+                        # The parent's solver has failed the same way, so
+                        # there will be no further candidates to evaluate.
+                        _candidate_solver = None
+
+        vector = None
+        if _candidate_solver is not None:
+                # A failed solve leaves the solver unusable, so each candidate
+                # is evaluated using a copy.
+                solver = pkg.solver.msat_solver(_candidate_solver)
+                if solver.add_clause([lit]) and solver.solve([]):
+                        vector = [
+                            (i + 1) for i in range(solver.get_variables())
+                            if solver.dereference(i)
+                        ]
+        return os.getpid(), _candidate_applied, vector
+
 
 class DependencyException(Exception):
         """local exception used to pass failure to match
@@ -120,13 +183,18 @@ class PkgSolver(object):
         operation."""
 
         def __init__(self, cat, installed_dict, pub_ranks, variants, avoids,
-            parent_pkgs, progtrack):
+            parent_pkgs, progtrack, cache_dir=None, jobs=1):
                 """Create a PkgSolver instance; catalog should contain all
                 known pkgs, installed fmris should be a dict of fmris indexed
                 by name that define pkgs current installed in the image.
                 Pub_ranks dict contains (rank, stickiness, enabled) for each
                 publisher.  variants are the current image variants; avoids is
-                the set of pkg stems being avoided in the image."""
+                the set of pkg stems being avoided in the image.  cache_dir,
+                if provided, is the directory where the catalog dependency
+                data used by the solver is cached between runs for the same
+                catalog.  jobs is the maximum number of processes used to
+                evaluate candidate solutions concurrently; if it is 1, the
+                solver runs serially."""
 
                 # check if we're allowed to use the solver
                 if DebugValues["no_solver"]:
@@ -165,6 +233,7 @@ class PkgSolver(object):
                 self.__fmri2id = {}             # and reverse
 
                 self.__solver = pkg.solver.msat_solver()
+                self.__jobs = jobs
 
                 self.__progtrack = progtrack    # progress tracker
                 self.__progitem = None          # progress tracker plan item
@@ -231,6 +300,29 @@ class PkgSolver(object):
                 self.__dg_incorp_cache = {}        # cache for downgradable
                                                    # incorp deps
 
+                self.__explicit_dict = {}       # fmri -> explicit install
+                self.__vmatch_cache = {}        # (fmri, constraint) -> set of
+                                                # fmris with matching versions
+
+                self.__cache_dir = cache_dir    # persistent input cache
+                self.__input_matches = {}       # constraint and fmri string ->
+                                                # stem digest, matching fmri
+                                                # strings
+                self.__input_states = {}        # fmri string -> obsolete,
+                                                # renamed
+                self.__input_variants = {}      # fmri string -> variants
+                self.__input_explicit = {}      # fmri string -> explicit
+                                                # install
+                self.__input_keys = {}          # fmri -> fmri string
+                self.__input_stems = {}         # pkg name -> stem digest
+                self.__input_hits = 0
+                self.__input_misses = 0
+                self.__input_signature = None
+                if cache_dir:
+                        self.__input_signature = \
+                            self.__input_cache_signature()
+                        self.__load_input_cache()
+
         def __str__(self):
                 s = "Solver: ["
                 if self.__state in [SOLVER_FAIL, SOLVER_SUCCESS]:
@@ -253,14 +345,129 @@ class PkgSolver(object):
 
                 s += "\nMaintained incorporations: {0}\n".format(incs)
 
+                if self.__cache_dir:
+                        s += ("Input cache: [ Hits: {0:d} Misses: {1:d} ]"
+                            "\n").format(self.__input_hits,
+                            self.__input_misses)
+
                 return s
 
+        def get_stats(self):
+                """Returns a dictionary of statistics about the solver: its
+                state, the number of variables and clauses given to the SAT
+                solver, the number of solutions iterated over, and a list of
+                (subphase, seconds) tuples for each completed subphase."""
+
+                return {
+                    "state": self.__state,
+                    "variables": self.__variables,
+                    "clauses": self.__clauses,
+                    "iterations": self.__iterations,
+                    "timings": list(self.__timings),
+                }
+
+        def __input_cache_signature(self):
+                """Returns the value identifying the state of the catalog and
+                the image variants for which entries in the input cache are
+                valid.  This is determined when the solver is created since
+                the variants may be changed by the requested operation."""
+
+                return [str(self.__catalog.created),
+                    str(self.__catalog.last_modified),
+                    [[k, v] for k, v in sorted(self.__variants.items())]]
+
+        def __input_key(self, fmri):
+                """Returns the string identifying 'fmri' in the input
+                cache."""
+
+                try:
+                        return self.__input_keys[fmri]
+                except KeyError:
+                        key = fmri.get_fmri(anarchy=False)
+                        self.__input_keys[fmri] = key
+                        return key
+
+        def __input_stem_digest(self, pkg_name):
+                """Returns a digest of the fmris in the catalog for 'pkg_name'
+                so that cached version matches are only used for the same list
+                of versions."""
+
+                try:
+                        return self.__input_stems[pkg_name]
+                except KeyError:
+                        pass
+
+                h = hashlib.sha1()
+                for ver, fmris in self.__get_fmris_by_version(pkg_name):
+                        for f in fmris:
+                                h.update(misc.force_bytes(
+                                    self.__input_key(f) + "\n"))
+                self.__input_stems[pkg_name] = h.hexdigest()
+                return self.__input_stems[pkg_name]
+
+        def __load_input_cache(self):
+                """Load the dependency matches, package states, variants and
+                explicit install settings derived from the catalog by earlier
+                solver runs for the current catalog and variants, if any."""
+
+                try:
+                        with open(os.path.join(self.__cache_dir,
+                            _INPUT_CACHE_FILE), "r") as f:
+                                data = json.load(f)
+                except (EnvironmentError, ValueError):
+                        # Missing or damaged; it will be rewritten.
+                        return
+
+                if isinstance(data, dict) and \
+                    data.get("signature") == self.__input_signature:
+                        self.__input_matches = data.get("matches", {})
+                        self.__input_states = data.get("states", {})
+                        self.__input_variants = data.get("variants", {})
+                        self.__input_explicit = data.get("explicit", {})
+
+        def __save_input_cache(self):
+                """Write the data derived from the catalog during this run to
+                the input cache so that later runs for the same catalog and
+                variants can avoid deriving it again.  Failures are ignored
+                since the cache is only an optimization."""
+
+                if not self.__cache_dir or not self.__input_misses:
+                        return
+
+                tmp = None
+                try:
+                        if not os.path.exists(self.__cache_dir):
+                                os.makedirs(self.__cache_dir)
+                        fd, tmp = tempfile.mkstemp(dir=self.__cache_dir)
+                        with os.fdopen(fd, "w") as f:
+                                json.dump({
+                                    "signature": self.__input_signature,
+                                    "matches": self.__input_matches,
+                                    "states": self.__input_states,
+                                    "variants": self.__input_variants,
+                                    "explicit": self.__input_explicit,
+                                }, f)
+                        portable.rename(tmp, os.path.join(self.__cache_dir,
+                            _INPUT_CACHE_FILE))
+                        tmp = None
+                except EnvironmentError as e:
+                        if e.errno not in (errno.EACCES, errno.EROFS,
+                            errno.ENOENT, errno.ENOSPC):
+                                raise
+                finally:
+                        if tmp:
+                                try:
+                                        portable.remove(tmp)
+                                except EnvironmentError:
+                                        pass
+
         def __cleanup(self, rval):
                 """Discards all solver information except for that needed to
                 show failure information or to stringify the solver object.
                 This allows early garbage collection to take place, and should
                 be performed after a solution is successfully returned."""
 
+                self.__save_input_cache()
                 self.__catalog = None
                 self.__installed_dict = {}
                 self.__installed_pkgs = frozenset()
@@ -288,6 +495,14 @@ class PkgSolver(object):
                 self.__allowed_downgrades = None
                 self.__dg_incorp_cache = None
                 self.__linked_pkgs = set()
+                self.__explicit_dict = None
+                self.__vmatch_cache = None
+                self.__input_keys = None
+                self.__input_stems = None
+                self.__input_matches = None
+                self.__input_states = None
+                self.__input_variants = None
+                self.__input_explicit = None
 
                 if DebugValues["plan"]:
                         # Remaining data must be kept.
@@ -1440,38 +1655,77 @@ class PkgSolver(object):
 
         def __solve(self, older=False, max_iterations=2000):
                 """Perform iterative solution; try for newest pkgs unless
-                older=True"""
+                older=True.  If more than one job is allowed, every iteration
+                after the first that the serial solver can satisfy also tries
+                candidate solutions concurrently, and uses the serial solution
+                only if none of them can be satisfied.  The worker processes
+                are started once and each keeps its own solver up to date with
+                the clauses added by later iterations."""
                 solution_vector = []
                 self.__state = SOLVER_FAIL
                 eliminated = set()
-                while not self.__addclause_failure and self.__solver.solve([]):
-                        self.__progress()
-                        self.__iterations += 1
+                pool = None
+                # Clauses added since the worker processes were started, and
+                # the number of them each worker (by process id) has applied.
+                added = []
+                applied = {}
+                try:
+                        while not self.__addclause_failure:
+                                # No candidate can be satisfied if the serial
+                                # solver can't be, so it is always run first.
+                                if not self.__solver.solve([]):
+                                        break
 
-                        if self.__iterations > max_iterations:
-                                break
+                                candidate = None
+                                if solution_vector and self.__jobs > 1:
+                                        if pool is None:
+                                                pool = misc.get_process_pool(
+                                                    self.__jobs,
+                                                    initializer=_candidate_init,
+                                                    initargs=(self.__solver,))
+                                        candidate = self.__solve_candidates(
+                                            pool, added, applied,
+                                            solution_vector, older)
 
-                        solution_vector = self.__get_solution_vector()
-                        if not solution_vector:
-                                break
+                                self.__progress()
+                                self.__iterations += 1
 
-                        # prevent the selection of any older pkgs
-                        for fid in solution_vector:
-                                pfmri = self.__getfmri(fid)
-                                matching, remaining = \
-                                    self.__comb_newer_fmris(pfmri)
-                                if not older:
-                                        remove = remaining
-                                else:
-                                        remove = matching - set([pfmri]) - \
-                                            eliminated
-                                for f in remove:
-                                        self.__addclauses([[-self.__getid(f)]])
+                                if self.__iterations > max_iterations:
+                                        break
 
+                                if candidate is not None:
+                                        solution_vector = candidate
+                                else:
+                                        solution_vector = \
+                                            self.__get_solution_vector()
+                                if not solution_vector:
+                                        break
 
-                        # prevent the selection of this exact combo;
-                        # permit [] solution
-                        self.__addclauses([[-i for i in solution_vector]])
+                                # prevent the selection of any older pkgs
+                                clauses = []
+                                for fid in solution_vector:
+                                        pfmri = self.__getfmri(fid)
+                                        matching, remaining = \
+                                            self.__comb_newer_fmris(pfmri)
+                                        if not older:
+                                                remove = remaining
+                                        else:
+                                                remove = matching - \
+                                                    set([pfmri]) - eliminated
+                                        for f in remove:
+                                                clauses.append(
+                                                    [-self.__getid(f)])
+
+                                # prevent the selection of this exact combo;
+                                # permit [] solution
+                                clauses.append([-i for i in solution_vector])
+                                self.__addclauses(clauses)
+                                if pool is not None:
+                                        added.extend(clauses)
+                finally:
+                        if pool is not None:
+                                pool.terminate()
+                                pool.join()
 
                 if not self.__iterations:
                         self.__raise_solution_error(no_solution=True)
@@ -1482,6 +1736,54 @@ class PkgSolver(object):
 
                 return solution
 
+        def __solve_candidates(self, pool, added, applied, solution_vector,
+            older):
+                """Evaluate alternatives to 'solution_vector' using the worker
+                processes in 'pool', which apply the clauses in 'added' to the
+                solver they inherited.  Each candidate assumes that one of the
+                packages in the solution is at its newest possible version (or
+                oldest, if 'older' is True).  Candidates are ordered by FMRI and
+                evaluated in batches of one per job; the solution vector of the
+                first one that can be satisfied is returned, so the result does
+                not depend on the number of jobs.  Returns None if there are no
+                satisfiable candidates.
+
+                'applied' maps the process id of each worker to the number of
+                clauses in 'added' it is known to have applied, and is updated
+                as results are returned.  Workers are only sent the clauses
+                that at least one of them might still need."""
+
+                lits = []
+                for pfmri in sorted(
+                    self.__getfmri(fid) for fid in solution_vector):
+                        versions = self.__possible_dict[pfmri.pkg_name]
+                        if older:
+                                alt = versions[0]
+                        else:
+                                alt = versions[-1]
+                        if alt != pfmri:
+                                lits.append(self.__getid(alt))
+                                if len(lits) == _MAX_CANDIDATES:
+                                        break
+
+                # Each batch is waited for in full so that no candidates are
+                # left running when the next iteration starts.
+                for i in range(0, len(lits), self.__jobs):
+                        offset = 0
+                        if len(applied) == self.__jobs:
+                                offset = min(six.itervalues(applied))
+                        clauses = added[offset:]
+                        found = None
+                        for pid, count, vector in pool.map(_candidate_solve,
+                            [(offset, clauses, lit)
+                            for lit in lits[i:i + self.__jobs]], chunksize=1):
+                                applied[pid] = count
+                                if vector is not None and found is None:
+                                        found = frozenset(vector)
+                        if found is not None:
+                                return found
+                return None
+
         def __get_solution_vector(self):
                 """Return solution vector from solver"""
                 return frozenset([
@@ -1567,14 +1869,14 @@ class PkgSolver(object):
                         # use frozensets so callers don't inadvertently update
                         # these sets (which may be cached).
                         all_fmris = set(self.__get_catalog_fmris(fmri.pkg_name))
+                        if fmri.version:
+                                vmatch = self.__get_version_matches(fmri,
+                                    constraint)
                         matching = frozenset([
                             f
                             for f in all_fmris
                             if f not in self.__trim_dict or not dotrim
-                            if not fmri.version or
-                                fmri.version == f.version or
-                                f.version.is_successor(fmri.version,
-                                    constraint=constraint)
+                            if not fmri.version or f in vmatch
                             if obsolete_ok or not self.__fmri_is_obsolete(f)
                         ])
                         remaining = frozenset(all_fmris - matching)
@@ -1587,6 +1889,52 @@ class PkgSolver(object):
 
                 return self.__cache[tp]
 
+        def __get_version_matches(self, fmri, constraint):
+                """Returns the set of fmris in the catalog for the package
+                named by 'fmri' that have the same version as 'fmri' or are
+                successors to it within 'constraint'.  If a cache directory was
+                provided, the matching fmris are taken from the input cache
+                when it was written for the same list of fmris."""
+
+                tp = (fmri, constraint)
+                try:
+                        return self.__vmatch_cache[tp]
+                except KeyError:
+                        pass
+
+                versions = self.__get_fmris_by_version(fmri.pkg_name)
+                key = digest = None
+                if self.__cache_dir:
+                        key = "{0:d} {1}".format(constraint,
+                            self.__input_key(fmri))
+                        digest = self.__input_stem_digest(fmri.pkg_name)
+                        cached = self.__input_matches.get(key)
+                        if cached is not None and cached[0] == digest:
+                                self.__input_hits += 1
+                                fstrs = set(cached[1])
+                                self.__vmatch_cache[tp] = frozenset(
+                                    f
+                                    for ver, fmris in versions
+                                    for f in fmris
+                                    if self.__input_key(f) in fstrs
+                                )
+                                return self.__vmatch_cache[tp]
+
+                self.__vmatch_cache[tp] = frozenset(
+                    f
+                    for ver, fmris in versions
+                    if fmri.version == ver or
+                        ver.is_successor(fmri.version, constraint=constraint)
+                    for f in fmris
+                )
+                if key:
+                        self.__input_misses += 1
+                        self.__input_matches[key] = [digest, sorted(
+                            self.__input_key(f)
+                            for f in self.__vmatch_cache[tp]
+                        )]
+                return self.__vmatch_cache[tp]
+
         def __comb_older_fmris(self, fmri, dotrim=True, obsolete_ok=True):
                 """Returns tuple of set of fmris that are older than
                 specified version and set of remaining fmris."""
@@ -1616,6 +1964,15 @@ class PkgSolver(object):
         def __fmri_loadstate(self, fmri, excludes):
                 """load fmri state (obsolete == True, renamed == True)"""
 
+                fstr = None
+                if self.__cache_dir:
+                        fstr = self.__input_key(fmri)
+                        state = self.__input_states.get(fstr)
+                        if state is not None:
+                                self.__input_hits += 1
+                                self.__fmri_state[fmri] = tuple(state)
+                                return
+
                 try:
                         relevant = dict([
                                 (a.attrs["name"], a.attrs["value"])
@@ -1635,6 +1992,10 @@ class PkgSolver(object):
                 self.__fmri_state[fmri] = (
                     relevant.get("pkg.obsolete", "false").lower() == "true",
                     relevant.get("pkg.renamed", "false").lower() == "true")
+                if fstr:
+                        self.__input_misses += 1
+                        self.__input_states[fstr] = list(
+                            self.__fmri_state[fmri])
 
         def __fmri_is_obsolete(self, fmri, excludes=EmptyI):
                 """check to see if fmri is obsolete"""
@@ -1693,10 +2054,25 @@ class PkgSolver(object):
 
         def __get_variant_dict(self, fmri):
                 """Return dictionary of variants suppported by fmri"""
+                if fmri in self.__variant_dict:
+                        return self.__variant_dict[fmri]
+
+                fstr = None
+                if self.__cache_dir:
+                        fstr = self.__input_key(fmri)
+                        vd = self.__input_variants.get(fstr)
+                        if vd is not None:
+                                self.__input_hits += 1
+                                self.__variant_dict[fmri] = vd
+                                return vd
+
                 try:
-                        if fmri not in self.__variant_dict:
-                                self.__variant_dict[fmri] = dict(
-                                    self.__catalog.get_entry_all_variants(fmri))
+                        self.__variant_dict[fmri] = dict(
+                            self.__catalog.get_entry_all_variants(fmri))
+                        if fstr:
+                                self.__input_misses += 1
+                                self.__input_variants[fstr] = \
+                                    self.__variant_dict[fmri]
                 except api_errors.InvalidPackageErrors:
                         # Trim package entries that have unparseable action data
                         # so that they can be filtered out later.
@@ -1707,11 +2083,39 @@ class PkgSolver(object):
         def __is_explicit_install(self, fmri):
                 """check if given fmri has explicit install actions."""
 
-                for sa in self.__get_set_actions(fmri):
+                if fmri in self.__explicit_dict:
+                        return self.__explicit_dict[fmri]
+
+                fstr = None
+                if self.__cache_dir:
+                        fstr = self.__input_key(fmri)
+                        explicit = self.__input_explicit.get(fstr)
+                        if explicit is not None:
+                                self.__input_hits += 1
+                                self.__explicit_dict[fmri] = explicit
+                                return explicit
+
+                try:
+                        set_actions = self.__get_set_actions(fmri,
+                            trim_invalid=False)
+                except api_errors.InvalidPackageErrors:
+                        # Trim package entries that have unparseable action data
+                        # so that they can be filtered out later.
+                        self.__fmri_state[fmri] = ("false", "false")
+                        self.__trim_unsupported(fmri)
+                        return False
+
+                explicit = False
+                for sa in set_actions:
                         if sa.attrs["name"] == "pkg.depend.explicit-install" \
                             and sa.attrs["value"].lower() == "true":
-                                return True
-                return False
+                                explicit = True
+                                break
+                self.__explicit_dict[fmri] = explicit
+                if fstr:
+                        self.__input_misses += 1
+                        self.__input_explicit[fstr] = explicit
+                return explicit
 
         def __filter_explicit_install(self, fmri):
                 """Check packages which have 'pkg.depend.explicit-install'
@@ -58,15 +58,29 @@ class PkgRemote(object):
         utilizes the "remote" subcommand within the pkg.1 client to manipulate
         images.  Communication between this class and the "pkg remote" process
         is done via RPC.  This class essentially implements an RPC client and
-        the "pkg remote" process is an RPC server."""
+        the "pkg remote" process is an RPC server.
+
+        The "pkg remote" process is kept running between the stages of an
+        operation (plan, prepare, and execute) so that it can carry on with
+        the image and plan it has already loaded, rather than starting over
+        for each stage."""
 
         # variables to keep track of our RPC client call state.
         __IDLE     = "call-idle"
         __SETUP    = "call-setup"
         __STARTED  = "call-started"
 
-        def __init__(self):
+        def __init__(self, catalog_root=None):
+                """'catalog_root' is an optional path to the publisher
+                metadata directory of the image driving this operation.  If
+                provided, it is handed to the "pkg remote" process so that
+                publisher catalogs already refreshed there can be used
+                instead of being retrieved again."""
+
+                self.__catalog_root = catalog_root
+
                 # initialize RPC server process state
+                self.__rpc_server_img_path = None
                 self.__rpc_server_proc = None
                 self.__rpc_server_fstdout = None
                 self.__rpc_server_fstderr = None
@@ -134,6 +148,11 @@ class PkgRemote(object):
                 fstdout = tempfile.TemporaryFile()
                 fstderr = tempfile.TemporaryFile()
 
+                env = None
+                if self.__catalog_root:
+                        env = os.environ.copy()
+                        env["PKG_PARENT_CATALOG_ROOT"] = self.__catalog_root
+
                 try:
                         # Under Python 3.4, os.pipe() returns non-inheritable
                         # file descriptors. On UNIX, subprocess makes file
@@ -145,10 +164,10 @@ class PkgRemote(object):
                         # pylint: disable=E1123
                         if six.PY2:
                                 p = pkg.pkgsubprocess.Popen(pkg_cmd,
-                                    stdout=fstdout, stderr=fstderr)
+                                    stdout=fstdout, stderr=fstderr, env=env)
                         else:
                                 p = subprocess.Popen(pkg_cmd,
-                                    stdout=fstdout, stderr=fstderr,
+                                    stdout=fstdout, stderr=fstderr, env=env,
                                     pass_fds=(server_cmd_pipe,
                                     server_prog_pipe_fobj.fileno()))
 
@@ -157,6 +176,7 @@ class PkgRemote(object):
                         raise apx._convert_error(e)
 
                 # initalization successful, update RPC server state
+                self.__rpc_server_img_path = img_path
                 self.__rpc_server_proc = p
                 self.__rpc_server_fstdout = fstdout
                 self.__rpc_server_fstderr = fstderr
@@ -178,7 +198,8 @@ class PkgRemote(object):
                 server_prog_pipe_fobj = os.fdopen(server_prog_pipe, "w")
 
                 # initialize the client side of the RPC server
-                rpc_client = pkg.pipeutils.PipedServerProxy(client_cmd_pipe)
+                rpc_client = pkg.pipeutils.PipedServerProxy(client_cmd_pipe,
+                    framing=True)
 
                 # fork off the server
                 self.__rpc_server_fork(img_path,
@@ -207,6 +228,7 @@ class PkgRemote(object):
 
                 # clear server state (which closes the rpc pipe file
                 # descriptors)
+                self.__rpc_server_img_path = None
                 self.__rpc_server_proc = None
                 self.__rpc_server_fstdout = None
                 self.__rpc_server_fstderr = None
@@ -402,6 +424,27 @@ class PkgRemote(object):
                         pass
                 self.__debug_msg("exiting", t2=True)
 
+        def __rpc_server_reusable(self, img_path):
+                """Check if we have a RPC server process left running by a
+                previous operation on the image at 'img_path'."""
+
+                return self.__rpc_server_proc is not None and \
+                    self.__rpc_server_img_path == img_path and \
+                    self.__rpc_server_proc.poll() is None
+
+        def __rpc_server_keep(self, rv, e):
+                """Check if the RPC server process should be kept running
+                after an operation returned 'rv' and 'e'.  We only keep it
+                when we expect to be asked to perform the next stage of the
+                same operation."""
+
+                if e is not None or rv != pkgdefs.EXIT_OK:
+                        return False
+                if self.__kwargs.get("noexecute", False):
+                        return False
+                return self.__kwargs.get("stage") in [
+                    pkgdefs.API_STAGE_PLAN, pkgdefs.API_STAGE_PREPARE]
+
         def __rpc_client_setup(self, pkg_op, **kwargs):
                 """Prepare to perform a RPC operation.
 
@@ -414,6 +457,13 @@ class PkgRemote(object):
                 # drain the progress pipe
                 self.__rpc_client_prog_pipe_drain()
 
+                # discard output from any previous operation.  the server
+                # shares the file offset with us, so rewind it as well.
+                for f in (self.__rpc_server_fstdout,
+                    self.__rpc_server_fstderr):
+                        f.seek(0)
+                        f.truncate()
+
         def setup(self, img_path, pkg_op, **kwargs):
                 """Public interface to setup a remote packaging operation.
 
@@ -424,7 +474,11 @@ class PkgRemote(object):
                 'kwargs' is the argument dict for the RPC operation."""
 
                 self.__debug_msg("setup()")
-                self.__rpc_server_setup(img_path)
+                if self.__rpc_server_reusable(img_path):
+                        self.__debug_msg("reusing RPC server")
+                else:
+                        self.__rpc_server_fini()
+                        self.__rpc_server_setup(img_path)
                 self.__rpc_client_setup(pkg_op, **kwargs)
 
         def start(self):
@@ -514,8 +568,12 @@ class PkgRemote(object):
                 if e is not None:
                         rv = pkgdefs.EXIT_OOPS
 
-                # shutdown the RPC server
-                self.__rpc_server_fini()
+                # shutdown the RPC server unless another stage will follow
+                if self.__rpc_server_keep(rv, e):
+                        self.__async_rpc_caller.join()
+                        self.__async_rpc_waiter.join()
+                else:
+                        self.__rpc_server_fini()
 
                 # pack up our results and enter the done state
                 self.__set_state_idle()
@@ -535,5 +593,15 @@ class PkgRemote(object):
                 # enter the idle state
                 self.__set_state_idle()
 
+        def close(self):
+                """Public interface to shut down a RPC server process kept
+                running for further operations, if there is one."""
+
+                self.__debug_msg("close()")
+                if self.__state != self.__IDLE:
+                        self.abort()
+                        return
+                self.__rpc_server_fini()
+
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
@@ -2158,6 +2158,78 @@ pkg unset-publisher {0}
                                 raise api_errors.MismatchedCatalog(self.prefix)
                 return True, True
 
+        def __refresh_shared(self, croot, tempdir):
+                """Private helper method that refreshes the catalog data in
+                'croot' using the copy already refreshed by the parent image,
+                if this image is a linked image child and the parent has a
+                catalog for the same publisher and origin.  Returns a tuple of
+                (changed, refreshed) as __refresh_v1 does, or None if no usable
+                copy was found and the origin must be contacted instead."""
+
+                root = global_settings.client_parent_catalog_root
+                if not root:
+                        return None
+
+                # Origin catalogs are stored in a directory named using a
+                # digest of the origin URI, so a matching directory in the
+                # parent holds the catalog for the same origin.
+                spath = os.path.join(root, self.prefix, "origins",
+                    os.path.basename(croot))
+                if os.path.realpath(spath) == os.path.realpath(croot):
+                        return None
+
+                try:
+                        scat = pkg.catalog.Catalog(meta_root=spath,
+                            read_only=True)
+                        if not scat.exists:
+                                return None
+
+                        v1_cat = pkg.catalog.Catalog(meta_root=croot,
+                            read_only=True)
+                        if v1_cat.exists:
+                                if v1_cat.last_modified > scat.last_modified:
+                                        # Ours is newer than the parent's, even
+                                        # if the origin's catalog was rebuilt
+                                        # since; never replace it with older
+                                        # data.
+                                        return None
+                                if v1_cat.created == scat.created and \
+                                    v1_cat.last_modified == scat.last_modified:
+                                        # Already up to date.
+                                        return False, True
+
+                        # Copy the parent's catalog to a private directory and
+                        # validate it there so that an incomplete copy is never
+                        # installed.
+                        sdir = tempfile.mkdtemp(dir=tempdir)
+                        for name in ["catalog.attrs"] + list(scat.parts):
+                                try:
+                                        shutil.copy2(os.path.join(spath, name),
+                                            sdir)
+                                except EnvironmentError as e:
+                                        if e.errno != errno.ENOENT:
+                                                raise
+                        pkg.catalog.Catalog(meta_root=sdir,
+                            read_only=True).validate()
+                except (EnvironmentError, api_errors.ApiException):
+                        # The parent's copy is unusable; fall back to
+                        # retrieving the catalog from the origin.
+                        return None
+
+                v0_cat = old_catalog.ServerCatalog(croot, read_only=True,
+                    publisher=self.prefix)
+                if v0_cat.exists:
+                        v0_cat.destroy(root=croot)
+
+                self._catalog = None
+                v1_cat = pkg.catalog.Catalog(meta_root=croot)
+                if v1_cat.exists:
+                        v1_cat.destroy()
+                for fn in os.listdir(sdir):
+                        pkg.portable.rename(os.path.join(sdir, fn),
+                            os.path.join(croot, fn))
+                return True, True
+
         def __refresh_origin(self, croot, full_refresh, immediate, mismatched,
             origin, progtrack=None, include_updates=False):
                 """Private helper method used to refresh catalog data for each
@@ -2187,10 +2259,14 @@ pkg unset-publisher {0}
                 # Ensure that the temporary directory gets removed regardless
                 # of success or failure.
                 try:
-                        rval = self.__refresh_v1(croot, tempdir,
-                            full_refresh, immediate, mismatched, repo,
-                            progtrack=progtrack,
-                            include_updates=include_updates)
+                        rval = None
+                        if not full_refresh and not include_updates:
+                                rval = self.__refresh_shared(croot, tempdir)
+                        if rval is None:
+                                rval = self.__refresh_v1(croot, tempdir,
+                                    full_refresh, immediate, mismatched, repo,
+                                    progtrack=progtrack,
+                                    include_updates=include_updates)
 
                         # Perform publisher metadata sanity checks.
                         self.__validate_metadata(croot, repo)
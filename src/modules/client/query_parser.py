@@ -74,6 +74,9 @@ class EmptyQuery(object):
         def search(self, *args):
                 return []
 
+        def postings(self, *args):
+                return None
+
         def set_info(self, **kwargs):
                 return
 
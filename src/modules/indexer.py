@@ -25,6 +25,7 @@
 #
 
 import errno
+import heapq
 import os
 import platform
 import shutil
@@ -52,6 +53,14 @@ FILE_OPEN_TIMEOUT_SECS = 2
 
 MAX_FAST_INDEXED_PKGS = 20
 
+# The largest number of packages a server index update will place in a delta
+# segment instead of rewriting the main dictionary, and the number of delta
+# segments at which the segments are compacted into the main dictionary.
+MAX_DELTA_INDEXED_PKGS = 100
+MAX_DELTA_SEGMENTS = 8
+
+DELTA_SEGMENT_PREFIX = "delta."
+
 SORT_FILE_PREFIX = "sort."
 
 SORT_FILE_MAX_SIZE = 128 * 1024 * 1024
@@ -75,6 +84,81 @@ def makedirs(pathname):
                         raise
 
 
+# The index parameters used by indexing worker processes; set by
+# _index_worker_init() in each worker.
+_index_state = None
+
+def _sort_file(path):
+        """Sorts the lines of the temporary sort file at 'path' by token."""
+
+        tmp_fh = open(path, "r", buffering=PKG_FILE_BUFSIZ)
+        l = [
+            (ss.IndexStoreMainDict.parse_main_dict_line_for_token(line),
+            line)
+            for line in tmp_fh
+        ]
+        tmp_fh.close()
+        l.sort()
+        tmp_fh = open(path, "w", buffering=PKG_FILE_BUFSIZ)
+        tmp_fh.writelines((line for tok, line in l))
+        tmp_fh.close()
+
+def _gen_sort_lines(p_id, new_dict):
+        """Yields the temporary sort file lines for the tokens in 'new_dict',
+        as returned by Manifest.search_dict, of the package with id 'p_id'."""
+
+        for tok_tup in new_dict.keys():
+                tok, action_type, subtype, fv = tok_tup
+                lst = [(action_type, [(subtype, [(fv, [(p_id,
+                    list(new_dict[tok_tup]))])])])]
+                yield ss.IndexStoreMainDict.transform_main_dict_line(tok, lst)
+
+def _index_worker_init(tmp_dir, excludes, log, sort_file_max_size):
+        """Initialize an indexing worker process."""
+
+        global _index_state
+        _index_state = (tmp_dir, excludes, log, sort_file_max_size)
+
+def _index_manifests_job(args):
+        """Tokenize a range of manifests in a worker process; 'args' is a
+        tuple of (run, manifests) where 'run' numbers the range and
+        'manifests' is a list of (package id, manifest path) tuples.  The
+        tokens are written to sorted temporary sort files of at most the
+        worker's sort file size.  Returns a tuple of the paths of those files
+        and the number of manifests processed."""
+
+        tmp_dir, excludes, log, sort_file_max_size = _index_state
+        run, manifests = args
+        files = []
+        fh = None
+        size = 0
+        try:
+                for p_id, path in manifests:
+                        new_dict = manifest.Manifest.search_dict(path,
+                            excludes, log=log)
+                        for s in _gen_sort_lines(p_id, new_dict):
+                                if fh is None or \
+                                    len(s) + size >= sort_file_max_size:
+                                        if fh is not None:
+                                                fh.close()
+                                                _sort_file(files[-1])
+                                        files.append(os.path.join(tmp_dir,
+                                            "{0}{1:d}.{2:d}".format(
+                                            SORT_FILE_PREFIX, run,
+                                            len(files))))
+                                        fh = open(files[-1], "w",
+                                            buffering=PKG_FILE_BUFSIZ)
+                                        size = 0
+                                fh.write(s)
+                                size += len(s)
+        finally:
+                if fh is not None:
+                        fh.close()
+        if files:
+                _sort_file(files[-1])
+        return files, len(manifests)
+
+
 class Indexer(object):
         """Indexer is a class designed to index a set of manifests or pkg plans
         and provide a compact representation on disk, which is quickly
@@ -84,7 +168,7 @@ class Indexer(object):
 
         def __init__(self, index_dir, get_manifest_func, get_manifest_path_func,
             progtrack=None, excludes=EmptyI, log=None,
-            sort_file_max_size=SORT_FILE_MAX_SIZE):
+            sort_file_max_size=SORT_FILE_MAX_SIZE, jobs=1):
                 self._num_keys = 0
                 self._num_manifests = 0
                 self._num_entries = 0
@@ -96,6 +180,9 @@ class Indexer(object):
                 if self.sort_file_max_size <= 0:
                         raise search_errors.IndexingException(
                             _("sort_file_max_size must be greater than 0"))
+                # The number of worker processes used to tokenize manifests
+                # when the index is built from a list of fmris.
+                self.jobs = jobs
 
                 # This structure was used to gather all index files into one
                 # location. If a new index structure is needed, the files can
@@ -131,6 +218,25 @@ class Indexer(object):
                     ss.InvertedDict(ss.FMRI_OFFSETS_FILE, self._data_manf)
                 self._data_fmri_offsets = self._data_dict["fmri_offsets"]
 
+                # The binary main dictionary and the auxiliary token indexes
+                # are only ever written, since the text main dictionary is the
+                # input for index updates, so they're kept out of the
+                # dictionaries which are opened and read.
+                self._data_bin_main_dict = \
+                    ss.IndexStoreBinaryMainDict(ss.BINARY_MAIN_FILE)
+                self._data_token_aux = \
+                    ss.IndexStoreTokenAux(ss.TOKEN_AUX_FILE)
+
+                # Packages added to a server index since it was last
+                # compacted are indexed in small, separate indexes in
+                # subdirectories of the index directory called delta segments,
+                # and packages removed since then are recorded as tombstones.
+                # These files only exist while there's something to compact,
+                # so they're also kept out of the dictionaries above.
+                self._data_delta_segments = \
+                    ss.IndexStoreSet(ss.DELTA_SEGMENTS_FILE)
+                self._data_tombstones = ss.IndexStoreSet(ss.TOMBSTONE_FILE)
+
                 self._index_dir = index_dir
                 self._tmp_dir = os.path.join(self._index_dir, "TMP")
 
@@ -155,6 +261,7 @@ class Indexer(object):
                 self._sort_fh = None
                 self._sort_file_num = 0
                 self._sort_file_bytes = 0
+                self._sort_files = []
 
                 # The action type and key indexes, which are necessary for
                 # efficient searches by type or key, store their file handles in
@@ -219,25 +326,80 @@ class Indexer(object):
                                 d.close_file_handle()
                         pt.job_done(pt.JOB_READ_SEARCH)
 
+        def __read_delta_state(self, version):
+                """Reads the names of the delta segments and the tombstones for
+                the index if they're consistent with the main index, which is
+                at 'version'."""
+
+                self._data_delta_segments.clear()
+                self._data_tombstones.clear()
+                if version is None:
+                        return
+                dicts = (self._data_delta_segments, self._data_tombstones)
+                try:
+                        # The files are removed after the main index is
+                        # replaced by a compacted one, so they may be left
+                        # over from an older version of the index.
+                        if ss.consistent_open(dicts, self._index_dir,
+                            self._file_timeout_secs) != version:
+                                return
+                        for d in dicts:
+                                d.read_dict_file()
+                finally:
+                        for d in dicts:
+                                d.close_file_handle()
+
+        def __remove_delta_state(self):
+                """Removes the delta segments and tombstones from the index
+                directory once they've been compacted into the main
+                dictionary."""
+
+                for d in (self._data_delta_segments, self._data_tombstones):
+                        path = os.path.join(self._index_dir, d.get_file_name())
+                        if os.path.exists(path):
+                                portable.remove(path)
+                for name in os.listdir(self._index_dir):
+                        if name.startswith(DELTA_SEGMENT_PREFIX):
+                                shutil.rmtree(os.path.join(self._index_dir,
+                                    name))
+
+        def __delta_segment_fmris(self):
+                """Returns the fmris indexed in the delta segments which haven't
+                been removed since."""
+
+                res = []
+                for name in self._data_delta_segments.get_set():
+                        data = ss.IndexStoreSet(ss.FULL_FMRI_FILE)
+                        try:
+                                data.open(os.path.join(self._index_dir, name))
+                                data.read_dict_file()
+                        finally:
+                                data.close_file_handle()
+                        for s in data.get_set():
+                                pfmri = fmri.PkgFmri(s)
+                                if not self._data_tombstones.has_entity(
+                                    pfmri.get_fmri(anarchy=True,
+                                    include_scheme=False)):
+                                        res.append(pfmri)
+                return res
+
         def __close_sort_fh(self):
                 """Utility fuction used to close and sort the temporary
                 files used to produce a sorted main_dict file."""
 
                 self._sort_fh.close()
                 self._sort_file_bytes = 0
-                tmp_file_name = os.path.join(self._tmp_dir,
-                    SORT_FILE_PREFIX + str(self._sort_file_num - 1))
-                tmp_fh = open(tmp_file_name, "r", buffering=PKG_FILE_BUFSIZ)
-                l = [
-                    (ss.IndexStoreMainDict.parse_main_dict_line_for_token(line),
-                    line)
-                    for line in tmp_fh
-                ]
-                tmp_fh.close()
-                l.sort()
-                tmp_fh = open(tmp_file_name, "w", buffering=PKG_FILE_BUFSIZ)
-                tmp_fh.writelines((line for tok, line in l))
-                tmp_fh.close()
+                _sort_file(self._sort_fh.name)
+
+        def __open_sort_fh(self):
+                """Opens the next temporary file used to produce a sorted
+                main_dict file."""
+
+                self._sort_files.append(os.path.join(self._tmp_dir,
+                    SORT_FILE_PREFIX + str(self._sort_file_num)))
+                self._sort_fh = open(self._sort_files[-1], "w",
+                    buffering=PKG_FILE_BUFSIZ)
+                self._sort_file_num += 1
 
         def _add_terms(self, pfmri, new_dict):
                 """Adds tokens, and the actions generating them, to the current
@@ -250,22 +412,12 @@ class Indexer(object):
                 the action."""
 
                 p_id = self._data_manf.get_id_and_add(pfmri)
-                pfmri = p_id
-
-                for tok_tup in new_dict.keys():
-                        tok, action_type, subtype, fv = tok_tup
-                        lst = [(action_type, [(subtype, [(fv, [(pfmri,
-                            list(new_dict[tok_tup]))])])])]
-                        s = ss.IndexStoreMainDict.transform_main_dict_line(tok,
-                            lst)
+
+                for s in _gen_sort_lines(p_id, new_dict):
                         if len(s) + self._sort_file_bytes >= \
                             self.sort_file_max_size:
                                 self.__close_sort_fh()
-                                self._sort_fh = open(os.path.join(self._tmp_dir,
-                                    SORT_FILE_PREFIX +
-                                    str(self._sort_file_num)), "w",
-                                    buffering=PKG_FILE_BUFSIZ)
-                                self._sort_file_num += 1
+                                self.__open_sort_fh()
                         self._sort_fh.write(s)
                         self._sort_file_bytes += len(s)
                 return
@@ -370,6 +522,10 @@ class Indexer(object):
 
                 removed_paths = []
 
+                if self.jobs > 1 and len(fmris) > 1:
+                        self.__process_fmris_parallel(fmris)
+                        return removed_paths
+
                 for added_fmri in fmris:
                         self._data_full_fmri.add_entity(
                             added_fmri.get_fmri(anarchy=True))
@@ -382,6 +538,52 @@ class Indexer(object):
                             self._progtrack.JOB_REBUILD_SEARCH)
                 return removed_paths
 
+        def __process_fmris_parallel(self, fmris):
+                """Tokenizes the manifests of fmris using self.jobs worker
+                processes.  Each worker writes sorted runs for disjoint ranges
+                of the fmris, which _gen_new_toks_from_files merges along with
+                the other temporary sort files.  Package ids are assigned here,
+                in order, so the resulting index matches a serial build."""
+
+                manifests = []
+                for added_fmri in fmris:
+                        self._data_full_fmri.add_entity(
+                            added_fmri.get_fmri(anarchy=True))
+                        manifests.append((
+                            self._data_manf.get_id_and_add(added_fmri),
+                            self.get_manifest_path_func(added_fmri)))
+
+                # Hand each worker several ranges so that a range of large
+                # manifests doesn't leave the other workers idle.
+                step = max(1, -(-len(manifests) // (self.jobs * 4)))
+                ranges = [
+                    (run, manifests[i:i + step])
+                    for run, i in enumerate(range(0, len(manifests), step))
+                ]
+
+                # Split the sort file size among the workers so that the
+                # memory used to sort the runs matches a serial build.
+                pool = misc.get_process_pool(self.jobs,
+                    initializer=_index_worker_init,
+                    initargs=(self._tmp_dir, self.excludes, self.__log,
+                    max(1, self.sort_file_max_size // self.jobs)))
+                try:
+                        for files, cnt in pool.imap(_index_manifests_job,
+                            ranges):
+                                self._sort_files.extend(files)
+                                self._progtrack.job_add_progress(
+                                    self._progtrack.JOB_REBUILD_SEARCH,
+                                    nitems=cnt)
+                except:
+                        pool.terminate()
+                        pool.join()
+                        pool = None
+                        raise
+                finally:
+                        if pool:
+                                pool.close()
+                                pool.join()
+
         def _write_main_dict_line(self, file_handle, token,
             fv_fmri_pos_list_list, out_dir):
                 """Writes out the new main dictionary file and also adds the
@@ -409,6 +611,9 @@ class Indexer(object):
                 cur_location_int = file_handle.tell()
                 cur_location = str(cur_location_int)
                 self._data_token_offset.write_entity(token, cur_location)
+                self._data_bin_main_dict.write_entry(token,
+                    fv_fmri_pos_list_list, cur_location_int)
+                self._data_token_aux.add_token(token)
 
                 for at, st_list in fv_fmri_pos_list_list:
                         self._progtrack.job_add_progress(
@@ -459,95 +664,50 @@ class Indexer(object):
                 """Produces a stream of ordered tokens and the associated
                 information for those tokens from the sorted temporary files
                 produced by _add_terms. In short, this is the merge part of the
-                merge sort being done on the tokens to be indexed."""
+                merge sort being done on the tokens to be indexed.
 
-                def get_line(fh):
-                        """Helper function to make the initialization of the
-                        fh_dict easier to understand."""
+                The lines of the files are merged in the same order they would
+                have if they had all been sorted as a single file, so the index
+                produced doesn't depend on how they were divided among the
+                files, or on whether the files were written by worker
+                processes."""
 
-                        try:
-                                return \
-                                        ss.IndexStoreMainDict.parse_main_dict_line(
-                                        next(fh))
-                        except StopIteration:
-                                return None
-
-                # Build a mapping from numbers to the file handle for the
-                # temporary sort file with that number.
-                fh_dict = dict([
-                    (i, open(os.path.join(self._tmp_dir,
-                    SORT_FILE_PREFIX + str(i)), "r",
-                    buffering=PKG_FILE_BUFSIZ))
-                    for i in range(self._sort_file_num)
-                ])
-
-                cur_toks = {}
-                # Seed cur_toks with the first token from each temporary file.
-                # The line may not exist since, for a empty repo, an empty file
-                # is created.
-                for i in list(fh_dict.keys()):
-                        line = get_line(fh_dict[i])
-                        if line is None:
-                                del fh_dict[i]
-                        else:
-                                cur_toks[i] = line
+                def gen_lines(path):
+                        """Yields a tuple of the token and the line itself for
+                        each line in the temporary sort file 'path', in the
+                        order _sort_file left them in."""
+
+                        with open(path, "r", buffering=PKG_FILE_BUFSIZ) as fh:
+                                for line in fh:
+                                        yield ss.IndexStoreMainDict.\
+                                            parse_main_dict_line_for_token(
+                                            line), line
 
                 old_min_token = None
-                # cur_toks will have items deleted from it as files no longer
-                # have tokens to provide. When no files have tokens, the merge
-                # is done.
-                while cur_toks:
-                        min_token = None
-                        matches = []
-                        # Find smallest available token and the temporary files
-                        # which contain that token.
-                        for i in fh_dict.keys():
-                                cur_tok, info = cur_toks[i]
-                                if cur_tok is None:
-                                        continue
-                                if min_token is None or cur_tok < min_token:
-                                        min_token = cur_tok
-                                        matches = [i]
-                                elif cur_tok == min_token:
-                                        matches.append(i)
-                        assert min_token is not None
-                        assert len(matches) > 0
-                        res = None
-                        for i in matches:
-                                new_tok, new_info = cur_toks[i]
-                                assert new_tok == min_token
-                                try:
-                                        # Continue pulling the next tokens from
-                                        # and adding them to the result list as
-                                        # long as the token matches min_token.
-                                        while new_tok == min_token:
-                                                if res is None:
-                                                        res = new_info
-                                                else:
-                                                        self.__splice(res,
-                                                            new_info)
-                                                new_tok, new_info = \
-                                                    ss.IndexStoreMainDict.parse_main_dict_line(next(fh_dict[i]))
-                                        cur_toks[i] = new_tok, new_info
-                                except StopIteration:
-                                        # When a StopIteration happens, the
-                                        # last line in the file has been read
-                                        # and processed. Delete all the
-                                        # information associated with that file
-                                        # so that we no longer check that file.
-                                        fh_dict[i].close()
-                                        del fh_dict[i]
-                                        del cur_toks[i]
-                        assert res is not None
+                min_token = None
+                res = None
+                # The lines for each token are spliced together in order.  An
+                # empty file may have been created for an empty repo.
+                for tok, line in heapq.merge(*[
+                    gen_lines(path) for path in self._sort_files
+                    ]):
+                        new_tok, new_info = \
+                            ss.IndexStoreMainDict.parse_main_dict_line(line)
+                        assert new_tok == tok
+                        if res is not None and tok == min_token:
+                                self.__splice(res, new_info)
+                                continue
+                        if res is not None and min_token != "":
+                                yield min_token, res
                         if old_min_token is not None and \
-                            old_min_token >= min_token:
+                            old_min_token >= tok:
                                 raise RuntimeError("Got min token:{0} greater "
                                     "than old_min_token:{1}".format(
-                                    min_token, old_min_token))
-                        old_min_token = min_token
-                        if min_token != "":
-                                yield min_token, res
-                return
+                                    tok, old_min_token))
+                        old_min_token = min_token = tok
+                        res = new_info
+                if res is not None and min_token != "":
+                        yield min_token, res
 
         def _update_index(self, dicts, out_dir):
                 """Processes the main dictionary file and writes out a new
@@ -583,6 +743,10 @@ class Indexer(object):
 
                 self._data_token_offset.open_out_file(out_dir,
                     self.file_version_number)
+                self._data_bin_main_dict.open_out_file(out_dir,
+                    self.file_version_number)
+                self._data_token_aux.open_out_file(out_dir,
+                    self.file_version_number)
 
                 new_toks_available = True
                 new_toks_it = self._gen_new_toks_from_files()
@@ -677,6 +841,8 @@ class Indexer(object):
 
                         out_main_dict_handle.close()
                         self._data_token_offset.close_file_handle()
+                        self._data_bin_main_dict.close_out_file()
+                        self._data_token_aux.close_out_file()
                         for fh in self.at_fh.values():
                                 fh.close()
                         for fh in self.st_fh.values():
@@ -726,6 +892,9 @@ class Indexer(object):
 
                         # Read the existing dictionaries.
                         self._read_input_indexes(self._index_dir)
+                        if not self.empty_index:
+                                self.__read_delta_state(
+                                    self.file_version_number)
                 except:
                         self.unlock()
                         raise
@@ -768,18 +937,27 @@ class Indexer(object):
 
                         elif input_type == IDX_INPUT_TYPE_FMRI:
                                 assert not self._sort_fh
-                                self._sort_fh = open(os.path.join(self._tmp_dir,
-                                    SORT_FILE_PREFIX +
-                                    str(self._sort_file_num)), "w")
-                                self._sort_file_num += 1
+                                # Compact the index by indexing the packages
+                                # in the delta segments along with the new
+                                # ones and dropping the entries for removed
+                                # packages from the main dictionary.
+                                compact = os.path.exists(os.path.join(
+                                    self._index_dir,
+                                    self._data_delta_segments.get_file_name()))
+                                inputs.extend(self.__delta_segment_fmris())
+                                self.__open_sort_fh()
 
                                 self._progtrack.job_start(
                                     self._progtrack.JOB_REBUILD_SEARCH,
                                     goal=len(inputs))
                                 dicts = self._process_fmris(inputs)
+                                dicts.extend(
+                                    fmri.PkgFmri(s)
+                                    for s in self._data_tombstones.get_set()
+                                )
                                 # Update the main dictionary file
                                 self.__close_sort_fh()
-                                self._update_index(dicts, tmp_index_dir)
+                                self._update_index(set(dicts), tmp_index_dir)
                                 self._progtrack.job_done(
                                     self._progtrack.JOB_REBUILD_SEARCH)
 
@@ -796,6 +974,12 @@ class Indexer(object):
                         # migrate is not an atomic action.
                         self._migrate(source_dir = tmp_index_dir,
                             fast_update=fast_update)
+                        # The delta segments are only removed once the
+                        # compacted main dictionary has replaced the old one;
+                        # searches ignore them from then on since their
+                        # version no longer matches the main index.
+                        if input_type == IDX_INPUT_TYPE_FMRI and compact:
+                                self.__remove_delta_state()
                         self.unlock()
 
                 except:
@@ -824,11 +1008,125 @@ class Indexer(object):
                 only way to remove a package from the index is to remove it
                 from the depot and reindex.  Note: if tmp_index_dir is
                 specified, it must NOT exist in the current directory structure.
-                This prevents the indexer from accidentally removing files."""
+                This prevents the indexer from accidentally removing files.
 
+                When only a few packages are added to an existing index, they
+                are indexed in a new delta segment instead, so the cost of the
+                update depends on the size of the packages rather than the
+                size of the index."""
+
+                fmris = list(fmris)
+                if self.__update_delta_state(fmris, EmptyI):
+                        return
                 self._generic_update_index(fmris, IDX_INPUT_TYPE_FMRI,
                     tmp_index_dir)
 
+        def server_remove_from_index(self, fmris):
+                """Records the packages in 'fmris' as removed from the
+                repository so that they're no longer returned by searches.
+                Their entries are dropped from the main dictionary the next
+                time the index is compacted."""
+
+                self.__update_delta_state(EmptyI, list(fmris))
+
+        def server_compact_index(self, tmp_index_dir=None):
+                """Folds any delta segments and tombstones into the main
+                dictionary.  'tmp_index_dir' is as for server_update_index.
+                Returns whether there was anything to compact."""
+
+                if not os.path.exists(os.path.join(self._index_dir,
+                    self._data_delta_segments.get_file_name())):
+                        return False
+                self._generic_update_index([], IDX_INPUT_TYPE_FMRI,
+                    tmp_index_dir)
+                return True
+
+        def __update_delta_state(self, added, removed):
+                """Indexes the packages in 'added' in a new delta segment and
+                records the packages in 'removed' as tombstones without
+                rewriting the main dictionary.  Returns False if the main
+                dictionary must be rewritten instead, either because there is
+                no index yet, too many packages were added, or there are
+                already enough delta segments to compact."""
+
+                self.lock()
+                try:
+                        try:
+                                version = ss.consistent_open(
+                                    self._data_dict.values(), self._index_dir,
+                                    self._file_timeout_secs)
+                                if version is not None:
+                                        self._data_full_fmri.read_dict_file()
+                        finally:
+                                for d in self._data_dict.values():
+                                        d.close_file_handle()
+                        if version is None:
+                                # There's nothing to remove packages from.
+                                return not added
+                        self.__read_delta_state(version)
+
+                        segments = self._data_delta_segments.get_set()
+                        if len(added) > MAX_DELTA_INDEXED_PKGS or \
+                            (added and len(segments) >= MAX_DELTA_SEGMENTS):
+                                return False
+                        for pfmri in added:
+                                # Entries for a package which was removed and
+                                # then added again must be dropped from the
+                                # main dictionary first.
+                                if self._data_tombstones.has_entity(
+                                    pfmri.get_fmri(anarchy=True,
+                                    include_scheme=False)):
+                                        return False
+
+                        if added:
+                                num = 1 + max([0] + [
+                                    int(name[len(DELTA_SEGMENT_PREFIX):])
+                                    for name in segments
+                                ])
+                                name = DELTA_SEGMENT_PREFIX + str(num)
+                                seg_dir = os.path.join(self._index_dir, name)
+                                # Remove any segment left behind by an
+                                # interrupted update.
+                                if os.path.exists(seg_dir):
+                                        shutil.rmtree(seg_dir)
+                                seg = Indexer(seg_dir, self.get_manifest_func,
+                                    self.get_manifest_path_func,
+                                    progtrack=self._progtrack,
+                                    excludes=self.excludes, log=self.__log,
+                                    sort_file_max_size=self.sort_file_max_size,
+                                    jobs=self.jobs)
+                                seg.server_update_index(added)
+                                self._data_delta_segments.add_entity(name)
+                                for pfmri in added:
+                                        self._data_full_fmri.add_entity(
+                                            pfmri.get_fmri(anarchy=True))
+
+                        for pfmri in removed:
+                                self._data_full_fmri.get_set().discard(
+                                    pfmri.get_fmri(anarchy=True))
+                                self._data_tombstones.add_entity(
+                                    pfmri.get_fmri(anarchy=True,
+                                    include_scheme=False))
+
+                        # The main index is unchanged, so these files are
+                        # written with its version.  The list of segments is
+                        # moved into place last so that searches only use
+                        # the new segment once it's complete.
+                        if os.path.exists(self._tmp_dir):
+                                shutil.rmtree(self._tmp_dir)
+                        makedirs(self._tmp_dir)
+                        for d in (self._data_full_fmri, self._data_tombstones,
+                            self._data_delta_segments):
+                                d.write_dict_file(self._tmp_dir, version)
+                                portable.rename(os.path.join(self._tmp_dir,
+                                    d.get_file_name()),
+                                    os.path.join(self._index_dir,
+                                    d.get_file_name()))
+                        shutil.rmtree(self._tmp_dir)
+                        return True
+                finally:
+                        self.unlock()
+
         def check_index_existence(self):
                 """ Returns a boolean value indicating whether a consistent
                 index exists. If an index exists but is inconsistent, an
@@ -949,7 +1247,7 @@ class Indexer(object):
                 old information.
 
                 The "fast_update" parameter determines whether the main
-                dictionary and the token byte offset files are moved.  This is
+                dictionaries and the token byte offset files are moved.  This is
                 used so that when only the update logs are touched, the large
                 files don't need to be moved."""
 
@@ -969,6 +1267,12 @@ class Indexer(object):
                                     d.get_file_name()),
                                     os.path.join(dest_dir, d.get_file_name()))
                 if not fast_update:
+                        for d in (self._data_bin_main_dict,
+                            self._data_token_aux):
+                                shutil.move(os.path.join(source_dir,
+                                    d.get_file_name()),
+                                    os.path.join(dest_dir, d.get_file_name()))
+
                         # Remove legacy index/pkg/ directory which is obsoleted
                         # by the fmri_offsets.v1 file.
                         try:
@@ -2596,6 +2596,50 @@ class AsyncCall(object):
                 return self.rv
 
 
+def get_process_pool(processes, initializer=None, initargs=()):
+        """Return a multiprocessing.Pool of 'processes' workers.
+
+        Workers are always created using fork() so that 'initializer' and
+        'initargs' are inherited by the child processes rather than pickled;
+        this allows callers to hand unpicklable objects (such as repository
+        stores or open catalogs) to their workers.  Only the arguments and
+        results of individual tasks must be picklable."""
+
+        import multiprocessing
+
+        try:
+                ctx = multiprocessing.get_context("fork")
+        except AttributeError:
+                # Python 2 always forks on this platform.
+                ctx = multiprocessing
+        return ctx.Pool(processes=processes, initializer=initializer,
+            initargs=initargs)
+
+
+class SyncResult(object):
+        """An object providing the subset of the multiprocessing AsyncResult
+        interface used by callers of get_process_pool(), for use when work is
+        performed serially in the calling process.  The call is deferred until
+        get() is first called so that serial and parallel callers produce
+        results in the same order."""
+
+        def __init__(self, func, *args):
+                self.__func = func
+                self.__args = args
+                self.__done = False
+                self.__rv = None
+
+        def ready(self):
+                return True
+
+        def get(self, timeout=None):
+                if not self.__done:
+                        self.__rv = self.__func(*self.__args)
+                        self.__done = True
+                        self.__func = self.__args = None
+                return self.__rv
+
+
 def get_runtime_proxy(proxy, uri):
         """Given a proxy string and a URI we want to access using it, determine
         whether any OS environment variables should override that value.
@@ -27,12 +27,15 @@
 import atexit
 import collections
 import errno
+import io
 import tarfile as tf
 import os
 import shutil
 import six
+import stat
 import sys
 import tempfile
+import threading
 from six.moves.urllib.parse import unquote
 
 import pkg
@@ -51,6 +54,26 @@ from pkg.misc import force_bytes, force_str
 if sys.version > '3':
         long = int
 
+# The largest archive member that is read ahead into memory when writing an
+# archive using multiple jobs; larger members are read by the writer itself.
+_MAX_READAHEAD_SIZE = 16 * 1024 * 1024
+
+def _read_member(pathname):
+        """Returns the content of the regular file 'pathname' to be added to
+        an archive, or None if it isn't a regular file or is too large to be
+        read ahead."""
+
+        try:
+                st = os.lstat(pathname)
+                if not stat.S_ISREG(st.st_mode) or \
+                    st.st_size > _MAX_READAHEAD_SIZE:
+                        return None
+                with open(pathname, "rb") as f:
+                        return f.read()
+        except EnvironmentError:
+                # The writer will encounter and report the error itself.
+                return None
+
 class ArchiveErrors(apx.ApiException):
         """Base exception class for archive class errors."""
 
@@ -213,6 +236,33 @@ class ArchiveIndex(object):
                 self.__closed = True
 
 
+class _ArchiveOffsets(dict):
+        """A dictionary mapping the names of archive members to their offsets
+        in the archive, which can also be used to look up package files by
+        hash.  The hash lookup table is built the first time it's needed, and
+        is shared by every Archive object sharing the offsets."""
+
+        def __init__(self, *args, **kwargs):
+                dict.__init__(self, *args, **kwargs)
+                self.__hashes = None
+
+        def find_package_file(self, fhash):
+                """Returns the name of the first package file in the archive
+                named after the given hash, or None if there isn't one."""
+
+                hashes = self.__hashes
+                if hashes is None:
+                        hashes = {}
+                        for name in self:
+                                parts = name.rsplit("/", 3)
+                                if len(parts) < 3 or parts[-3] != "file" or \
+                                    parts[-2] != parts[-1][:2]:
+                                        continue
+                                hashes.setdefault(parts[-1], name)
+                        self.__hashes = hashes
+                return hashes.get(fhash)
+
+
 class InvalidArchive(ArchiveErrors):
         """Used to indicate that the specified archive is in a format not
         supported or recognized by this version of the pkg(5) Archive class.
@@ -374,7 +424,7 @@ class Archive(object):
                         # Likely not an archive or the archive is corrupt.
                         raise InvalidArchive(self.__arc_name)
 
-                self.__extract_offsets = {}
+                self.__extract_offsets = _ArchiveOffsets()
                 if "r" in mode:
                         # Opening the tarfile loaded the first member, which
                         # should be the archive index file.
@@ -388,6 +438,10 @@ class Archive(object):
                         # the index from an exising Archive object,
                         # and will have validated the version of that archive.
                         if archive_index:
+                                if not isinstance(archive_index,
+                                    _ArchiveOffsets):
+                                        archive_index = _ArchiveOffsets(
+                                            archive_index)
                                 self.__extract_offsets = archive_index
                                 return
 
@@ -878,8 +932,6 @@ class Archive(object):
                 'pub' is the prefix (name) of the publisher that the package
                 files are associated with.  If not provided, the first file
                 named after the given hash found in the archive will be used.
-                (This will be noticeably slower depending on the size of the
-                archive.)
                 """
 
                 assert not self.__closed and "r" in self.__mode
@@ -890,28 +942,22 @@ class Archive(object):
                 self.__find_extract_offsets()
 
                 if not pub:
-                        # Scan extract offsets index for the first instance of
-                        # any package file seen for each hash and extract the
-                        # file as each is found.
-                        hashes = set(hashes)
-
-                        for name in self.__extract_offsets:
-                                for fhash in hashes:
-                                        hash_fname = os.path.join("file",
-                                            fhash[:2], fhash)
-                                        if name.endswith(hash_fname):
-                                                self.extract_to(name, path,
-                                                    filename=fhash)
-                                                hashes.discard(fhash)
-                                                break
-                                if not hashes:
-                                        break
-
-                        if hashes:
+                        # Extract the first instance of any package file seen
+                        # for each hash.
+                        missing = set()
+                        for fhash in set(hashes):
+                                name = self.__extract_offsets.find_package_file(
+                                    fhash)
+                                if name is None:
+                                        missing.add(fhash)
+                                        continue
+                                self.extract_to(name, path, filename=fhash)
+
+                        if missing:
                                 # Any remaining hashes are for package files
                                 # that couldn't be found.
                                 raise UnknownArchiveFiles(self.__arc_name,
-                                    hashes)
+                                    missing)
                         return
 
                 for fhash in hashes:
@@ -1041,6 +1087,19 @@ class Archive(object):
 
                 assert not self.__closed and "r" in self.__mode
 
+                member = self.__get_member(src)
+
+                # Finally, return the object for the matching archive member.
+                try:
+                        return self.__arc_tfile.extractfile(member)
+                except KeyError:
+                        raise UnknownArchiveFiles(self.__arc_name, [src])
+
+        def __get_member(self, src):
+                """Private helper method that returns the TarInfo object for
+                the archive member 'src', or just 'src' if the offsets of the
+                archive's members aren't known."""
+
                 # Get the offset in the archive for the given file, and then
                 # seek to it.
                 offset = self.__extract_offsets.get(src, None)
@@ -1054,7 +1113,7 @@ class Archive(object):
                         try:
                                 # Get the tarinfo object needed to extract the
                                 # file.
-                                member = tf.TarInfo.fromtarfile(tfile)
+                                return tf.TarInfo.fromtarfile(tfile)
                         except tf.TarError:
                                 # Read error encountered.
                                 raise InvalidArchive(self.__arc_name)
@@ -1062,15 +1121,34 @@ class Archive(object):
                         # Assume there is no such archive member if extract
                         # offsets are known, but the item can't be found.
                         raise UnknownArchiveFiles(self.__arc_name, [src])
-                else:
-                        # No archive index; fallback to retrieval by name.
-                        member = src
 
-                # Finally, return the object for the matching archive member.
-                try:
-                        return tfile.extractfile(member)
-                except KeyError:
-                        raise UnknownArchiveFiles(self.__arc_name, [src])
+                # No archive index; fallback to retrieval by name.
+                return src
+
+        def get_file_extent(self, src):
+                """Returns a tuple of (offset, size) describing where the
+                content of an archive member is stored in the archive file, so
+                that it can be read or sent without going through a file-like
+                object from get_file().  If the member's content isn't stored
+                contiguously (for example, because it is a link), None is
+                returned instead, and get_file() must be used.
+
+                'src' is the pathname of the archive file to return the extent
+                of.
+                """
+
+                assert not self.__closed and "r" in self.__mode
+
+                member = self.__get_member(src)
+                if not isinstance(member, tf.TarInfo):
+                        try:
+                                member = self.__arc_tfile.getmember(member)
+                        except KeyError:
+                                raise UnknownArchiveFiles(self.__arc_name,
+                                    [src])
+                if not member.isreg() or member.issparse():
+                        return None
+                return member.offset_data, member.size
 
         def get_index(self):
                 """Returns the index, and extract_offsets from an Archive
@@ -1095,11 +1173,28 @@ class Archive(object):
                 'pub' is the prefix (name) of the publisher that the package
                 files are associated with.  If not provided, the first file
                 named after the given hash found in the archive will be used.
-                (This will be noticeably slower depending on the size of the
-                archive.)
                 """
 
                 assert not self.__closed and "r" in self.__mode
+                return self.get_file(self.__get_package_file_name(fhash, pub))
+
+        def get_package_file_extent(self, fhash, pub=None):
+                """Returns a tuple of (offset, size) describing where the
+                content of the first package file matching the given hash is
+                stored in the archive file, or None if it can't be accessed
+                that way; see get_file_extent() for details.
+
+                'fhash' and 'pub' are as described for get_package_file().
+                """
+
+                assert not self.__closed and "r" in self.__mode
+                return self.get_file_extent(self.__get_package_file_name(fhash,
+                    pub))
+
+        def __get_package_file_name(self, fhash, pub):
+                """Private helper method that returns the name of the archive
+                member for the package file named by 'fhash' for publisher
+                'pub', or for any publisher if 'pub' isn't provided."""
 
                 if not self.__extract_offsets:
                         # If the extraction index doesn't exist, scan the
@@ -1107,16 +1202,15 @@ class Archive(object):
                         self.__find_extract_offsets()
 
                 if not pub:
-                        # Scan extract offsets index for the first instance of
-                        # any package file seen for the hash and extract it.
-                        hash_fname = os.path.join("file", fhash[:2], fhash)
-                        for name in self.__extract_offsets:
-                                if name.endswith(hash_fname):
-                                        return self.get_file(name)
-                        raise UnknownArchiveFiles(self.__arc_name, [fhash])
+                        # Use the first instance of any package file seen for
+                        # the hash.
+                        name = self.__extract_offsets.find_package_file(fhash)
+                        if name is None:
+                                raise UnknownArchiveFiles(self.__arc_name,
+                                    [fhash])
+                        return name
 
-                return self.get_file(os.path.join("publisher", pub, "file",
-                    fhash[:2], fhash))
+                return os.path.join("publisher", pub, "file", fhash[:2], fhash)
 
         def get_package_manifest(self, pfmri, raw=False):
                 """Returns a package manifest from the archive.
@@ -1218,11 +1312,80 @@ class Archive(object):
                         self.__arc_file = None
                 self.__closed = True
 
-        def close(self, progtrack=None):
+        def __gen_queue(self, jobs):
+                """Private helper generator that empties the queue of files to
+                add to the archive, yielding a tuple of (pathname, arcname,
+                data) for each in order.  If 'jobs' is greater than 1, that
+                many threads read the content of upcoming regular files ahead
+                of the writer, which is provided as 'data'; otherwise 'data'
+                is None and the writer reads the file itself."""
+
+                if jobs <= 1:
+                        while self.__queue:
+                                src, arcname = self.__queue.popleft()
+                                yield src, arcname, None
+                        return
+
+                items = list(self.__queue)
+                self.__queue.clear()
+
+                # Only a limited number of files are read ahead at once to
+                # bound memory usage.
+                window = jobs * 4
+                cv = threading.Condition()
+                ready = {}
+                state = { "next": 0, "written": 0, "stop": False }
+
+                def read_ahead():
+                        while True:
+                                with cv:
+                                        while not state["stop"] and \
+                                            state["next"] - state["written"] >= \
+                                            window:
+                                                cv.wait()
+                                        i = state["next"]
+                                        if state["stop"] or i >= len(items):
+                                                return
+                                        state["next"] += 1
+                                data = _read_member(items[i][0])
+                                with cv:
+                                        ready[i] = data
+                                        cv.notify_all()
+
+                threads = [
+                    threading.Thread(target=read_ahead)
+                    for i in range(jobs)
+                ]
+                for t in threads:
+                        t.daemon = True
+                        t.start()
+
+                try:
+                        for i, (src, arcname) in enumerate(items):
+                                with cv:
+                                        while i not in ready:
+                                                cv.wait()
+                                        data = ready.pop(i)
+                                        state["written"] = i + 1
+                                        cv.notify_all()
+                                yield src, arcname, data
+                finally:
+                        with cv:
+                                state["stop"] = True
+                                cv.notify_all()
+                        for t in threads:
+                                t.join()
+
+        def close(self, progtrack=None, jobs=1):
                 """If mode is 'r', this will close the archive file.  If mode is
                 'w', this will write all queued files to the archive and close
                 it.  Further operations on the archive are not possible after
-                calling this function."""
+                calling this function.
+
+                'jobs' is an optional number of threads to use to read the
+                content of the queued files while the archive is written.
+                Files are always written to the archive in the order they were
+                queued, so the result doesn't depend on its value."""
 
                 assert not self.__closed
 
@@ -1291,11 +1454,15 @@ class Archive(object):
                 self.__index = None
 
                 # Add all queued files to the archive.
-                while self.__queue:
-                        src, arcname = self.__queue.popleft()
-
+                for src, arcname, data in self.__gen_queue(jobs):
                         start_offset = tfile.offset
-                        tfile.add(src, arcname=arcname, recursive=False)
+                        if data is None:
+                                tfile.add(src, arcname=arcname,
+                                    recursive=False)
+                        else:
+                                ti = tfile.gettarinfo(src, arcname=arcname)
+                                tfile.addfile(ti, ti.isreg() and
+                                    io.BytesIO(data) or None)
 
                         # tarfile caches member information for every item
                         # added by default, which provides fast access to the
@@ -43,12 +43,20 @@ over a pipe:
         _PipedTransport
         _PipedHTTPRequestHandler
         _PipedRequestHandler
+        _PipedFramedRequestHandler
         PipedRPCServer
 
 The following classes are implemented to allow RPC clients operations
 over a pipe:
         PipedServerProxy
 
+RPC servers and clients can optionally negotiate a compact framing for their
+requests.  A client that asks for framing sends its first request with HTTP
+encapsulation and a framing header.  If the server supports framing, it
+echoes that header back, and subsequent requests and responses are sent as
+length-prefixed messages without any HTTP encapsulation.  Otherwise the client
+keeps using HTTP encapsulation.
+
 RPC clients should be prepared to catch the following exceptions:
         ProtocolError1
         ProtocolError2
@@ -108,6 +116,15 @@ from pkg.misc import force_bytes, force_str
 logging.getLogger("jsonrpclib.SimpleJSONRPCServer").addHandler(
     logging.NullHandler())
 
+# Framed messages start with a header containing a magic value, which can never
+# start a HTTP request line, and the length of the message payload.
+_FRAME_HDR = struct.Struct(">4sI")
+_FRAME_MAGIC = b"\0PKF"
+
+# HTTP header used to negotiate framing, and the framing version we support.
+_FRAMING_HEADER = "X-Pkg-Pipe-Framing"
+_FRAMING_VERSION = "1"
+
 # debugging
 pipeutils_debug = (os.environ.get("PKG_PIPEUTILS_DEBUG", None) is not None)
 
@@ -180,7 +197,9 @@ class PipeFile(object):
                         msg = "fd={0:d}".format(fd)
                 else:
                         os.lseek(fd, os.SEEK_SET, 0)
-                        msg = "".join(os.fdopen(os.dup(fd)).readlines())
+                        # framed messages may not be valid text
+                        msg = force_str(os.fdopen(os.dup(fd), "rb").read(),
+                            errors="replace")
                         msg = "msg={0}".format(msg)
                         os.lseek(fd, os.SEEK_SET, 0)
 
@@ -255,6 +274,51 @@ class PipeFile(object):
                 self.sendfd(mf.fileno())
                 mf.close()
 
+        def sendframe(self, msg):
+                """Send a length-prefixed message via the pipe."""
+
+                msg = force_bytes(msg)
+                mf = tempfile.TemporaryFile(mode="w+b")
+                mf.write(_FRAME_HDR.pack(_FRAME_MAGIC, len(msg)))
+                mf.write(msg)
+                mf.flush()
+                self.sendfd(mf.fileno())
+                mf.close()
+
+        def recvframe(self):
+                """Receive a length-prefixed message via the pipe and return
+                its payload.  Can block waiting for input.
+
+                None is returned if the other end of the connection was
+                closed, or if the data received isn't a framed message.  In
+                the latter case the data can still be consumed via read() and
+                readline()."""
+
+                assert self.__readfh is None
+
+                fd = self.recvfd()
+                if fd == -1:
+                        return None
+
+                hdr = os.read(fd, _FRAME_HDR.size)
+                if len(hdr) != _FRAME_HDR.size or \
+                    not hdr.startswith(_FRAME_MAGIC):
+                        # not a framed message, so save the fd we received
+                        # for subsequent reads.
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        self.__readfh = os.fdopen(fd)
+                        return None
+
+                size = _FRAME_HDR.unpack(hdr)[1]
+                with os.fdopen(fd, "rb") as fh:
+                        msg = fh.read(size)
+                if len(msg) != size:
+                        self.debug_msg("recvframe", "failed (truncated)")
+                        raise IOError("recvframe() received a truncated "
+                            "message ({0:d} of {1:d} bytes)".format(
+                            len(msg), size))
+                return msg
+
         def close(self):
                 """Close the pipe."""
                 if self.closed:
@@ -381,6 +445,11 @@ class PipedHTTPResponse(http_client.HTTPResponse):
                 self.will_close = False
                 return
 
+        @property
+        def framing(self):
+                """Whether the server agreed to use framed requests."""
+                return self.getheader(_FRAMING_HEADER) == _FRAMING_VERSION
+
 
 class PipedHTTPConnection(http_client.HTTPConnection):
         """Create a httplib.HTTPConnection like object that can be used with
@@ -390,7 +459,7 @@ class PipedHTTPConnection(http_client.HTTPConnection):
         # we use PipedHTTPResponse in place of httplib.HTTPResponse
         response_class = PipedHTTPResponse
 
-        def __init__(self, fd, port=None):
+        def __init__(self, fd, port=None, framing=False):
                 assert port is None
 
                 # invoke parent constructor
@@ -401,6 +470,11 @@ class PipedHTTPConnection(http_client.HTTPConnection):
                 assert type(fd) == int and os.fstat(fd)
                 self.sock = PipeSocket(fd, "client-connection")
 
+                # whether to ask the server to use framed requests, and
+                # whether it agreed to.
+                self.__framing = framing
+                self.framing = False
+
         def __del__(self):
                 # make sure the destructor gets called for our pipe
                 if self.sock is not None:
@@ -415,14 +489,39 @@ class PipedHTTPConnection(http_client.HTTPConnection):
                 """Required to support select()."""
                 return self.sock.fileno()
 
+        def putrequest(self, method, url, *args, **kwargs):
+                """Start a request, asking the server to use framed requests
+                if we want to."""
+
+                http_client.HTTPConnection.putrequest(self, method, url,
+                    *args, **kwargs)
+                if self.__framing:
+                        self.putheader(_FRAMING_HEADER, _FRAMING_VERSION)
+
+        def getresponse(self, *args, **kwargs):
+                """Get the server's response, noting whether it agreed to
+                use framed requests."""
+
+                response = http_client.HTTPConnection.getresponse(self,
+                    *args, **kwargs)
+                self.framing = self.__framing and response.framing
+                return response
+
 
 class _PipedTransport(rpc.Transport):
         """Create a Transport object which can create new PipedHTTP
         connections via an existing pipe."""
 
-        def __init__(self, fd, http_enc=True):
+        def __init__(self, fd, http_enc=True, framing=False):
                 self.__pipe_file = PipeFile(fd, "client-transport")
                 self.__http_enc = http_enc
+
+                # framing is negotiated via HTTP encapsulated requests.
+                # __framing indicates if we still need to try negotiating it
+                # and __framed if the server agreed to it.
+                self.__framing = framing and http_enc
+                self.__framed = False
+                self.__http_conn = None
                 # This is a workaround to cope with the jsonrpclib update
                 # (version 0.2.6) more safely. Once jsonrpclib is out in
                 # the OS build, we can change it to always pass a 'config'
@@ -452,30 +551,56 @@ class _PipedTransport(rpc.Transport):
                 subsequently used to issue http requests."""
                 # Redefining name from outer scope; pylint: disable=W0621
 
-                assert self.__pipe_file is not None
-
-                client_pipefd, server_pipefd = os.pipe()
-                self.__pipe_file.sendfd(server_pipefd)
-                os.close(server_pipefd)
+                client_pipefd = self.__connect()
 
                 if self.__http_enc:
                         # we're using http encapsulation so return a
                         # PipedHTTPConnection object
-                        return PipedHTTPConnection(client_pipefd)
+                        self.__http_conn = PipedHTTPConnection(client_pipefd,
+                            framing=self.__framing)
+                        return self.__http_conn
 
                 # we're not using http encapsulation so return a
                 # PipeSocket object
                 return PipeSocket(client_pipefd, "client-connection",
                     http_enc=self.__http_enc)
 
+        def __connect(self):
+                """Create a new pipe, send one end of it to the server, and
+                return the other end."""
+
+                assert self.__pipe_file is not None
+
+                client_pipefd, server_pipefd = os.pipe()
+                self.__pipe_file.sendfd(server_pipefd)
+                os.close(server_pipefd)
+                return client_pipefd
+
         def request(self, host, handler, request_body, verbose=0):
                 """Send a request to the server."""
 
+                if self.__framed:
+                        # the server agreed to use framed requests.
+                        c = PipeSocket(self.__connect(), "client-connection")
+                        c.sendframe(request_body)
+                        response = c.recvframe()
+                        c.close()
+                        if response is None:
+                                raise IOError("no response received from "
+                                    "RPC server")
+                        return force_str(response)
+
                 if self.__http_enc:
                         # we're using http encapsulation so just pass the
                         # request to our parent class.
-                        return rpc.Transport.request(self,
+                        rv = rpc.Transport.request(self,
                             host, handler, request_body, verbose)
+                        if self.__framing:
+                                # we only negotiate framing once.
+                                self.__framing = False
+                                self.__framed = self.__http_conn.framing
+                        self.__http_conn = None
+                        return rv
 
                 c = self.make_connection(host)
                 c.send(request_body)
@@ -550,6 +675,12 @@ class _PipedRequestHandler(_PipedHTTPRequestHandler):
                 """Handle one client request."""
 
                 request = self.rfile.readline()
+                self.wfile.write(self._dispatch_request(request))
+                self.wfile.flush()
+
+        def _dispatch_request(self, request):
+                """Dispatch a client request and return the response."""
+
                 response = ""
                 try:
                         # Access to protected member; pylint: disable=W0212
@@ -571,17 +702,46 @@ class _PipedRequestHandler(_PipedHTTPRequestHandler):
                         # tell the server to exit
                         self.server.initiate_shutdown()
 
-                self.wfile.write(response)
-                self.wfile.flush()
+                return response
+
+
+class _PipedFramedRequestHandler(_PipedRequestHandler):
+        """Piped RPC request handler that accepts both framed requests and
+        requests that use HTTP encapsulation, and which lets clients know
+        that framed requests are supported."""
+
+        def handle_one_request(self):
+                """Handle one client request."""
+
+                request = self.rfile.recvframe()
+                if request is None:
+                        # not a framed request, so it must be using http
+                        # encapsulation.
+                        return _PipedHTTPRequestHandler.handle_one_request(
+                            self)
+
+                response = self._dispatch_request(force_str(request))
+                self.wfile.sendframe(response)
+                self.close_connection = True
+
+        def end_headers(self):
+                """Agree to use framed requests if the client asked to."""
+
+                if self.headers.get(_FRAMING_HEADER) == _FRAMING_VERSION:
+                        self.send_header(_FRAMING_HEADER, _FRAMING_VERSION)
+                _PipedHTTPRequestHandler.end_headers(self)
 
 
 class PipedRPCServer(_PipedServer, SimpleRPCDispatcher):
         """Modeled after SimpleRPCServer.  Differs in that
         SimpleRPCServer is derived from SocketServer.TCPServer but we're
-        derived from _PipedServer."""
+        derived from _PipedServer.
+
+        If 'framing' is True, clients using HTTP encapsulation may
+        negotiate the use of framed requests."""
 
         def __init__(self, addr,
-            logRequests=False, encoding=None, http_enc=True):
+            logRequests=False, encoding=None, http_enc=True, framing=False):
 
                 self.logRequests = logRequests
                 SimpleRPCDispatcher.__init__(self, encoding)
@@ -589,6 +749,8 @@ class PipedRPCServer(_PipedServer, SimpleRPCDispatcher):
                 requestHandler = _PipedHTTPRequestHandler
                 if not http_enc:
                         requestHandler = _PipedRequestHandler
+                elif framing:
+                        requestHandler = _PipedFramedRequestHandler
 
                 _PipedServer.__init__(self, addr, requestHandler,
                     http_enc=http_enc)
@@ -639,12 +801,16 @@ class PipedRPCServer(_PipedServer, SimpleRPCDispatcher):
 
 class PipedServerProxy(rpc.ServerProxy):
         """Create a ServerProxy object that can be used to make calls to
-        an RPC server on the other end of a pipe."""
+        an RPC server on the other end of a pipe.
+
+        If 'framing' is True, and HTTP encapsulation is used, the server is
+        asked to use framed requests.  If it agrees, all requests after the
+        first one are framed."""
 
         def __init__(self, pipefd, encoding=None, verbose=0, version=None,
-            http_enc=True):
+            http_enc=True, framing=False):
                 self.__piped_transport = _PipedTransport(pipefd,
-                    http_enc=http_enc)
+                    http_enc=http_enc, framing=framing)
                 rpc.ServerProxy.__init__(self,
                     "http://localhost/RPC2",
                     transport=self.__piped_transport,
@@ -591,6 +591,21 @@ class BooleanQuery(object):
                 return set(self.lc.search(None, *args)), \
                     set(self.rc.search(None, *args))
 
+        def postings(self, *args):
+                """Returns an iterator over the index entries for the actions
+                matched by this query, or None if they can't be found using
+                the index alone.  Entries are of the form (pfmri, offsets,
+                action type, key, value), where offsets are the offsets of
+                the matching actions in the manifest of pfmri."""
+
+                return None
+
+        def results_from_postings(self, postings):
+                """Converts the index entries in 'postings' produced by
+                postings() into search results."""
+
+                return self.lc.results_from_postings(postings)
+
         def sorted(self, res):
                 """Sort the results.  If the results are actions, sort by the
                 fmris of the packages from which they came."""
@@ -637,11 +652,24 @@ class AndQuery(BooleanQuery):
                 AST tree will have restriction set."""
 
                 if self.return_type == Query.RETURN_ACTIONS:
-                        # If actions are being returned, the answers from
-                        # previous terms must be used as the domain of search.
-                        # To do this, restriction is passed to the left
-                        # child and the result from that child is passed to
-                        # the right child as its domain.
+                        # If both children can be answered from the index,
+                        # the matching actions are found without reading
+                        # any manifests other than for the results.
+                        if restriction is None:
+                                res = self.postings(*args)
+                                if res is not None:
+                                        # Lines are stripped as they are by
+                                        # restricted searches.
+                                        return (
+                                            (at, st, pfmri, fv, l.strip())
+                                            for at, st, pfmri, fv, l
+                                            in self.results_from_postings(res)
+                                        )
+                        # Otherwise the answers from previous terms must be
+                        # used as the domain of search.  To do this,
+                        # restriction is passed to the left child and the
+                        # result from that child is passed to the right
+                        # child as its domain.
                         lc_it = self.lc.search(restriction, *args)
                         return self.rc.search(lc_it, *args)
                 else:
@@ -652,6 +680,41 @@ class AndQuery(BooleanQuery):
                         lc_set, rc_set = BooleanQuery.search(self, *args)
                         return self.sorted(lc_set & rc_set)
 
+        def postings(self, *args):
+                """Returns an iterator over the index entries of the left child
+                for the actions which the right child also matches, or None
+                if either child can't be answered from the index."""
+
+                if self.return_type != Query.RETURN_ACTIONS:
+                        return None
+                lc_it = self.lc.postings(*args)
+                if lc_it is None:
+                        return None
+                rc_it = self.rc.postings(*args)
+                if rc_it is None:
+                        return None
+                # An action is identified by the package it's from and its
+                # offset in that package's manifest.  Only these keys for the
+                # right child are held in memory, while the entries for the
+                # left child are filtered as they're found.
+                keys = set(
+                    (pfmri, o)
+                    for pfmri, offsets, at, st, fv in rc_it
+                    for o in offsets
+                )
+                return self.__filter_postings(lc_it, keys)
+
+        @staticmethod
+        def __filter_postings(it, keys):
+                """Yields the index entries from 'it' restricted to the actions
+                identified in 'keys'."""
+
+                if not keys:
+                        return
+                for pfmri, offsets, at, st, fv in it:
+                        offsets = [o for o in offsets if (pfmri, o) in keys]
+                        if offsets:
+                                yield pfmri, offsets, at, st, fv
 
         def __str__(self):
                 return "({0!s} AND {1!s})".format(self.lc, self.rc)
@@ -857,6 +920,12 @@ class PhraseQuery(object):
                 )
                 return it
 
+        def postings(self, *args):
+                """Phrases are matched against the actions themselves, so can't
+                be found using the index alone."""
+
+                return None
+
         def allow_version(self, v):
                 """Returns whether the query supports a query of version v."""
 
@@ -913,6 +982,17 @@ class FieldQuery(object):
                 assert self.query.return_type == Query.RETURN_ACTIONS
                 return self.query.search(restriction, *args)
 
+        def postings(self, *args):
+                """Returns the index entries for the structured query; see
+                BooleanQuery.postings."""
+
+                return self.query.postings(*args)
+
+        def results_from_postings(self, postings):
+                """Converts index entries into search results."""
+
+                return self.query.results_from_postings(postings)
+
         def allow_version(self, v):
                 """Returns whether the query supports a query of version v."""
 
@@ -943,13 +1023,6 @@ class TopQuery(object):
         def __str__(self):
                 return str(self.query)
 
-        def __keep(self, x):
-                """Determines whether the x'th result should be returned."""
-
-                return x >= self.start_point and \
-                    (self.num_to_return is None or
-                    x < self.num_to_return + self.start_point)
-
         def finalize_results(self, it):
                 """Converts the internal result representation to the format
                 which is expected by the callers of search.  It also handles
@@ -958,20 +1031,22 @@ class TopQuery(object):
                 # Need to replace "1" with current search version, or something
                 # similar
 
+                # Results are produced lazily, so no more of the search is
+                # performed once the last result requested has been returned.
+                stop = None
+                if self.num_to_return is not None:
+                        stop = self.start_point + self.num_to_return
+                it = itertools.islice(it, self.start_point, stop)
                 if self.query.return_type == Query.RETURN_ACTIONS:
                         return (
                             (1, Query.RETURN_ACTIONS,
                             (fmri.PkgFmri(pfmri), fv, force_str(l)))
-                            for x, (at, st, pfmri, fv, l)
-                            in enumerate(it)
-                            if self.__keep(x)
+                            for at, st, pfmri, fv, l in it
                         )
                 else:
                         return (
                             (1, Query.RETURN_PACKAGES, fmri.PkgFmri(pfmri))
-                            for x, pfmri
-                            in enumerate(it)
-                            if self.__keep(x)
+                            for pfmri in it
                         )
 
         def set_info(self, num_to_return, start_point, **kwargs):
@@ -1059,6 +1134,10 @@ class TermQuery(object):
                 self._data_manf = None
                 self._data_token_offset = None
                 self._data_main_dict = None
+                self._data_bin_main_dict = None
+                self._data_token_aux = None
+                self._delta_segments = []
+                self._data_tombstones = None
 
         def __init_gdd(self, path):
                 gdd = self._global_data_dict
@@ -1126,9 +1205,13 @@ class TermQuery(object):
                 gdd = cls._global_data_dict
                 cls.__lock_gdd(index_dir)
                 try:
-                        del gdd[index_dir]
-                except KeyError:
-                        pass
+                        # The data cached for the index's delta segments is
+                        # dropped as well.
+                        prefix = os.path.join(index_dir, "")
+                        for path in list(gdd.keys()):
+                                if path == index_dir or \
+                                    path.startswith(prefix):
+                                        del gdd[path]
                 finally:
                         cls.__unlock_gdd(index_dir)
 
@@ -1195,13 +1278,36 @@ class TermQuery(object):
                 try:
                         self._data_main_dict = \
                             ss.IndexStoreMainDict(ss.MAIN_FILE)
+                        # If the index has a binary main dictionary, tokens
+                        # are looked up in it directly, so the token byte
+                        # offset dictionary doesn't need to be read.
+                        self._data_bin_main_dict = None
+                        self._data_token_aux = None
+                        if os.path.exists(os.path.join(self._dir_path,
+                            ss.BINARY_MAIN_FILE)):
+                                self._data_bin_main_dict = \
+                                    ss.IndexStoreBinaryMainDict(
+                                        ss.BINARY_MAIN_FILE)
+                                tq_gdd.pop("token_byte_offset", None)
+                                # The auxiliary token indexes allow case
+                                # insensitive and wildcard searches to only
+                                # check some of the tokens.
+                                if os.path.exists(os.path.join(
+                                    self._dir_path, ss.TOKEN_AUX_FILE)):
+                                        self._data_token_aux = \
+                                            ss.IndexStoreTokenAux(
+                                                ss.TOKEN_AUX_FILE)
+                        elif "token_byte_offset" not in tq_gdd:
+                                tq_gdd["token_byte_offset"] = \
+                                    ss.IndexStoreDictMutable(
+                                        ss.BYTE_OFFSET_FILE)
                         if "fmri_offsets" not in tq_gdd:
                                 tq_gdd["fmri_offsets"] = ss.InvertedDict(
                                     ss.FMRI_OFFSETS_FILE, None)
                         # Create a temporary list of dictionaries we need to
                         # open consistently.
                         tmp = list(tq_gdd.values())
-                        tmp.append(self._data_main_dict)
+                        tmp.extend(self.__main_dicts())
                         try:
                                 # Try to open the index files assuming they
                                 # were made after the conversion to using the
@@ -1209,12 +1315,25 @@ class TermQuery(object):
                                 ret = ss.consistent_open(tmp, self._dir_path,
                                     self._file_timeout_secs)
                         except search_errors.InconsistentIndexException:
-                                # If opening the index fails, try falling
-                                # back to the index prior to the conversion
-                                # to using the fmri_offsets.v1 file.
-                                del tq_gdd["fmri_offsets"]
+                                if self._data_bin_main_dict is not None:
+                                        # The binary main dictionary may
+                                        # have been left behind by a newer
+                                        # version of pkg(7) if an older one
+                                        # updated the index, so fall back to
+                                        # the text main dictionary.
+                                        self._data_bin_main_dict = None
+                                        self._data_token_aux = None
+                                        tq_gdd["token_byte_offset"] = \
+                                            ss.IndexStoreDictMutable(
+                                                ss.BYTE_OFFSET_FILE)
+                                else:
+                                        # If opening the index fails, try
+                                        # falling back to the index prior to
+                                        # the conversion to using the
+                                        # fmri_offsets.v1 file.
+                                        del tq_gdd["fmri_offsets"]
                                 tmp = list(tq_gdd.values())
-                                tmp.append(self._data_main_dict)
+                                tmp.extend(self.__main_dicts())
                                 ret = ss.consistent_open(tmp, self._dir_path,
                                     self._file_timeout_secs)
                         if ret == None:
@@ -1246,7 +1365,7 @@ class TermQuery(object):
                                                 in tq_gdd.items()
                                             ])
                                         tmp = list(tq_gdd.values())
-                                        tmp.append(self._data_main_dict)
+                                        tmp.extend(self.__main_dicts())
                                         ret = ss.consistent_open(tmp,
                                             self._dir_path,
                                             self._file_timeout_secs)
@@ -1260,7 +1379,7 @@ class TermQuery(object):
                                                 for d in tq_gdd.values():
                                                         d.read_dict_file()
                                         except:
-                                                self._data_main_dict.close_file_handle()
+                                                self._close_dicts()
                                                 raise
 
                         finally:
@@ -1270,22 +1389,90 @@ class TermQuery(object):
                                         d.close_file_handle()
                         self._data_manf = tq_gdd["manf"]
 
-                        self._data_token_offset = tq_gdd["token_byte_offset"]
+                        if self._data_bin_main_dict is not None:
+                                # The text main dictionary was only opened to
+                                # check that its version is consistent with
+                                # the binary one.
+                                self._data_main_dict.close_file_handle()
+                                self._data_main_dict = self._data_bin_main_dict
+                                self._data_token_offset = \
+                                    self._data_bin_main_dict
+                        else:
+                                self._data_token_offset = \
+                                    tq_gdd["token_byte_offset"]
                         self._data_fmri_offsets = tq_gdd.get("fmri_offsets",
                             None)
+                        self.__read_delta_state(ret)
                 finally:
                         self.__unlock_gdd(self._dir_path)
 
+        def __read_delta_state(self, version):
+                """Reads the names of the delta segments of the index and the
+                packages removed from it since it was last compacted, if
+                they're consistent with the main index, which is at
+                'version'."""
+
+                self._delta_segments = []
+                self._data_tombstones = None
+                if not os.path.exists(os.path.join(self._dir_path,
+                    ss.DELTA_SEGMENTS_FILE)):
+                        return
+                segments = ss.IndexStoreSet(ss.DELTA_SEGMENTS_FILE)
+                tombstones = ss.IndexStoreSet(ss.TOMBSTONE_FILE)
+                try:
+                        # Left over files from before the index was last
+                        # compacted have an older version and are ignored.
+                        if ss.consistent_open((segments, tombstones),
+                            self._dir_path,
+                            self._file_timeout_secs) != version:
+                                return
+                        segments.read_dict_file()
+                        tombstones.read_dict_file()
+                finally:
+                        segments.close_file_handle()
+                        tombstones.close_file_handle()
+                self._delta_segments = sorted(segments.get_set())
+                if tombstones.get_set():
+                        self._data_tombstones = tombstones
+
+        def __main_dicts(self):
+                """Returns the main dictionaries which need to be opened
+                along with the global dictionaries."""
+
+                if self._data_bin_main_dict is None:
+                        return [self._data_main_dict]
+                if self._data_token_aux is None:
+                        return [self._data_main_dict, self._data_bin_main_dict]
+                return [self._data_main_dict, self._data_bin_main_dict,
+                    self._data_token_aux]
+
         def allow_version(self, v):
                 """Returns whether the query supports a query of version v."""
                 return True
 
+        def postings(self, *args):
+                """Returns an iterator over the index entries matching the term,
+                or None if it can't be answered from the index alone; see
+                BooleanQuery.postings."""
+
+                return None
+
+        def results_from_postings(self, postings):
+                """Converts index entries into search results by reading the
+                matching actions from the manifests."""
+
+                return self._get_results(postings)
+
         def _close_dicts(self):
                 """Closes the main dictionary file handle, which is handled
                 separately from the other dictionaries since it's not read
                 entirely into memory in one shot."""
 
                 self._data_main_dict.close_file_handle()
+                if self._data_bin_main_dict is not None:
+                        self._data_bin_main_dict.close_file_handle()
+                if self._data_token_aux is not None:
+                        self._data_token_aux.close_file_handle()
 
         @staticmethod
         def flatten(lst):
@@ -1337,15 +1524,6 @@ class TermQuery(object):
                         if matches:
                                 yield at, st, fmri_str, fv, l
 
-        def __offset_line_read(self, offsets):
-                """Takes a group of byte offsets into the main dictionary and
-                reads the lines starting at those byte offsets."""
-
-                md_fh = self._data_main_dict.get_file_handle()
-                for o in sorted(offsets):
-                        md_fh.seek(o)
-                        yield md_fh.readline()
-
         def _read_pkg_dirs(self, fmris):
                 """Legacy function used to search indexes which have a pkg
                 directory with fmri offset information instead of the
@@ -1377,14 +1555,72 @@ class TermQuery(object):
                                 pkg_offsets.add(int(l))
                 return pkg_offsets
 
+        def __restrict_offsets(self, name, offsets):
+                """Returns the main dictionary offsets listed in the file 'name'
+                in the index directory which are also in 'offsets', or all of
+                them if 'offsets' is None.  The file is read incrementally so
+                that only the offsets kept are held in memory."""
+
+                try:
+                        fh = open(os.path.join(self._dir_path, name), "rb")
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
+                        # If the file doesn't exist, then no actions with that
+                        # action type or key were indexed.
+                        return set()
+                with fh:
+                        if offsets is None:
+                                return set(int(l) for l in fh)
+                        return set(
+                            o for o in (int(l) for l in fh) if o in offsets
+                        )
+
         def _search_internal(self, fmris):
-                """Searches the indexes in dir_path for any matches of query
-                and the results in self.res.  The method assumes the
-                dictionaries have already been loaded and read appropriately.
+                """Searches the indexes in dir_path, and any delta segments
+                they have, for any matches of query and the results in
+                self.res.  Results for packages which have been removed since
+                the index was last compacted are skipped.  The method assumes
+                the dictionaries have already been loaded and read
+                appropriately.
 
                 The "fmris" parameter is a generator of fmris of installed
                 packages."""
 
+                res = self.__search_index(fmris)
+                if self._delta_segments:
+                        res = itertools.chain(res, *[
+                            self.__search_delta_segment(name, fmris)
+                            for name in self._delta_segments
+                        ])
+                if self._data_tombstones is not None:
+                        tombstones = self._data_tombstones
+                        res = (
+                            r for r in res
+                            if not tombstones.has_entity(r[0])
+                        )
+                return res
+
+        def __search_delta_segment(self, name, fmris):
+                """Searches the delta segment 'name' of the index in dir_path.
+                A delta segment is a complete index of the packages added
+                since the index was last compacted."""
+
+                seg = copy.copy(self)
+                try:
+                        TermQuery.set_info(seg, os.path.join(self._dir_path,
+                            name), self._manifest_path_func,
+                            self._case_sensitive)
+                except search_errors.NoIndexException:
+                        # The segment was compacted into the main
+                        # dictionary since the index was opened.
+                        return
+                for r in seg.__search_index(fmris):
+                        yield r
+
+        def __search_index(self, fmris):
+                """Searches the main dictionary of the index in dir_path."""
+
                 assert self._data_main_dict.get_file_handle() is not None
 
                 glob = self._glob
@@ -1401,12 +1637,30 @@ class TermQuery(object):
                         # If the term has at least one non-wildcard character
                         # in it, do the glob search.
                         if TermQuery.has_non_wildcard_character.match(term):
-                                keys = self._data_token_offset.get_keys()
-                                matches = choose(keys, term, case_sensitive)
-                                offsets = set([
-                                    self._data_token_offset.get_id(match)
-                                    for match in matches
-                                ])
+                                cands = None
+                                if self._data_token_aux is not None:
+                                        cands = self._data_token_aux.\
+                                            get_candidates(term)
+                                if cands is not None:
+                                        # Only the tokens the auxiliary
+                                        # indexes found need to be checked.
+                                        ids = dict(self._data_main_dict.
+                                            get_tokens(cands))
+                                        matches = choose(list(ids.keys()),
+                                            term, case_sensitive)
+                                        offsets = set([
+                                            ids[match] for match in matches
+                                        ])
+                                else:
+                                        keys = \
+                                            self._data_token_offset.get_keys()
+                                        matches = choose(keys, term,
+                                            case_sensitive)
+                                        offsets = set([
+                                            self._data_token_offset.get_id(
+                                                match)
+                                            for match in matches
+                                        ])
                 elif self._data_token_offset.has_entity(term):
                         offsets = set([
                             self._data_token_offset.get_id(term)])
@@ -1430,55 +1684,24 @@ class TermQuery(object):
                                 offsets &= pkg_offsets
                 # Restrict results by action type.
                 if not self.action_type_wildcard:
-                        tmp_set = set()
-                        try:
-                                fh = open(os.path.join(self._dir_path,
-                                    "__at_" + self.action_type), "rb")
-                                for l in fh:
-                                        tmp_set.add(int(l.strip()))
-                                if offsets is None:
-                                        offsets = tmp_set
-                                else:
-                                        offsets &= tmp_set
-                        except EnvironmentError as e:
-                                if e.errno != errno.ENOENT:
-                                        raise
-                                # If the file doesn't exist, then no actions
-                                # with that action type were indexed.
-                                offsets = set()
+                        offsets = self.__restrict_offsets(
+                            "__at_" + self.action_type, offsets)
                 # Restrict results by key.
                 if not self.key_wildcard:
-                        tmp_set = set()
-                        try:
-                                fh = open(os.path.join(self._dir_path,
-                                    "__st_" + self.key), "rb")
-                                for l in fh:
-                                        tmp_set.add(int(l))
-                                if offsets is None:
-                                        offsets = tmp_set
-                                else:
-                                        offsets &= tmp_set
-                        except EnvironmentError as e:
-                                if e.errno != errno.ENOENT:
-                                        raise
-                                # If the file doesn't exist, then no actions
-                                # with that key were indexed.
-                                offsets = set()
-                line_iter = EmptyI
+                        offsets = self.__restrict_offsets(
+                            "__st_" + self.key, offsets)
+                entry_iter = EmptyI
                 # If offsets isn't None, then the set of results has been
                 # restricted so iterate through those offsets.
                 if offsets is not None:
-                        line_iter = self.__offset_line_read(offsets)
+                        entry_iter = self._data_main_dict.gen_entries(offsets)
                 # If offsets is None and the term was only wildcard search
                 # tokens, return results for every known token.
                 elif glob and \
                     not TermQuery.has_non_wildcard_character.match(term):
-                        line_iter = self._data_main_dict.get_file_handle()
+                        entry_iter = self._data_main_dict.gen_entries()
 
-                for line in line_iter:
-                        assert not line == '\n'
-                        tok, at_lst = \
-                            self._data_main_dict.parse_main_dict_line(line)
+                for tok, at_lst in entry_iter:
                         # Check that the token was what was expected.
                         assert ((term == tok) or
                             (not case_sensitive and
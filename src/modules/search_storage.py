@@ -24,16 +24,21 @@
 # Copyright (c) 2010, 2016, Oracle and/or its affiliates. All rights reserved.
 #
 
+import array
 import os
 import errno
+import mmap
+import re
+import struct
 import time
 import hashlib
+import zlib
 from six.moves.urllib.parse import quote, unquote
 
 import pkg.fmri as fmri
 import pkg.search_errors as search_errors
 import pkg.portable as portable
-from pkg.misc import PKG_FILE_BUFSIZ, force_bytes
+from pkg.misc import PKG_FILE_BUFSIZ, force_bytes, force_str
 
 FAST_ADD = 'fast_add.v1'
 FAST_REMOVE = 'fast_remove.v1'
@@ -43,6 +48,10 @@ MAIN_FILE = 'main_dict.ascii.v2'
 BYTE_OFFSET_FILE = 'token_byte_offset.v1'
 FULL_FMRI_HASH_FILE = 'full_fmri_list.hash'
 FMRI_OFFSETS_FILE = 'fmri_offsets.v1'
+BINARY_MAIN_FILE = 'main_dict.bin.v1'
+TOKEN_AUX_FILE = 'token_aux.bin.v1'
+DELTA_SEGMENTS_FILE = 'delta_segments.v1'
+TOMBSTONE_FILE = 'tombstones.v1'
 
 def consistent_open(data_list, directory, timeout = 1):
         """Opens all data holders in data_list and ensures that the
@@ -75,7 +84,7 @@ def consistent_open(data_list, directory, timeout = 1):
                         # in the function is greater than timeout.
                         try:
                                 f = os.path.join(directory, d.get_file_name())
-                                fh = open(f, 'r')
+                                fh = open(f, d.open_mode)
                                 # If we get here, then the current index file
                                 # is present.
                                 if missing == None:
@@ -88,8 +97,7 @@ def consistent_open(data_list, directory, timeout = 1):
                                         break
                                 d.set_file_handle(fh, f)
                                 version_tmp = fh.readline()
-                                version_num = \
-                                    int(version_tmp.split(' ')[1].rstrip('\n'))
+                                version_num = int(version_tmp.split()[1])
                                 # Read the version. If this is the first file,
                                 # set the expected version otherwise check that
                                 # the version matches the expected version.
@@ -135,6 +143,9 @@ class IndexStoreBase(object):
         calls.
         """
 
+        # The mode consistent_open uses to open the file backing this storage.
+        open_mode = 'r'
+
         def __init__(self, file_name):
                 self._name = file_name
                 self._file_handle = None
@@ -249,6 +260,29 @@ class IndexStoreMainDict(IndexStoreBase):
                 """
                 return self._file_handle
 
+        def gen_entries(self, offsets=None):
+                """Yields the token and the parsed entries for each line of
+                the main dictionary.  If offsets is provided, only the lines
+                starting at those byte offsets are read, in increasing order;
+                otherwise, every line after the current position of the file
+                handle is read."""
+
+                if offsets is None:
+                        lines = self._file_handle
+                else:
+                        lines = self.__offset_line_read(offsets)
+                for line in lines:
+                        assert not line == '\n'
+                        yield self.parse_main_dict_line(line)
+
+        def __offset_line_read(self, offsets):
+                """Takes a group of byte offsets into the main dictionary and
+                reads the lines starting at those byte offsets."""
+
+                for o in sorted(offsets):
+                        self._file_handle.seek(o)
+                        yield self._file_handle.readline()
+
         @staticmethod
         def parse_main_dict_line(line):
                 """Parses one line of a main dictionary file.
@@ -371,6 +405,752 @@ class IndexStoreMainDict(IndexStoreBase):
                 self._old_suffix = self._name + suffix
 
 
+def _encode_varint(buf, val):
+        """Appends the unsigned integer val to the bytearray buf using seven
+        bits per byte, with the high bit set on all but the last byte."""
+
+        while val > 0x7f:
+                buf.append((val & 0x7f) | 0x80)
+                val >>= 7
+        buf.append(val)
+
+
+def _decode_varint(buf, pos):
+        """Decodes an integer written by _encode_varint from the bytearray buf
+        starting at pos.  Returns the integer and the position of the byte
+        following it."""
+
+        val = 0
+        shift = 0
+        while True:
+                b = buf[pos]
+                pos += 1
+                val |= (b & 0x7f) << shift
+                if b < 0x80:
+                        return val, pos
+                shift += 7
+
+
+class IndexStoreMapped(IndexStoreBase):
+        """Base class for binary index files which are mapped into memory
+        while they're open, so the operating system shares and caches their
+        pages between searches.  After the version line, each file starts
+        with the MAGIC of its class followed by a header which
+        _read_header processes."""
+
+        MAGIC = None
+
+        open_mode = 'rb'
+
+        def __init__(self, file_name):
+                IndexStoreBase.__init__(self, file_name)
+                self._map = None
+
+        def set_file_handle(self, f_handle, f_path):
+                IndexStoreBase.set_file_handle(self, f_handle, f_path)
+                self._map = mmap.mmap(f_handle.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+                start = self._map.find(b"\n") + 1
+                if self._map[start:start + len(self.MAGIC)] != self.MAGIC:
+                        raise search_errors.InconsistentIndexException(
+                            os.path.dirname(f_path))
+                self._read_header(start + len(self.MAGIC))
+
+        def _read_header(self, start):
+                """Reads the header which starts at the given position in the
+                mapped file."""
+
+                raise NotImplementedError()
+
+        def get_file_handle(self):
+                return self._file_handle
+
+        def close_file_handle(self):
+                """Unmaps the file and closes the file handle."""
+
+                if self._map is not None:
+                        self._map.close()
+                        self._map = None
+                IndexStoreBase.close_file_handle(self)
+
+        def _write_out_file(self, path, version_num, header, sections):
+                """Writes the version line, MAGIC, and header to path,
+                followed by each of the sections.  A section is either a
+                bytearray or the path of a temporary file, which is copied and
+                then removed."""
+
+                with open(path, "wb", buffering=PKG_FILE_BUFSIZ) as fh:
+                        fh.write(force_bytes("VERSION: {0}\n".format(
+                            version_num)))
+                        fh.write(self.MAGIC)
+                        fh.write(header)
+                        for sect in sections:
+                                if isinstance(sect, bytearray):
+                                        fh.write(sect)
+                                        continue
+                                with open(sect, "rb") as sfh:
+                                        while True:
+                                                data = sfh.read(
+                                                    PKG_FILE_BUFSIZ)
+                                                if not data:
+                                                        break
+                                                fh.write(data)
+                                portable.remove(sect)
+
+        def _header_start(self, version_num, header_size):
+                """Returns the position following the header of a file
+                written with the given version number."""
+
+                return len(force_bytes("VERSION: {0}\n".format(
+                    version_num))) + len(self.MAGIC) + header_size
+
+        def count_entries_removed_during_partial_indexing(self):
+                """Returns the number of entries removed during a second phase
+                of indexing.
+                """
+                return 0
+
+
+class IndexStoreBinaryMainDict(IndexStoreMapped):
+        """Class for representing the binary form of the main dictionary.
+        It holds the same information as the text main dictionary, but sorted
+        tokens can be found by binary search and only the entries for
+        matching tokens need to be decoded.
+
+        After the version line, the file contains a magic string followed by
+        a header of little endian 64-bit integers describing where each
+        section starts.  The sections are:
+
+            - a table of the action types and keys used in the entries,
+
+            - the tokens, in blocks of BLOCK_SIZE.  Each token is stored as
+              the length of the prefix it shares with the previous token in
+              its block, followed by the rest of the token and the location
+              and length of its entries,
+
+            - the position of each block of tokens,
+
+            - the byte offset of each token's line in the text main
+              dictionary, which is the id used by the token byte offset,
+              fmri offset, action type, and key indexes,
+
+            - the entries for each token, encoded as nested counted lists of
+              variable length integers in the structure parse_main_dict_line
+              produces.  Full values equal to the token are stored as a
+              zero length, and manifest offsets are delta encoded.
+
+        The text main dictionary remains the source for incremental index
+        updates; this file is rewritten alongside it.
+        """
+
+        MAGIC = b"PKGSIDX1"
+        BLOCK_SIZE = 16
+
+        __header = struct.Struct("<8Q")
+        __offset = struct.Struct("<Q")
+
+        def __init__(self, file_name):
+                IndexStoreMapped.__init__(self, file_name)
+                self._strings = []
+                self._str_ids = {}
+                self._num_tokens = 0
+                self._num_blocks = 0
+                self._tokens_start = 0
+                self._blocks_start = 0
+                self._offsets_start = 0
+                self._entries_start = 0
+                self._end = 0
+                self._last_block = None
+                self._out_dir = None
+                self._out_version = None
+                self._tok_fh = None
+                self._ent_fh = None
+                self._off_fh = None
+                self._block_pos = []
+                self._tok_size = 0
+                self._ent_size = 0
+                self._prev_tok = None
+
+        def _read_header(self, start):
+                (self._num_tokens, self._num_blocks, str_start,
+                    self._tokens_start, self._blocks_start,
+                    self._offsets_start, self._entries_start,
+                    self._end) = self.__header.unpack_from(self._map, start)
+                buf = bytearray(self._map[str_start:self._tokens_start])
+                cnt, pos = _decode_varint(buf, 0)
+                self._strings = []
+                for i in range(cnt):
+                        l, pos = _decode_varint(buf, pos)
+                        self._strings.append(force_str(bytes(buf[pos:pos + l])))
+                        pos += l
+                self._last_block = None
+
+        def close_file_handle(self):
+                self._last_block = None
+                IndexStoreMapped.close_file_handle(self)
+
+        def open_out_file(self, use_dir, version_num):
+                """Prepares to write the dictionary into use_dir via
+                write_entry.  The sections are written to temporary files
+                which close_out_file assembles into the final file."""
+
+                self._out_dir = use_dir
+                self._out_version = version_num
+                path = os.path.join(use_dir, self._name)
+                self._tok_fh = open(path + ".tok", "wb",
+                    buffering=PKG_FILE_BUFSIZ)
+                self._ent_fh = open(path + ".ent", "wb",
+                    buffering=PKG_FILE_BUFSIZ)
+                self._off_fh = open(path + ".off", "wb",
+                    buffering=PKG_FILE_BUFSIZ)
+                self._strings = []
+                self._str_ids = {}
+                self._block_pos = []
+                self._num_tokens = 0
+                self._tok_size = 0
+                self._ent_size = 0
+                self._prev_tok = None
+
+        def __get_str_id(self, s):
+                try:
+                        return self._str_ids[s]
+                except KeyError:
+                        self._str_ids[s] = len(self._strings)
+                        self._strings.append(s)
+                        return self._str_ids[s]
+
+        def write_entry(self, token, entries, main_dict_offset):
+                """Adds a token to the dictionary.  Tokens must be written in
+                sorted order.  The "entries" parameter has the structure
+                described in _write_main_dict_line in indexer.py, and
+                "main_dict_offset" is the byte offset of the token's line in
+                the text main dictionary."""
+
+                tok = force_bytes(token)
+                buf = bytearray()
+                _encode_varint(buf, len(entries))
+                for at, st_list in entries:
+                        _encode_varint(buf, self.__get_str_id(at))
+                        _encode_varint(buf, len(st_list))
+                        for st, fv_list in st_list:
+                                _encode_varint(buf, self.__get_str_id(st))
+                                _encode_varint(buf, len(fv_list))
+                                for fv, p_list in fv_list:
+                                        fv = force_bytes(fv)
+                                        if fv == tok:
+                                                _encode_varint(buf, 0)
+                                        else:
+                                                _encode_varint(buf, len(fv) + 1)
+                                                buf.extend(fv)
+                                        _encode_varint(buf, len(p_list))
+                                        for p_id, m_off_set in p_list:
+                                                _encode_varint(buf, int(p_id))
+                                                _encode_varint(buf,
+                                                    len(m_off_set))
+                                                old_o = 0
+                                                for o in sorted(
+                                                    int(o) for o in m_off_set):
+                                                        _encode_varint(buf,
+                                                            o - old_o)
+                                                        old_o = o
+                self._ent_fh.write(buf)
+
+                tbuf = bytearray()
+                if self._num_tokens % self.BLOCK_SIZE == 0:
+                        self._block_pos.append(self._tok_size)
+                        prefix = 0
+                else:
+                        prefix = len(os.path.commonprefix(
+                            [self._prev_tok, tok]))
+                _encode_varint(tbuf, prefix)
+                _encode_varint(tbuf, len(tok) - prefix)
+                tbuf.extend(tok[prefix:])
+                _encode_varint(tbuf, self._ent_size)
+                _encode_varint(tbuf, len(buf))
+                self._tok_fh.write(tbuf)
+                self._off_fh.write(self.__offset.pack(main_dict_offset))
+
+                self._tok_size += len(tbuf)
+                self._ent_size += len(buf)
+                self._num_tokens += 1
+                self._prev_tok = tok
+
+        def close_out_file(self):
+                """Assembles the sections written by write_entry into the
+                dictionary file and removes the temporary files."""
+
+                path = os.path.join(self._out_dir, self._name)
+                for fh in (self._tok_fh, self._ent_fh, self._off_fh):
+                        fh.close()
+                self._tok_fh = self._ent_fh = self._off_fh = None
+
+                strings = bytearray()
+                _encode_varint(strings, len(self._strings))
+                for s in self._strings:
+                        s = force_bytes(s)
+                        _encode_varint(strings, len(s))
+                        strings.extend(s)
+                blocks = bytearray(b"".join(
+                    self.__offset.pack(p) for p in self._block_pos))
+
+                str_start = self._header_start(self._out_version,
+                    self.__header.size)
+                tokens_start = str_start + len(strings)
+                blocks_start = tokens_start + self._tok_size
+                offsets_start = blocks_start + len(blocks)
+                entries_start = offsets_start + \
+                    self.__offset.size * self._num_tokens
+                end = entries_start + self._ent_size
+
+                self._write_out_file(path, self._out_version,
+                    self.__header.pack(self._num_tokens, len(self._block_pos),
+                    str_start, tokens_start, blocks_start, offsets_start,
+                    entries_start, end),
+                    [strings, path + ".tok", blocks, path + ".off",
+                    path + ".ent"])
+                self._block_pos = []
+                self._str_ids = {}
+
+        def write_dict_file(self, path, version_num):
+                """Writes out an empty dictionary."""
+
+                self.open_out_file(path, version_num)
+                self.close_out_file()
+
+        def __read_offset(self, pos):
+                return self.__offset.unpack_from(self._map, pos)[0]
+
+        def __read_block(self, block):
+                """Returns a list of (token, entries position, entries length)
+                tuples for the tokens in the given block.  Tokens are returned
+                as bytes."""
+
+                if self._last_block is not None and \
+                    self._last_block[0] == block:
+                        return self._last_block[1]
+                start = self._tokens_start + \
+                    self.__read_offset(self._blocks_start +
+                    block * self.__offset.size)
+                if block + 1 < self._num_blocks:
+                        end = self._tokens_start + \
+                            self.__read_offset(self._blocks_start +
+                            (block + 1) * self.__offset.size)
+                else:
+                        end = self._blocks_start
+                buf = bytearray(self._map[start:end])
+                res = []
+                pos = 0
+                tok = b""
+                while pos < len(buf):
+                        prefix, pos = _decode_varint(buf, pos)
+                        l, pos = _decode_varint(buf, pos)
+                        tok = tok[:prefix] + bytes(buf[pos:pos + l])
+                        pos += l
+                        ent_pos, pos = _decode_varint(buf, pos)
+                        ent_len, pos = _decode_varint(buf, pos)
+                        res.append((tok, ent_pos, ent_len))
+                self._last_block = (block, res)
+                return res
+
+        def __first_token(self, block):
+                """Returns the first token of the given block without decoding
+                the rest of the block."""
+
+                start = self._tokens_start + \
+                    self.__read_offset(self._blocks_start +
+                    block * self.__offset.size)
+                # The first token of a block shares no prefix, so it's
+                # preceded by two variable length integers of at most ten
+                # bytes each.
+                buf = bytearray(self._map[start:start + 20])
+                prefix, pos = _decode_varint(buf, 0)
+                l, pos = _decode_varint(buf, pos)
+                return bytes(self._map[start + pos:start + pos + l])
+
+        def __find(self, token):
+                """Returns the index of token in the dictionary, or None if
+                the token isn't present."""
+
+                try:
+                        tok = force_bytes(token)
+                except UnicodeEncodeError:
+                        return None
+                lo = 0
+                hi = self._num_blocks
+                # Find the last block whose first token is not greater than
+                # the token being looked for.
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if tok < self.__first_token(mid):
+                                hi = mid
+                        else:
+                                lo = mid + 1
+                if lo == 0:
+                        return None
+                block = lo - 1
+                for i, (t, ent_pos, ent_len) in \
+                    enumerate(self.__read_block(block)):
+                        if t == tok:
+                                return block * self.BLOCK_SIZE + i
+                        if t > tok:
+                                break
+                return None
+
+        def has_entity(self, entity):
+                return self.__find(entity) is not None
+
+        def get_id(self, entity):
+                """Returns the byte offset into the text main dictionary of
+                the line for entity.  This is the id used by the other
+                indexes."""
+
+                i = self.__find(entity)
+                if i is None:
+                        raise KeyError(entity)
+                return self.__read_offset(self._offsets_start +
+                    i * self.__offset.size)
+
+        def get_keys(self):
+                return [
+                    force_str(t)
+                    for b in range(self._num_blocks)
+                    for t, ent_pos, ent_len in self.__read_block(b)
+                ]
+
+        def get_tokens(self, indexes):
+                """Yields the token and the id, as returned by get_id, of each
+                of the tokens at the given sorted indexes."""
+
+                for i in indexes:
+                        t, ent_pos, ent_len = self.__read_block(
+                            i // self.BLOCK_SIZE)[i % self.BLOCK_SIZE]
+                        yield force_str(t), self.__read_offset(
+                            self._offsets_start + i * self.__offset.size)
+
+        def __decode_entries(self, tok, ent_pos, ent_len):
+                """Decodes the entries for a token into the structure that
+                IndexStoreMainDict.parse_main_dict_line produces."""
+
+                start = self._entries_start + ent_pos
+                buf = bytearray(self._map[start:start + ent_len])
+                str_tok = force_str(tok)
+                strings = self._strings
+                res = []
+                at_cnt, pos = _decode_varint(buf, 0)
+                for i in range(at_cnt):
+                        at, pos = _decode_varint(buf, pos)
+                        st_cnt, pos = _decode_varint(buf, pos)
+                        at_res = []
+                        for j in range(st_cnt):
+                                st, pos = _decode_varint(buf, pos)
+                                fv_cnt, pos = _decode_varint(buf, pos)
+                                st_res = []
+                                for k in range(fv_cnt):
+                                        l, pos = _decode_varint(buf, pos)
+                                        if l == 0:
+                                                fv = str_tok
+                                        else:
+                                                fv = force_str(bytes(
+                                                    buf[pos:pos + l - 1]))
+                                                pos += l - 1
+                                        p_cnt, pos = _decode_varint(buf, pos)
+                                        fv_res = []
+                                        for m in range(p_cnt):
+                                                p_id, pos = \
+                                                    _decode_varint(buf, pos)
+                                                o_cnt, pos = \
+                                                    _decode_varint(buf, pos)
+                                                offsets = []
+                                                o = 0
+                                                for n in range(o_cnt):
+                                                        d, pos = \
+                                                            _decode_varint(buf,
+                                                            pos)
+                                                        o += d
+                                                        offsets.append(o)
+                                                fv_res.append((p_id, offsets))
+                                        st_res.append((fv, fv_res))
+                                at_res.append((strings[st], st_res))
+                        res.append((strings[at], at_res))
+                return str_tok, res
+
+        def __find_offset(self, offset):
+                """Returns the index of the token whose text main dictionary
+                line starts at offset.  Offsets increase with the token
+                index, so a binary search is used."""
+
+                lo = 0
+                hi = self._num_tokens
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if self.__read_offset(self._offsets_start +
+                            mid * self.__offset.size) < offset:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                assert lo < self._num_tokens and \
+                    self.__read_offset(self._offsets_start +
+                    lo * self.__offset.size) == offset
+                return lo
+
+        def gen_entries(self, offsets=None):
+                """Yields the token and the decoded entries for each token in
+                the dictionary, in the same form as
+                IndexStoreMainDict.gen_entries.  If offsets is provided, only
+                the tokens whose text main dictionary lines start at those
+                byte offsets are returned."""
+
+                if offsets is None:
+                        for b in range(self._num_blocks):
+                                for t, ent_pos, ent_len in \
+                                    self.__read_block(b):
+                                        yield self.__decode_entries(t,
+                                            ent_pos, ent_len)
+                        return
+                for o in sorted(offsets):
+                        i = self.__find_offset(o)
+                        t, ent_pos, ent_len = self.__read_block(
+                            i // self.BLOCK_SIZE)[i % self.BLOCK_SIZE]
+                        yield self.__decode_entries(t, ent_pos, ent_len)
+
+
+class IndexStoreTokenAux(IndexStoreMapped):
+        """Class for the auxiliary token indexes which allow case insensitive
+        and wildcard searches to avoid matching the search term against every
+        token in the binary main dictionary.  Tokens are referred to by their
+        index in IndexStoreBinaryMainDict, which must be written at the same
+        time.
+
+        The case folded index holds the crc32 of each lower cased token paired
+        with the token's index, sorted by the crc32.  The trigram index holds
+        a sorted table of every three byte sequence found in the lower cased
+        tokens, each pointing at the delta encoded indexes of the tokens
+        containing it.
+
+        Only ASCII tokens are added to those indexes, since case insensitive
+        matching of other characters doesn't always agree with lower().  The
+        indexes of the remaining tokens are stored separately and are always
+        returned as candidates.
+        """
+
+        MAGIC = b"PKGSAUX1"
+        GRAM_LEN = 3
+
+        __header = struct.Struct("<7Q")
+        __fold = struct.Struct("<II")
+        __gram = struct.Struct("<3sQI")
+
+        # The characters which make a search term a glob.
+        glob_chars = bytearray(b"*?[")
+
+        def __init__(self, file_name):
+                IndexStoreMapped.__init__(self, file_name)
+                self._num_tokens = 0
+                self._num_grams = 0
+                self._fold_start = 0
+                self._grams_start = 0
+                self._postings_start = 0
+                self._others = ()
+                self._out_dir = None
+                self._out_version = None
+                self._fold = None
+                self._grams = None
+                self._other_toks = None
+
+        def _read_header(self, start):
+                (self._num_tokens, self._num_grams, self._fold_start,
+                    self._grams_start, self._postings_start, others_start,
+                    end) = self.__header.unpack_from(self._map, start)
+                buf = bytearray(self._map[others_start:end])
+                cnt, pos = _decode_varint(buf, 0)
+                others = []
+                i = 0
+                for n in range(cnt):
+                        d, pos = _decode_varint(buf, pos)
+                        i += d
+                        others.append(i)
+                self._others = others
+
+        def open_out_file(self, use_dir, version_num):
+                """Prepares to add the tokens written to the binary main
+                dictionary via add_token."""
+
+                self._out_dir = use_dir
+                self._out_version = version_num
+                self._num_tokens = 0
+                self._fold = array.array("I")
+                self._grams = {}
+                self._other_toks = array.array("I")
+
+        def add_token(self, token):
+                """Adds the next token written to the binary main
+                dictionary."""
+
+                i = self._num_tokens
+                self._num_tokens += 1
+                tok = bytearray(force_bytes(token))
+                if any(c > 0x7f for c in tok):
+                        self._other_toks.append(i)
+                        self._fold.append(0)
+                        return
+                tok = bytes(tok.lower())
+                self._fold.append(zlib.crc32(tok) & 0xffffffff)
+                grams = self._grams
+                for g in set(tok[j:j + self.GRAM_LEN]
+                    for j in range(len(tok) - self.GRAM_LEN + 1)):
+                        try:
+                                grams[g].append(i)
+                        except KeyError:
+                                grams[g] = array.array("I", [i])
+
+        def close_out_file(self):
+                """Writes out the indexes of the tokens added since
+                open_out_file was called."""
+
+                path = os.path.join(self._out_dir, self._name)
+                others = set(self._other_toks)
+
+                fold = bytearray()
+                for i in sorted((i for i in range(self._num_tokens)
+                    if i not in others), key=self._fold.__getitem__):
+                        fold.extend(self.__fold.pack(self._fold[i], i))
+
+                table = bytearray()
+                postings = bytearray()
+                for g in sorted(self._grams):
+                        toks = self._grams[g]
+                        table.extend(self.__gram.pack(g, len(postings),
+                            len(toks)))
+                        old_i = 0
+                        for i in toks:
+                                _encode_varint(postings, i - old_i)
+                                old_i = i
+
+                other_buf = bytearray()
+                _encode_varint(other_buf, len(self._other_toks))
+                old_i = 0
+                for i in self._other_toks:
+                        _encode_varint(other_buf, i - old_i)
+                        old_i = i
+
+                fold_start = self._header_start(self._out_version,
+                    self.__header.size)
+                grams_start = fold_start + len(fold)
+                postings_start = grams_start + len(table)
+                others_start = postings_start + len(postings)
+                end = others_start + len(other_buf)
+                self._write_out_file(path, self._out_version,
+                    self.__header.pack(self._num_tokens, len(self._grams),
+                    fold_start, grams_start, postings_start, others_start,
+                    end), [fold, table, postings, other_buf])
+                self._fold = self._grams = self._other_toks = None
+
+        def write_dict_file(self, path, version_num):
+                """Writes out empty indexes."""
+
+                self.open_out_file(path, version_num)
+                self.close_out_file()
+
+        def __fold_candidates(self, tok):
+                """Returns the indexes of the tokens whose lower cased crc32
+                matches that of tok."""
+
+                h = zlib.crc32(tok.lower()) & 0xffffffff
+                size = self.__fold.size
+                cnt = (self._grams_start - self._fold_start) // size
+                lo = 0
+                hi = cnt
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if self.__fold.unpack_from(self._map,
+                            self._fold_start + mid * size)[0] < h:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                res = set()
+                while lo < cnt:
+                        fh, i = self.__fold.unpack_from(self._map,
+                            self._fold_start + lo * size)
+                        if fh != h:
+                                break
+                        res.add(i)
+                        lo += 1
+                return res
+
+        def __gram_tokens(self, gram):
+                """Returns the set of indexes of the tokens containing gram."""
+
+                size = self.__gram.size
+                lo = 0
+                hi = self._num_grams
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        g, pos, cnt = self.__gram.unpack_from(self._map,
+                            self._grams_start + mid * size)
+                        if g < gram:
+                                lo = mid + 1
+                        elif g > gram:
+                                hi = mid
+                        else:
+                                start = self._postings_start + pos
+                                # Each delta takes at most five bytes.
+                                buf = bytearray(self._map[start:
+                                    min(start + cnt * 5, self._map.size())])
+                                res = set()
+                                i = 0
+                                pos = 0
+                                for n in range(cnt):
+                                        d, pos = _decode_varint(buf, pos)
+                                        i += d
+                                        res.add(i)
+                                return res
+                return set()
+
+        def __literal_grams(self, tok):
+                """Returns the trigrams of the lower cased runs of ASCII
+                characters which any token matching the glob tok must
+                contain.  Since fnmatch character classes can contain
+                anything, nothing after the first '[' is used."""
+
+                grams = set()
+                for run in re.split(br"[*?]|[^\x00-\x7f]",
+                    tok.split(b"[", 1)[0].lower()):
+                        grams.update(run[j:j + self.GRAM_LEN]
+                            for j in range(len(run) - self.GRAM_LEN + 1))
+                return grams
+
+        def get_candidates(self, term):
+                """Returns the sorted indexes of the tokens in the binary main
+                dictionary which might match term, either case insensitively
+                or as a glob.  Every token which matches is included, but
+                callers must check the tokens returned.  None is returned if
+                the indexes can't narrow down the tokens which need to be
+                checked."""
+
+                try:
+                        tok = force_bytes(term)
+                except UnicodeEncodeError:
+                        return None
+                if not any(c in self.glob_chars for c in bytearray(tok)):
+                        if any(c > 0x7f for c in bytearray(tok)):
+                                return None
+                        res = self.__fold_candidates(tok)
+                else:
+                        grams = self.__literal_grams(tok)
+                        if not grams:
+                                return None
+                        res = None
+                        for g in sorted(grams):
+                                toks = self.__gram_tokens(g)
+                                if res is None:
+                                        res = toks
+                                else:
+                                        res &= toks
+                                if not res:
+                                        break
+                res.update(self._others)
+                return sorted(res)
+
 class IndexStoreListDict(IndexStoreBase):
         """Used when both a list and a dictionary are needed to
         store the information. Used for bidirectional lookup when
@@ -2195,6 +2195,8 @@ class DepotConfig(object):
                     cfg.PropList("disable_ops"),
                     cfg.PropDefined("image_root", allowed=["",
                         "<abspathname>"]),
+                    cfg.PropInt("index_jobs", default=1, minimum=1,
+                        value_map={ "": 1 }),
                     cfg.PropDefined("inst_root", allowed=["", "<pathname>"]),
                     cfg.PropBool("ll_mirror"),
                     cfg.PropDefined("log_access", allowed=["", "stderr",
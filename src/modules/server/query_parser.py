@@ -94,5 +94,11 @@ class TermQuery(qp.TermQuery):
                 it = self._get_results(base_res)
                 return it
 
+        def postings(self, fmris):
+                """Returns an iterator over the index entries matching the
+                term.  Everything a server searches is in its index."""
+
+                return self._search_internal(fmris)
+
 # Vim hints
 # vim:ts=8:sw=8:et:fdm=marker
@@ -24,6 +24,7 @@
 from __future__ import print_function
 
 import codecs
+import collections
 import datetime
 import errno
 import hashlib
@@ -31,10 +32,12 @@ import logging
 import os
 import os.path
 import shutil
+import simplejson as json
 import six
 import stat
 import sys
 import tempfile
+import time
 import zlib
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
@@ -59,6 +62,7 @@ import pkg.portable as portable
 import pkg.misc as misc
 import pkg.nrlock
 import pkg.search_errors as se
+import pkg.search_storage as ss
 import pkg.query_parser as qp
 import pkg.server.catalog as old_catalog
 import pkg.server.query_parser as sqp
@@ -374,6 +378,523 @@ class RepositorySigNoTrustAnchorDirError(RepositoryError):
                 return _("Unable to find trust anchor directory {0}").format(
                     self.data)
 
+# The repository store and verification parameters used by verify worker
+# processes; set by _verify_worker_init() in each worker.
+_verify_state = None
+
+# The repository store and manifest loading parameters used by rebuild worker
+# processes; set by _rebuild_worker_init() in each worker.
+_rebuild_state = None
+
+def _verify_worker_init(rstore, pub, trust_anchors, sig_required_names,
+    use_crls):
+        """Initialize a verify worker process."""
+
+        global _verify_state
+        _verify_state = (rstore, pub, trust_anchors, sig_required_names,
+            use_crls)
+
+def _verify_manifest_job(batch):
+        """Verify a batch of manifests in a worker process; 'batch' is a list
+        of tuples of (pdir, pname, ver, check_sig).  Returns a list of the
+        results for each."""
+
+        rstore, pub, trust_anchors, sig_required_names, use_crls = \
+            _verify_state
+        return [
+            rstore._verify_pkg_manifest(pdir, pname, ver, pub, trust_anchors,
+                sig_required_names, use_crls, check_sig=check_sig)
+            for pdir, pname, ver, check_sig in batch
+        ]
+
+def _verify_payload_job(args):
+        """Verify a single payload in a worker process; 'args' is a tuple of
+        (pfmri, file_name, hash_value, hash_func)."""
+
+        return _verify_state[0]._verify_payload(*args)
+
+def _rebuild_worker_init(rstore, sig):
+        """Initialize a rebuild worker process."""
+
+        global _rebuild_state
+        _rebuild_state = (rstore, sig)
+
+def _rebuild_manifest_job(pfmri):
+        """Load the manifest for 'pfmri' in a worker process and return a
+        tuple of (pfmri, error, signatures, actions, payload_names) where
+        'actions' is a list of the string form of the depend and set actions
+        used by the catalog.  If the manifest is invalid, 'error' is the
+        reason and the remaining items are None."""
+
+        rstore, sig = _rebuild_state
+        try:
+                m = rstore._get_manifest(pfmri, sig=sig)
+        except (apx.InvalidPackageErrors, actions.ActionError,
+            fmri.FmriError, pkg.version.VersionError) as e:
+                return pfmri, str(e), None, None, None
+
+        acts = [
+            str(a)
+            for atype in ("depend", "set")
+            for a in m.gen_actions_by_type(atype)
+        ]
+        return pfmri, None, dict(m.signatures), acts, \
+            sorted(_get_payload_names(m))
+
+
+class _RepoVerifyState(object):
+        """A persistent record of the repository content that has been
+        successfully verified, used by incremental verification to avoid
+        rehashing content that is unchanged since it was last checked.
+
+        Payloads are recorded by file name along with the stat information
+        of the file, the hash value and algorithm used, and the time they
+        were verified.  Manifests are recorded by their path relative to the
+        manifest root along with their stat information, the names of the
+        payloads they reference and the time their signatures were verified,
+        so that an unchanged manifest whose payloads are also unchanged need
+        not be read at all.  Because signature verification depends on
+        the repository's signature policy, manifest records are discarded
+        whenever 'policy' differs from the policy they were recorded with.
+        'policy' must be a JSON-serializable list.
+
+        Only entries that are recorded (or carried forward using keep_*())
+        during a verification run are retained when save() is called, so
+        records for removed content are pruned automatically."""
+
+        VERSION = 2
+
+        def __init__(self, pathname, policy=None):
+                self.pathname = pathname
+                self.policy = policy
+                self.__manifests = {}
+                self.__payloads = {}
+                self.__new_manifests = {}
+                self.__new_payloads = {}
+
+        @staticmethod
+        def __stat_key(st):
+                return [st.st_size, st.st_mtime, st.st_ino]
+
+        def load(self):
+                """Load the verification records; missing or unreadable
+                records are treated as empty."""
+
+                try:
+                        with open(self.pathname, "rb") as f:
+                                data = json.loads(misc.force_str(f.read()))
+                except (EnvironmentError, ValueError):
+                        return
+                if not isinstance(data, dict) or \
+                    data.get("version") != self.VERSION:
+                        return
+                self.__payloads = data.get("payloads", {})
+                if self.policy is None:
+                        # Callers that only discard records retain the
+                        # existing policy.
+                        self.policy = data.get("policy")
+                if data.get("policy") == self.policy:
+                        self.__manifests = data.get("manifests", {})
+
+        def save(self):
+                """Atomically store the records for this run.  Failure to
+                store them is not fatal, since verification itself never
+                requires write access to the repository."""
+
+                fn = None
+                try:
+                        fd, fn = tempfile.mkstemp(
+                            dir=os.path.dirname(self.pathname))
+                        os.fchmod(fd, misc.PKG_FILE_MODE)
+                        with os.fdopen(fd, "wb") as f:
+                                f.write(misc.force_bytes(json.dumps({
+                                    "version": self.VERSION,
+                                    "policy": self.policy,
+                                    "manifests": self.__new_manifests,
+                                    "payloads": self.__new_payloads,
+                                })))
+                        portable.rename(fn, self.pathname)
+                except EnvironmentError as e:
+                        if e.errno not in (errno.EACCES, errno.EPERM,
+                            errno.EROFS, errno.ENOENT):
+                                raise
+                finally:
+                        if fn and os.path.exists(fn):
+                                os.unlink(fn)
+
+        def __current(self, entry, st, max_age):
+                if not entry or st is None:
+                        return False
+                if entry[:3] != self.__stat_key(st):
+                        return False
+                return not max_age or time.time() - entry[-1] < max_age
+
+        def check_manifest(self, name, st, max_age=None):
+                """Returns a boolean indicating whether the manifest 'name',
+                currently having stat information 'st', was verified and is
+                unchanged since then and younger than 'max_age' seconds."""
+
+                return self.__current(self.__manifests.get(name), st, max_age)
+
+        def manifest_payloads(self, name):
+                """Returns the names of the payloads referenced by the manifest
+                'name' when it was verified."""
+
+                return self.__manifests[name][3]
+
+        def check_payload(self, fname, hval, alg, st, max_age=None):
+                """Returns a boolean indicating whether the payload 'fname',
+                currently having stat information 'st', was verified against
+                hash value 'hval' using 'alg' and is unchanged since then and
+                younger than 'max_age' seconds.  If 'hval' is None, the hash
+                value and algorithm it was verified with are not checked."""
+
+                entry = self.__payloads.get(fname)
+                if not self.__current(entry, st, max_age):
+                        return False
+                return hval is None or entry[3:5] == [hval, alg().name]
+
+        def keep_manifest(self, name):
+                """Carry the existing record for manifest 'name' forward."""
+
+                self.__new_manifests[name] = self.__manifests[name]
+
+        def keep_payload(self, fname):
+                """Carry the existing record for payload 'fname' forward."""
+
+                self.__new_payloads[fname] = self.__payloads[fname]
+
+        def add_manifest(self, name, st, payloads):
+                """Record that manifest 'name', which references the payloads
+                named in 'payloads', was successfully verified when it had stat
+                information 'st'."""
+
+                self.__new_manifests[name] = self.__stat_key(st) + \
+                    [sorted(payloads), int(time.time())]
+
+        def add_payload(self, fname, hval, alg, st):
+                """Record that payload 'fname' was successfully verified
+                against 'hval' using 'alg' when it had stat information
+                'st'."""
+
+                self.__new_payloads[fname] = self.__stat_key(st) + \
+                    [hval, alg().name, int(time.time())]
+
+        def discard(self, manifests=misc.EmptyI, payloads=misc.EmptyI):
+                """Remove any record of the named manifests and payloads from
+                the stored state, if there is any."""
+
+                if not os.path.exists(self.pathname):
+                        return
+                self.load()
+                self.__new_manifests = self.__manifests
+                self.__new_payloads = self.__payloads
+                for name in manifests:
+                        self.__new_manifests.pop(name, None)
+                for fname in payloads:
+                        self.__new_payloads.pop(fname, None)
+                self.save()
+
+
+class _PayloadRefIndex(object):
+        """A persistent index of the number of manifests in a repository store
+        that reference each payload file, keyed by the name the payload is
+        stored under.
+
+        The index is partitioned into shards using the first two characters
+        of each name (matching the fanout of the repository's file layout)
+        so that updates and queries only ever need to load a small fraction
+        of it into memory.  Each shard is a sorted text file of lines of the
+        form '<name> <count>'.  The index is only considered valid once its
+        version file exists; build() creates it from scratch."""
+
+        VERSION = 1
+
+        def __init__(self, root):
+                self.root = root
+
+        @property
+        def exists(self):
+                """True if the index is complete and may be used."""
+
+                return os.path.exists(os.path.join(self.root, "version"))
+
+        def __read_shard(self, shard):
+                counts = {}
+                try:
+                        with open(os.path.join(self.root, shard), "r") as f:
+                                for l in f:
+                                        name, cnt = l.split()
+                                        counts[name] = int(cnt)
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
+                return counts
+
+        def __write_shard(self, shard, counts):
+                pathname = os.path.join(self.root, shard)
+                if not counts:
+                        try:
+                                portable.remove(pathname)
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise
+                        return
+
+                fd, fn = tempfile.mkstemp(dir=self.root)
+                try:
+                        os.fchmod(fd, misc.PKG_FILE_MODE)
+                        with os.fdopen(fd, "w") as f:
+                                for name in sorted(counts):
+                                        f.write("{0} {1:d}\n".format(name,
+                                            counts[name]))
+                        portable.rename(fn, pathname)
+                finally:
+                        if os.path.exists(fn):
+                                os.unlink(fn)
+
+        def update(self, deltas):
+                """Apply 'deltas', a dictionary mapping payload names to the
+                change in their reference count, to the index.  Returns the
+                set of names that are no longer referenced."""
+
+                shards = {}
+                for name, delta in six.iteritems(deltas):
+                        if delta:
+                                shards.setdefault(name[:2], []).append(
+                                    (name, delta))
+
+                unreferenced = set()
+                for shard in sorted(shards):
+                        counts = self.__read_shard(shard)
+                        for name, delta in shards[shard]:
+                                cnt = counts.get(name, 0) + delta
+                                if cnt > 0:
+                                        counts[name] = cnt
+                                        unreferenced.discard(name)
+                                else:
+                                        counts.pop(name, None)
+                                        unreferenced.add(name)
+                        self.__write_shard(shard, counts)
+                return unreferenced
+
+        def gen_unreferenced(self, names):
+                """Generate each payload name yielded by the iterable 'names'
+                that is not referenced by any manifest.  'names' is expected
+                to be grouped by shard (as FileManager.walk() produces them)
+                so that only one shard need be loaded at a time."""
+
+                shard = None
+                counts = None
+                for name in names:
+                        if name[:2] != shard:
+                                shard = name[:2]
+                                counts = self.__read_shard(shard)
+                        if name not in counts:
+                                yield name
+
+        def build(self, refs):
+                """Replace the index with one built from 'refs', an iterable
+                that yields the payload names referenced by each manifest in
+                the repository store.  Memory use is bounded by spilling the
+                references found to a temporary file per shard before they
+                are counted one shard at a time."""
+
+                tmp_root = self.root + ".new"
+                shutil.rmtree(tmp_root, True)
+                misc.makedirs(tmp_root)
+                spills = {}
+                try:
+                        for names in refs:
+                                for name in names:
+                                        shard = name[:2]
+                                        sf = spills.get(shard)
+                                        if not sf:
+                                                sf = spills[shard] = open(
+                                                    os.path.join(tmp_root,
+                                                    shard + ".spill"), "w")
+                                        sf.write(name + "\n")
+                        for sf in spills.values():
+                                sf.close()
+
+                        tmp_idx = _PayloadRefIndex(tmp_root)
+                        for shard in sorted(spills):
+                                spill = os.path.join(tmp_root, shard + ".spill")
+                                counts = {}
+                                with open(spill, "r") as sf:
+                                        for l in sf:
+                                                name = l.rstrip("\n")
+                                                counts[name] = \
+                                                    counts.get(name, 0) + 1
+                                portable.remove(spill)
+                                tmp_idx.__write_shard(shard, counts)
+
+                        with open(os.path.join(tmp_root, "version"), "w") as f:
+                                f.write("{0:d}\n".format(self.VERSION))
+
+                        old_root = self.root + ".old"
+                        shutil.rmtree(old_root, True)
+                        if os.path.exists(self.root):
+                                portable.rename(self.root, old_root)
+                        portable.rename(tmp_root, self.root)
+                        shutil.rmtree(old_root, True)
+                finally:
+                        for sf in spills.values():
+                                sf.close()
+                        shutil.rmtree(tmp_root, True)
+
+        def destroy(self):
+                """Remove the index; it must be rebuilt before it is used
+                again."""
+
+                shutil.rmtree(self.root, True)
+
+
+def _get_payload_names(m):
+        """Return the set of names under which the payloads referenced by
+        Manifest 'm' are stored in the repository."""
+
+        names = set()
+        for a in m.gen_actions():
+                if not a.has_payload:
+                        continue
+
+                # Action payload.
+                hattr, hval, hfunc = digest.get_least_preferred_hash(a)
+                names.add(hval)
+
+                # Signature actions have additional payloads.
+                if a.name == "signature":
+                        names.update(a.get_chain_certs(least_preferred=True))
+        return names
+
+
+class _SearchCache(object):
+        """A bounded, in-memory cache of search results for a repository
+        store, with least recently used entries discarded first.
+
+        Entries are keyed by the normalized query and its options and are
+        only valid for the generation of the search index (and catalog) that
+        produced them; adding an entry for a newer generation, or calling
+        clear(), discards all existing ones.  Results are cached as they are
+        streamed to the caller, and only once completely consumed, so that
+        results too large to cache are never held in memory."""
+
+        # The maximum number of entries and the maximum total estimated size
+        # of the cached results in bytes.
+        MAX_ENTRIES = 1024
+        MAX_SIZE = 32 * 1024 * 1024
+
+        # Estimated fixed overhead of each result.
+        __RESULT_OVERHEAD = 64
+
+        def __init__(self, max_entries=MAX_ENTRIES, max_size=MAX_SIZE):
+                self.max_entries = max_entries
+                self.max_size = max_size
+                # No single query may consume more than a fraction of the
+                # cache.
+                self.max_entry_size = max_size // 8
+                self.hits = 0
+                self.misses = 0
+                self.size = 0
+                self.__entries = collections.OrderedDict()
+                self.__generation = None
+                self.__lock = pkg.nrlock.NRLock()
+
+        @staticmethod
+        def get_key(query):
+                """Return the cache key for the Query object 'query'.  Runs of
+                whitespace are insignificant in query text, so are collapsed
+                so that equivalent queries share an entry."""
+
+                return (" ".join(query.text.split()), query.return_type,
+                    query.case_sensitive, query.num_to_return,
+                    query.start_point)
+
+        def __sizeof(self, res):
+                # Results are of the form (version, return_type, vals) where
+                # vals is either a package FMRI string or a tuple of strings.
+                vals = res[2]
+                if isinstance(vals, six.string_types):
+                        return self.__RESULT_OVERHEAD + len(vals)
+                return self.__RESULT_OVERHEAD + sum(len(v) for v in vals)
+
+        def clear(self):
+                """Discard all cached results."""
+
+                with self.__lock:
+                        self.__entries.clear()
+                        self.size = 0
+                        self.__generation = None
+
+        def get(self, key, generation):
+                """Return an iterator over the cached results for 'key' or
+                None if there are none for the given index 'generation'."""
+
+                with self.__lock:
+                        entry = None
+                        if generation == self.__generation:
+                                entry = self.__entries.pop(key, None)
+                        if entry is None:
+                                self.misses += 1
+                                return None
+                        # Re-insert the entry to mark it most recently used.
+                        self.__entries[key] = entry
+                        self.hits += 1
+                        return iter(entry[0])
+
+        def __add(self, key, generation, results, size):
+                with self.__lock:
+                        if generation != self.__generation:
+                                self.__entries.clear()
+                                self.size = 0
+                                self.__generation = generation
+                        old = self.__entries.pop(key, None)
+                        if old:
+                                self.size -= old[1]
+                        self.__entries[key] = (results, size)
+                        self.size += size
+                        while self.__entries and (
+                            len(self.__entries) > self.max_entries or
+                            self.size > self.max_size):
+                                rkey, (rres, rsize) = \
+                                    self.__entries.popitem(last=False)
+                                self.size -= rsize
+
+        def gen_results(self, key, generation, results):
+                """A generator that yields each item of the iterable 'results'
+                and then caches them for 'key' and the index 'generation' if
+                they were small enough."""
+
+                cached = []
+                size = 0
+                for res in results:
+                        if cached is not None:
+                                size += self.__sizeof(res)
+                                if size > self.max_entry_size:
+                                        cached = None
+                                else:
+                                        cached.append(res)
+                        yield res
+
+                if cached is not None:
+                        self.__add(key, generation, cached, size)
+
+        def get_status(self):
+                """Return a dictionary of statistics for the cache."""
+
+                with self.__lock:
+                        lookups = self.hits + self.misses
+                        return {
+                            "entries": len(self.__entries),
+                            "hit-rate": lookups and
+                                float(self.hits) / lookups or 0.0,
+                            "hits": self.hits,
+                            "misses": self.misses,
+                            "size": self.size,
+                        }
+
+
 class _RepoStore(object):
         """The _RepoStore object provides an interface for performing operations
         on a set of package data contained within a repository.  This class is
@@ -381,7 +902,7 @@ class _RepoStore(object):
         """
 
         def __init__(self, allow_invalid=False, file_layout=None,
-            file_root=None, log_obj=None, mirror=False, pub=None,
+            file_root=None, index_jobs=1, log_obj=None, mirror=False, pub=None,
             read_only=False, root=None,
             sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None):
                 """Prepare the repository for use."""
@@ -394,6 +915,7 @@ class _RepoStore(object):
                 self.__file_layout = file_layout
                 self.__file_root = None
                 self.__in_flight_trans = {}
+                self.__index_jobs = index_jobs
                 self.__read_only = read_only
                 self.__root = None
                 self.__sort_file_max_size = sort_file_max_size
@@ -424,6 +946,9 @@ class _RepoStore(object):
                 self.__set_writable_root(writable_root)
 
                 self.__search_available = False
+                self.__search_cache = _SearchCache()
+                self.__search_lock = pkg.nrlock.NRLock()
+                self.__search_parser = None
                 self.__refresh_again = False
 
                 self.__lock = pkg.nrlock.NRLock()
@@ -659,6 +1184,7 @@ class _RepoStore(object):
                     "package-count": pkg_count,
                     "package-version-count": pkg_ver_count,
                     "last-catalog-update": lcat_update,
+                    "search-cache": self.__search_cache.get_status(),
                     "status": rstatus,
                 }
 
@@ -745,8 +1271,30 @@ class _RepoStore(object):
                 # Discard in-memory search data.
                 self.reset_search()
 
+        def __remove_from_search_index(self, fmris):
+                """Private helper function to remove packages from the search
+                index by recording them as tombstones; the index is purged
+                instead if that isn't possible."""
+
+                if not self.index_root or not os.path.exists(self.index_root):
+                        return
+
+                ind = indexer.Indexer(self.index_root,
+                    self._get_manifest,
+                    self.manifest,
+                    log=self.__index_log,
+                    sort_file_max_size=self.__sort_file_max_size)
+                try:
+                        ind.server_remove_from_index(fmris)
+                except (se.IndexingException, EnvironmentError):
+                        self.__purge_search_index()
+                        return
+
+                # Discard in-memory search data.
+                self.reset_search()
+
         def __rebuild(self, build_catalog=True, build_index=False, lm=None,
-            incremental=False):
+            incremental=False, jobs=1):
                 """Private version; caller responsible for repository
                 locking."""
 
@@ -771,44 +1319,76 @@ class _RepoStore(object):
                         # rebuild.
                         self.catalog.log_updates = incremental
 
-                        def add_package(f):
-                                m = self._get_manifest(f, sig=True)
-                                if "pkg.fmri" in m:
-                                        f = fmri.PkgFmri(m["pkg.fmri"])
-                                if default_pub and not f.publisher:
-                                        f.publisher = default_pub
-                                self.__add_package(f, manifest=m)
-                                self.__log(str(f))
-
-                        # XXX eschew os.walk in favor of another os.listdir
-                        # here?
-                        for pkgpath in os.walk(self.manifest_root):
-                                if pkgpath[0] == self.manifest_root:
-                                        continue
-
-                                for fname in os.listdir(pkgpath[0]):
+                        def add_packages():
+                                # Yields a tuple of (names, added) for each
+                                # manifest, where 'added' is True if the
+                                # package was added to the catalog, False if
+                                # it was already there, and None if its
+                                # manifest is invalid.
+                                for f, m, names in self.__gen_manifests(
+                                    sig=True, jobs=jobs):
+                                        name = self.manifest(f)
+                                        added = True
                                         try:
-                                                f = self.__fmri_from_path(
-                                                    pkgpath[0], fname)
-                                                add_package(f)
-                                        except (apx.InvalidPackageErrors,
-                                            actions.ActionError,
+                                                if "pkg.fmri" in m:
+                                                        f = fmri.PkgFmri(
+                                                            m["pkg.fmri"])
+                                                if default_pub and \
+                                                    not f.publisher:
+                                                        f.publisher = \
+                                                            default_pub
+                                                self.__add_package(f,
+                                                    manifest=m)
+                                                self.__log(str(f))
+                                        except (actions.ActionError,
                                             fmri.FmriError,
                                             pkg.version.VersionError) as e:
                                                 # Don't add packages with
                                                 # corrupt manifests to the
                                                 # catalog.
-                                                name = os.path.join(pkgpath[0],
-                                                    fname)
                                                 self.__log(_("Skipping "
                                                     "{name}; invalid "
                                                     "manifest: {error}").format(
                                                     name=name, error=e))
+                                                added = None
                                         except apx.DuplicateCatalogEntry as e:
                                                 # Raise dups if not in
                                                 # incremental mode.
                                                 if not incremental:
                                                         raise
+                                                added = False
+                                        yield names, added
+
+                        refs = self.__get_refs()
+                        if refs and not incremental and not self.read_only:
+                                # Every manifest is being loaded anyway, so
+                                # rebuild the payload reference index too.
+                                refs.build(
+                                    names for names, added in add_packages())
+                        elif refs and refs.exists and not self.read_only:
+                                # Manifests that are new to the catalog were
+                                # put in place without being recorded in the
+                                # payload reference index, so record them
+                                # now.  Invalid manifests are found again by
+                                # every refresh and can't be recorded just
+                                # once, so the index is discarded instead and
+                                # rebuilt when it is next needed.
+                                deltas = {}
+                                invalid = False
+                                for names, added in add_packages():
+                                        if added is None:
+                                                invalid = True
+                                        elif added:
+                                                for n in names:
+                                                        deltas[n] = \
+                                                            deltas.get(n, 0) + 1
+                                if invalid:
+                                        refs.destroy()
+                                else:
+                                        refs.update(deltas)
+                        else:
+                                for names, added in add_packages():
+                                        pass
 
                         # Private add_package doesn't automatically save catalog
                         # so that operations can be batched (there is
@@ -825,11 +1405,96 @@ class _RepoStore(object):
                         self.__purge_search_index()
 
                 if build_index:
-                        self.__refresh_index()
+                        self.__refresh_index(jobs=max(jobs,
+                            self.__index_jobs))
                 else:
                         self.__check_search()
 
-        def __refresh_index(self):
+        def __gen_manifests(self, sig=False, jobs=1):
+                """Private generator that yields a tuple of (pfmri, manifest,
+                payload_names) for every valid manifest in the repository
+                store; invalid manifests are logged and skipped.  Caller
+                responsible for repository locking.
+
+                'sig' is an optional boolean value indicating whether manifest
+                signatures should be generated.
+
+                'jobs' is an optional number of worker processes to load the
+                manifests with.  If greater than one, each manifest yielded
+                only contains the depend and set actions used by the catalog.
+                Manifests are yielded in the same order regardless."""
+
+                def log_invalid(name, e):
+                        # Don't add packages with corrupt manifests to the
+                        # catalog.
+                        self.__log(_("Skipping {name}; invalid manifest: "
+                            "{error}").format(name=name, error=e))
+
+                def gen_fmris():
+                        # XXX eschew os.walk in favor of another os.listdir
+                        # here?
+                        for pkgpath in os.walk(self.manifest_root):
+                                if pkgpath[0] == self.manifest_root:
+                                        continue
+
+                                for fname in os.listdir(pkgpath[0]):
+                                        try:
+                                                yield self.__fmri_from_path(
+                                                    pkgpath[0], fname)
+                                        except (fmri.FmriError,
+                                            pkg.version.VersionError) as e:
+                                                log_invalid(os.path.join(
+                                                    pkgpath[0], fname), e)
+
+                if jobs <= 1:
+                        for f in gen_fmris():
+                                try:
+                                        m = self._get_manifest(f, sig=sig)
+                                except (apx.InvalidPackageErrors,
+                                    actions.ActionError,
+                                    fmri.FmriError,
+                                    pkg.version.VersionError) as e:
+                                        log_invalid(self.manifest(f), e)
+                                        continue
+                                yield f, m, _get_payload_names(m)
+                        return
+
+                # Reading, parsing and signing the manifests is done by the
+                # workers; only the small subset of each manifest used by the
+                # catalog is handed back and parsed again here.
+                pool = misc.get_process_pool(jobs,
+                    initializer=_rebuild_worker_init, initargs=(self, sig))
+                try:
+                        for f, err, sigs, acts, names in pool.imap(
+                            _rebuild_manifest_job, gen_fmris(), chunksize=16):
+                                if err:
+                                        log_invalid(self.manifest(f), err)
+                                        continue
+                                m = pkg.manifest.Manifest(f)
+                                m.set_content(content="\n".join(acts))
+                                m.signatures = sigs
+                                yield f, m, names
+                except:
+                        pool.terminate()
+                        pool.join()
+                        pool = None
+                        raise
+                finally:
+                        if pool:
+                                pool.close()
+                                pool.join()
+
+        def __get_refs(self):
+                """Return the _PayloadRefIndex object for the repository store
+                or None if the store has no root or its file root is shared
+                with other content."""
+
+                if not self.root or not self.file_root or \
+                    not self.file_root.startswith(self.root + os.path.sep):
+                        return None
+                return _PayloadRefIndex(os.path.join(self.root, "refs"))
+
+        def __refresh_index(self, jobs=None):
                 """Private version; caller responsible for repository
                 locking."""
 
@@ -844,7 +1509,7 @@ class _RepoStore(object):
                     self.index_root, cat)
 
                 if fmris_to_index:
-                        return self.__run_update_index()
+                        return self.__run_update_index(jobs=jobs)
 
                 # Since there is nothing to index, setup the index
                 # and declare search available.  This is only logged
@@ -859,6 +1524,11 @@ class _RepoStore(object):
                         self.__index_log("Search Available")
                 self.__search_available = True
 
+                # With nothing left to index, compact any delta segments and
+                # tombstones into the main dictionary.
+                if ind.server_compact_index():
+                        self.reset_search()
+
         def __init_state(self, allow_invalid=False):
                 """Private version; caller responsible for repository
                 locking."""
@@ -886,6 +1556,15 @@ class _RepoStore(object):
                     not self.catalog.exists:
                         self.__save_catalog()
 
+                # Likewise, a new repository store starts with an empty
+                # payload reference index so that it never needs to be built
+                # from a scan of the store's manifests.
+                refs = self.__get_refs()
+                if not self.read_only and refs and not refs.exists and \
+                    not (os.path.isdir(self.manifest_root) and
+                    os.listdir(self.manifest_root)):
+                        refs.build([])
+
                 self.__check_search()
 
         def __init_catalog(self, allow_invalid=False):
@@ -1169,17 +1848,27 @@ class _RepoStore(object):
                 finally:
                         self.__lock.release()
 
-        def __update_searchdb_unlocked(self, fmris):
+        def __update_searchdb_unlocked(self, fmris, jobs=None):
                 """Creates an indexer then hands it fmris; it assumes that all
                 needed locking has already occurred.
+
+                'jobs' is the number of worker processes to use to tokenize
+                manifests; if not provided, the store's index_jobs is used.
                 """
                 assert self.index_root
 
+                if jobs is None:
+                        jobs = self.__index_jobs
+
+                # Cached search results are only valid for the index that
+                # produced them.
+                self.__search_cache.clear()
                 if fmris:
                         index_inst = indexer.Indexer(self.index_root,
                             self._get_manifest, self.manifest,
                             log=self.__index_log,
-                            sort_file_max_size=self.__sort_file_max_size)
+                            sort_file_max_size=self.__sort_file_max_size,
+                            jobs=jobs)
                         index_inst.server_update_index(fmris)
                         if not self.__search_available:
                                 self.__index_log("Search Available")
@@ -1284,6 +1973,33 @@ class _RepoStore(object):
                 finally:
                         self.__unlock_rstore()
 
+        def update_refs(self, added=None, removed=None):
+                """Update the payload reference index to reflect the addition
+                of the manifest 'added' to, or removal of the manifest
+                'removed' from, the repository store.  Both are optional
+                Manifest objects.  To ensure payloads are never considered
+                unreferenced while a manifest that uses them exists, callers
+                must record additions before the manifest is put in place and
+                removals only after it has been removed."""
+
+                if self.read_only:
+                        raise RepositoryReadOnlyError()
+
+                deltas = {}
+                for m, delta in ((added, 1), (removed, -1)):
+                        if m:
+                                for name in _get_payload_names(m):
+                                        deltas[name] = \
+                                            deltas.get(name, 0) + delta
+
+                self.__lock_rstore(blocking=True)
+                try:
+                        refs = self.__get_refs()
+                        if refs and refs.exists:
+                                refs.update(deltas)
+                finally:
+                        self.__unlock_rstore()
+
         def replace_package(self, pfmri):
                 """Replaces the information for the specified FMRI in the
                 repository's catalog."""
@@ -1383,6 +2099,7 @@ class _RepoStore(object):
                         # Nothing to do.
                         return
                 sqp.TermQuery.clear_cache(self.index_root)
+                self.__search_cache.clear()
 
         def close(self, trans_id, add_to_catalog=True):
                 """Closes the transaction specified by 'trans_id'.
@@ -1522,9 +2239,12 @@ class _RepoStore(object):
                 except trans.TransactionError as e:
                         raise RepositoryError(e)
 
-        def refresh_index(self):
+        def refresh_index(self, jobs=None):
                 """This function refreshes the search indexes if there any new
                 packages.
+
+                'jobs' is the number of worker processes to use to tokenize
+                manifests; if not provided, the store's index_jobs is used.
                 """
 
                 if self.mirror:
@@ -1539,7 +2259,7 @@ class _RepoStore(object):
                 try:
                         try:
                                 try:
-                                        self.__refresh_index()
+                                        self.__refresh_index(jobs=jobs)
                                 except se.InconsistentIndexException as e:
                                         s = _("Index corrupted or out of date. "
                                             "Removing old index directory ({0}) "
@@ -1549,7 +2269,8 @@ class _RepoStore(object):
                                         try:
                                                 self.__rebuild(
                                                     build_catalog=False,
-                                                    build_index=True)
+                                                    build_index=True,
+                                                    jobs=jobs or 1)
                                         except se.IndexingException as e:
                                                 self.__log(str(e), "INDEX")
                                 except se.IndexingException as e:
@@ -1588,37 +2309,20 @@ class _RepoStore(object):
                         progtrack = progress.NullProgressTracker()
 
                 def get_hashes(pfmri):
-                        """Given an FMRI, return a set of tuples containing all
-                        of the hashes of the files its manifest references.
-                        Each tuple is of the form (hash value, hash function)"""
-
-                        m = self._get_manifest(pfmri)
-                        hashes = set()
-                        for a in m.gen_actions():
-                                if not a.has_payload:
-                                        # Nothing to archive.
-                                        continue
-
-                                # Action payload.
-                                hattr, hval, hfunc = \
-                                    digest.get_least_preferred_hash(a)
-                                hashes.add(hval)
+                        """Given an FMRI, return the set of names of the files
+                        its manifest references."""
 
-                                # Signature actions have additional payloads.
-                                if a.name == "signature":
-                                        for c in a.get_chain_certs(
-                                            least_preferred=True):
-                                                hashes.add(c)
-                        return hashes
+                        return _get_payload_names(self._get_manifest(pfmri))
 
                 self.__lock_rstore()
                 c = self.catalog
                 try:
-                        # First, dump all search data as it will be invalidated
-                        # as soon as the catalog is updated.
+                        # First, remove the packages from the search data as
+                        # it will be invalidated as soon as the catalog is
+                        # updated.
                         progtrack.job_start(progtrack.JOB_REPO_DELSEARCH)
                         progtrack.job_add_progress(progtrack.JOB_REPO_DELSEARCH)
-                        self.__purge_search_index()
+                        self.__remove_from_search_index(packages)
                         progtrack.job_add_progress(progtrack.JOB_REPO_DELSEARCH)
                         progtrack.job_done(progtrack.JOB_REPO_DELSEARCH)
 
@@ -1657,10 +2361,13 @@ class _RepoStore(object):
                         # any of the packages not actually have a manifest in
                         # the repository.
                         pfiles = set()
+                        deltas = {}
                         progtrack.job_start(progtrack.JOB_REPO_ANALYZE_RM,
                             goal=len(packages))
                         for pfmri in packages:
-                                pfiles.update(get_hashes(pfmri))
+                                for name in get_hashes(pfmri):
+                                        pfiles.add(name)
+                                        deltas[name] = deltas.get(name, 0) - 1
                                 progtrack.job_add_progress(
                                     progtrack.JOB_REPO_ANALYZE_RM)
                         progtrack.job_done(progtrack.JOB_REPO_ANALYZE_RM)
@@ -1670,8 +2377,14 @@ class _RepoStore(object):
                         # remove any hashes in use from the list to be removed.
                         # However, if the package being removed doesn't have any
                         # payloads, then we can skip checking all of the
-                        # packages in the repository for files in use.
-                        if pfiles:
+                        # packages in the repository for files in use.  If the
+                        # payload reference index is available, it determines
+                        # which files are no longer in use instead once the
+                        # manifests have been removed below.
+                        refs = self.__get_refs()
+                        if refs and not refs.exists:
+                                refs = None
+                        if pfiles and not refs:
                                 # Number of packages to check is total found in
                                 # repo minus number to be removed.
                                 slist = os.listdir(self.manifest_root)
@@ -1746,6 +2459,8 @@ class _RepoStore(object):
                                 portable.remove(mpath)
                                 progtrack.job_add_progress(
                                     progtrack.JOB_REPO_RM_MFST)
+                        if refs:
+                                pfiles = refs.update(deltas)
                         progtrack.job_done(progtrack.JOB_REPO_RM_MFST)
 
                         # Next, remove any package files that are not
@@ -1796,7 +2511,92 @@ class _RepoStore(object):
                         c.batch_mode = False
                         self.__unlock_rstore()
 
-        def rebuild(self, build_catalog=True, build_index=False):
+        def gc(self, dry_run=False, progtrack=None):
+                """A generator that removes payload files that are not
+                referenced by any manifest in the repository store and yields
+                a tuple of (name, pathname, size) for each.  No other
+                modifying operations may be performed until complete.
+
+                'dry_run' is an optional boolean indicating that files should
+                only be reported and not removed.
+
+                'progtrack' is an optional ProgressTracker object.
+
+                Unreferenced files are found using the payload reference
+                index, which is built first if it does not yet exist.  Files
+                referenced by in-flight transactions are never removed."""
+
+                if self.mirror:
+                        raise RepositoryMirrorError()
+                if self.read_only and not dry_run:
+                        raise RepositoryReadOnlyError()
+                refs = self.__get_refs()
+                if not refs or not self.manifest_root:
+                        raise RepositoryUnsupportedOperationError()
+                if not progtrack:
+                        progtrack = progress.NullProgressTracker()
+
+                self.__lock_rstore()
+                try:
+                        if not refs.exists:
+                                if self.read_only:
+                                        raise RepositoryReadOnlyError()
+                                progtrack.job_start(
+                                    progtrack.JOB_REPO_ANALYZE_REPO)
+
+                                def gen_refs():
+                                        for f, m, names in \
+                                            self.__gen_manifests():
+                                                progtrack.job_add_progress(
+                                                    progtrack.JOB_REPO_ANALYZE_REPO)
+                                                yield names
+                                refs.build(gen_refs())
+                                progtrack.job_done(
+                                    progtrack.JOB_REPO_ANALYZE_REPO)
+
+                        # Transactions may refer to files that are already in
+                        # the repository without having stored their own copy.
+                        in_flight = set()
+                        if self.trans_root and os.path.exists(self.trans_root):
+                                for tid in os.listdir(self.trans_root):
+                                        m = pkg.manifest.Manifest()
+                                        try:
+                                                m.set_content(pathname=
+                                                    os.path.join(
+                                                    self.trans_root, tid,
+                                                    "manifest"))
+                                        except EnvironmentError as e:
+                                                if e.errno != errno.ENOENT:
+                                                        raise
+                                                continue
+                                        in_flight.update(_get_payload_names(m))
+
+                        progtrack.job_start(progtrack.JOB_REPO_RM_FILES)
+                        try:
+                                for name in refs.gen_unreferenced(
+                                    self.cache_store.walk()):
+                                        if name in in_flight:
+                                                continue
+                                        fpath = self.cache_store.lookup(name)
+                                        if not fpath:
+                                                continue
+                                        size = os.stat(fpath).st_size
+                                        if not dry_run:
+                                                self.cache_store.remove(name)
+                                        progtrack.job_add_progress(
+                                            progtrack.JOB_REPO_RM_FILES)
+                                        yield name, fpath, size
+                        except file_manager.UnrecognizedFilePaths:
+                                # Anything that isn't payload content isn't
+                                # ours to remove.
+                                pass
+                        progtrack.job_done(progtrack.JOB_REPO_RM_FILES)
+                except EnvironmentError as e:
+                        raise apx._convert_error(e)
+                finally:
+                        self.__unlock_rstore()
+
+        def rebuild(self, build_catalog=True, build_index=False, jobs=1):
                 """Rebuilds the repository catalog and search indexes using the
                 package manifests currently in the repository.
 
@@ -1806,6 +2606,10 @@ class _RepoStore(object):
 
                 'build_index' is an optional boolean value indicating whether
                 search indexes should be built.
+
+                'jobs' is an optional number of worker processes to load the
+                package manifests with.  The resulting catalog is identical
+                regardless of the number used.
                 """
 
                 if self.mirror:
@@ -1818,11 +2622,11 @@ class _RepoStore(object):
                 self.__lock_rstore()
                 try:
                         self.__rebuild(build_catalog=build_catalog,
-                            build_index=build_index)
+                            build_index=build_index, jobs=jobs)
                 finally:
                         self.__unlock_rstore()
 
-        def __run_update_index(self):
+        def __run_update_index(self, jobs=None):
                 """ Determines which fmris need to be indexed and passes them
                 to the indexer.
 
@@ -1842,7 +2646,8 @@ class _RepoStore(object):
 
                 if fmris_to_index:
                         self.__index_log("Updating search indexes")
-                        self.__update_searchdb_unlocked(fmris_to_index)
+                        self.__update_searchdb_unlocked(fmris_to_index,
+                            jobs=jobs)
                 else:
                         ind = indexer.Indexer(self.index_root,
                             self._get_manifest, self.manifest,
@@ -1867,12 +2672,25 @@ class _RepoStore(object):
                 if not self.search_available:
                         raise RepositorySearchUnavailableError()
 
+                generation = self.__get_search_generation()
+
                 def _search(q):
                         assert self.index_root
-                        l = sqp.QueryLexer()
-                        l.build()
-                        qqp = sqp.QueryParser(l)
-                        query = qqp.parse(q.text)
+                        key = self.__search_cache.get_key(q)
+                        res = self.__search_cache.get(key, generation)
+                        if res is not None:
+                                return res
+
+                        # Building the parser is far more expensive than
+                        # parsing, so one is shared by all searches; but it
+                        # isn't thread-safe.
+                        with self.__search_lock:
+                                if not self.__search_parser:
+                                        l = sqp.QueryLexer()
+                                        l.build()
+                                        self.__search_parser = \
+                                            sqp.QueryParser(l)
+                                query = self.__search_parser.parse(q.text)
                         query.set_info(num_to_return=q.num_to_return,
                             start_point=q.start_point,
                             index_dir=self.index_root,
@@ -1880,7 +2698,8 @@ class _RepoStore(object):
                             case_sensitive=q.case_sensitive)
                         if q.return_type == sqp.Query.RETURN_PACKAGES:
                                 query.propagate_pkg_return()
-                        return query.search(self.catalog.fmris)
+                        return self.__search_cache.gen_results(key,
+                            generation, query.search(self.catalog.fmris))
 
                 query_lst = []
                 try:
@@ -1894,6 +2713,27 @@ class _RepoStore(object):
                         raise RepositoryError(e)
                 return [_search(q) for q in query_lst]
 
+        def __get_search_generation(self):
+                """Return a value identifying the current state of the search
+                index and catalog; it changes whenever either does."""
+
+                gen = [self.catalog.last_modified]
+                for name in (ss.MAIN_FILE, ss.FAST_ADD, ss.FAST_REMOVE,
+                    ss.FULL_FMRI_FILE, ss.DELTA_SEGMENTS_FILE,
+                    ss.TOMBSTONE_FILE):
+                        try:
+                                st = os.stat(os.path.join(self.index_root,
+                                    name))
+                        except EnvironmentError as e:
+                                if e.errno != errno.ENOENT:
+                                        raise
+                                gen.append(None)
+                                continue
+                        # The indexer always replaces the files it updates,
+                        # so the inode changes even if nothing else does.
+                        gen.append((st.st_ino, st.st_mtime, st.st_size))
+                return tuple(gen)
+
         @property
         def search_available(self):
                 return (self.__search_available and self.index_root and
@@ -2254,10 +3094,102 @@ class _RepoStore(object):
                                         return False, pth
                 return True, None
 
+        def _verify_pkg_manifest(self, pdir, pname, ver, pub, trust_anchors,
+            sig_required_names, use_crls, check_sig=True):
+                """Verify the manifest named 'ver' within the package directory
+                'pdir' for the package stem 'pname'.  This function should be
+                private; but is protected instead due to its usage by verify
+                worker processes.
+
+                If 'check_sig' is False, the signatures of the manifest are
+                assumed to have been verified previously.
+
+                Returns a tuple of (pfmri, bad_manifest, errors, hashes) where
+                'pfmri' is the FMRI of the package or None if one could not be
+                determined, 'bad_manifest' is a boolean indicating whether the
+                manifest could not be loaded, 'errors' is a list of error
+                tuples suitable for passing to __build_verify_error and
+                'hashes' is a sorted list of the (file_name, hash_value,
+                hash_func) tuples for the payloads the manifest references."""
+
+                path = os.path.join(pdir, ver)
+                # Version must be decoded before use.
+                pver = unquote(ver)
+                try:
+                        pfmri = fmri.PkgFmri("@".join((pname, pver)),
+                            publisher=self.publisher)
+                        if not os.path.isfile(path):
+                                raise Exception(
+                                    "{0} is not a file".format(path))
+                except Exception as e:
+                        # Assume the error is result of an unexpected file in
+                        # the directory. We don't know the FMRI here, so use
+                        # None.
+                        return None, False, [(REPO_VERIFY_UNKNOWN, path,
+                            {"err": str(e)})], []
+
+                err = self.__verify_manifest(path, pfmri)
+                if err:
+                        # with a bad manifest, we can go no further
+                        return pfmri, True, [err], []
+
+                hashes, errors = self.__get_hashes(path, pfmri)
+
+                # verify manifest signatures
+                if check_sig:
+                        errors.extend(self.__verify_signature(path, pfmri, pub,
+                            trust_anchors, sig_required_names, use_crls))
+                return pfmri, False, errors, sorted(hashes,
+                    key=lambda h: h[:2])
+
+        def _verify_payload(self, pfmri, fname, h, alg):
+                """Verify the payload stored in the repository under 'fname'
+                against hash value 'h' computed using 'alg' on behalf of the
+                package 'pfmri'.  Returns an error tuple suitable for passing
+                to __build_verify_error or None.  This function should be
+                private; but is protected instead due to its usage by verify
+                worker processes."""
+
+                try:
+                        path = self.cache_store.lookup(fname,
+                            check_existence=False)
+                except apx.PermissionsException as e:
+                        # if we can't even get the path within the
+                        # repository, then we'll do the best we can to
+                        # report the problem.
+                        return (REPO_VERIFY_PERM, pfmri, {"hash": fname,
+                            "err": _("Permission denied.", "path", h)})
+
+                err = self.__verify_perm(path, pfmri, h)
+                if err:
+                        return err
+                return self.__verify_hash(path, pfmri, h, alg=alg)
+
+        def __payload_stat(self, fname):
+                """Return the stat information for the payload stored under
+                'fname' or None if it cannot be determined."""
+
+                try:
+                        return os.stat(self.cache_store.lookup(fname,
+                            check_existence=False))
+                except (apx.PermissionsException, EnvironmentError):
+                        return None
+
         def __gen_verify(self, progtrack, pub, trust_anchors,
-            sig_required_names, use_crls):
+            sig_required_names, use_crls, jobs=1, vstate=None, max_age=None):
                 """A generator that produces verify errors, each a tuple
-                of the form (error_code, path, message, details)"""
+                of the form (error_code, path, message, details)
+
+                If 'jobs' is greater than one, manifests and payloads are
+                verified by that many worker processes; errors are still
+                produced in the same order as they would be serially.
+
+                If 'vstate' is provided, it is a _RepoVerifyState object in
+                which content that is successfully verified is recorded, and
+                content that it shows was verified within 'max_age' seconds,
+                and is unchanged since, is not verified again.  Manifests that
+                are unchanged and only reference such payloads are not read."""
+
                 # We may not have a manifest_root directory if no
                 # packages have ever been published for this publisher.
                 if not os.path.exists(self.manifest_root):
@@ -2304,111 +3236,271 @@ class _RepoStore(object):
                             {"permissionspath": path, "pub": pub.prefix})
                 progtrack.repo_verify_end_pkg(None)
 
+                # Build the ordered list of items to report on; each is a
+                # tuple of (kind, data).  Directory-level errors are found
+                # here, while manifests are handed to verify_manifest below.
+                items = []
+                mfjobs = []
                 for name in mflist:
                         pdir = os.path.join(self.manifest_root, name)
                         err = self.__verify_perm(pdir, None, None)
                         if err:
-                                yield self.__build_verify_error(*err)
+                                items.append(("error", err))
                                 continue
 
                         # Stem must be decoded before use.
                         try:
                                 pname = unquote(name)
-                        except Exception:
+                        except Exception as e:
                                 # Assume error is result of an
                                 # unexpected file in the directory. We
                                 # don't know the FMRI here, so use None.
-                                progtrack.repo_verify_start_pkg(None)
-                                progtrack.repo_verify_add_progress(None)
-                                yield self.__build_verify_error(
-                                    REPO_VERIFY_UNKNOWN, pdir, {"err": str(e)})
-                                progtrack.repo_verify_end_pkg(None)
+                                items.append(("unknown", (REPO_VERIFY_UNKNOWN,
+                                    pdir, {"err": str(e)})))
                                 continue
 
                         for ver in os.listdir(pdir):
-                                path = os.path.join(pdir, ver)
-                                # Version must be decoded before
-                                # use.
-                                pver = unquote(ver)
+                                mname = os.path.join(name, ver)
                                 try:
-                                        pfmri = fmri.PkgFmri("@".join((pname,
-                                            pver)),
-                                            publisher=self.publisher)
-                                        if not os.path.isfile(path):
-                                                raise Exception(
-                                                    "{0} is not a file".format(
-                                                    path))
-                                except Exception as e:
-                                        # Assume the error is result of an
-                                        # unexpected file in the directory. We
-                                        # don't know the FMRI here, so use None.
-                                        progtrack.repo_verify_start_pkg(None)
-                                        progtrack.repo_verify_add_progress(None)
-                                        yield self.__build_verify_error(
-                                            REPO_VERIFY_UNKNOWN, path,
-                                            {"err": str(e)})
-                                        progtrack.repo_verify_end_pkg(None)
-                                        continue
+                                        st = os.stat(os.path.join(pdir, ver))
+                                except EnvironmentError:
+                                        st = None
+                                check_sig = True
+                                if vstate and vstate.check_manifest(mname,
+                                    st, max_age=max_age):
+                                        vstate.keep_manifest(mname)
+                                        check_sig = False
+                                        fnames = vstate.manifest_payloads(
+                                            mname)
+                                        if all(vstate.check_payload(fname,
+                                            None, None,
+                                            self.__payload_stat(fname),
+                                            max_age=max_age)
+                                            for fname in fnames):
+                                                for fname in fnames:
+                                                        vstate.keep_payload(
+                                                            fname)
+                                                items.append(("verified",
+                                                    fmri.PkgFmri("@".join((
+                                                    pname, unquote(ver))),
+                                                    publisher=self.publisher)))
+                                                continue
+                                items.append(("manifest", (mname, st,
+                                    check_sig)))
+                                mfjobs.append((pdir, pname, ver, check_sig))
+
+                pool = None
+                if jobs > 1 and mfjobs:
+                        pool = misc.get_process_pool(jobs,
+                            initializer=_verify_worker_init,
+                            initargs=(self, pub, trust_anchors,
+                            sig_required_names, use_crls))
+                        mfresults = self.__gen_verify_results(pool, jobs,
+                            mfjobs)
+
+                        def verify_payload(pfmri, fname, h, alg):
+                                return pool.apply_async(_verify_payload_job,
+                                    ((pfmri, fname, h, alg),))
+                else:
+                        mfresults = (
+                            self._verify_pkg_manifest(pdir, pname, ver, pub,
+                                trust_anchors, sig_required_names, use_crls,
+                                check_sig=check_sig)
+                            for pdir, pname, ver, check_sig in mfjobs
+                        )
+
+                        def verify_payload(pfmri, fname, h, alg):
+                                return misc.SyncResult(self._verify_payload,
+                                    pfmri, fname, h, alg)
+
+                # Payloads are commonly shared between packages, so each one
+                # is only verified once per run; the result is then reported
+                # against every package that references it.  Entries map
+                # (file_name, hash_value, hash_func) to a tuple of the FMRI
+                # used to verify it, the pending result and the stat
+                # information of the payload before it was verified, or to
+                # None once the payload is known to be good.
+                payloads = {}
+
+                def submit(pfmri, key):
+                        st = None
+                        if vstate:
+                                st = self.__payload_stat(key[0])
+                        if vstate and vstate.check_payload(*(key + (st,)),
+                            max_age=max_age):
+                                vstate.keep_payload(key[0])
+                                payloads[key] = None
+                                return
+                        payloads[key] = (pfmri, verify_payload(pfmri, *key),
+                            st)
 
-                                progtrack.repo_verify_start_pkg(pfmri)
-                                err = self.__verify_manifest(path, pfmri)
-                                if err:
-                                        # with a bad manifest, we can go no
-                                        # further
-                                        yield self.__build_verify_error(*err)
-                                        progtrack.repo_verify_end_pkg(None)
-                                        continue
+                def rebind(pfmri, key):
+                        entry = payloads[key]
+                        if entry is None:
+                                return
+                        vfmri, res, st = entry
+                        err = res.get()
+                        if not err:
+                                if vstate and st:
+                                        vstate.add_payload(*(key + (st,)))
+                                payloads[key] = None
+                                return
+                        if vfmri == pfmri:
+                                return err
+                        error, path, reason = err
+                        reason = reason.copy()
+                        if "pkg" in reason:
+                                reason["pkg"] = pfmri
+                        if path == vfmri:
+                                path = pfmri
+                        return error, path, reason
+
+                def report(kind, data):
+                        if kind == "error":
+                                yield self.__build_verify_error(*data)
+                                return
+                        if kind == "verified":
+                                progtrack.repo_verify_start_pkg(data)
+                                progtrack.repo_verify_end_pkg(data)
+                                return
+                        if kind == "unknown":
+                                progtrack.repo_verify_start_pkg(None)
+                                progtrack.repo_verify_add_progress(None)
+                                yield self.__build_verify_error(*data)
+                                progtrack.repo_verify_end_pkg(None)
+                                return
 
-                                hashes, errors = self.__get_hashes(path, pfmri)
+                        (pfmri, bad_manifest, errors, hashes), \
+                            (mname, st, check_sig) = data
+                        if not pfmri:
+                                progtrack.repo_verify_start_pkg(None)
+                                progtrack.repo_verify_add_progress(None)
                                 for err in errors:
                                         yield self.__build_verify_error(*err)
+                                progtrack.repo_verify_end_pkg(None)
+                                return
 
-                                # verify manifest signatures
-                                errs = self.__verify_signature(path, pfmri, pub,
-                                    trust_anchors, sig_required_names, use_crls)
-                                for err in errs:
-                                        yield self.__build_verify_error(*err)
+                        progtrack.repo_verify_start_pkg(pfmri)
+                        for err in errors:
+                                yield self.__build_verify_error(*err)
+                        if bad_manifest:
+                                progtrack.repo_verify_end_pkg(None)
+                                return
 
-                                # verify payload delivered by this pkg
-                                errors = []
-                                for fname, h, alg in hashes:
-                                        try:
-                                                path = self.cache_store.lookup(
-                                                     fname,
-                                                     check_existence=False)
-                                        except apx.PermissionsException as e:
-                                                # if we can't even get the path
-                                                # within the repository, then
-                                                # we'll do the best we can to
-                                                # report the problem.
-                                                errors.append((REPO_VERIFY_PERM,
-                                                    pfmri, {"hash": fname,
-                                                    "err": _("Permission "
-                                                    "denied.", "path", h)}))
-                                                continue
+                        if vstate and check_sig and st and not errors:
+                                vstate.add_manifest(mname, st,
+                                    [key[0] for key in hashes])
 
-                                        err = self.__verify_perm(path, pfmri, h)
-                                        if err:
-                                                errors.append(err)
-                                                continue
-                                        err = self.__verify_hash(path, pfmri, h,
-                                            alg=alg)
-                                        if err:
-                                                errors.append(err)
-                                for err in errors:
+                        # verify payload delivered by this pkg
+                        for key in hashes:
+                                err = rebind(pfmri, key)
+                                if err:
                                         yield self.__build_verify_error(*err)
+                        progtrack.repo_verify_end_pkg(pfmri)
+
+                def ready(kind, data):
+                        if kind != "manifest":
+                                return True
+                        return all(payloads[key] is None or
+                            payloads[key][1].ready() for key in data[0][3])
+
+                # Items are reported strictly in order, but as soon as the
+                # results they depend on are available so that progress
+                # continues to be shown while workers are busy.
+                pending = collections.deque()
+                try:
+                        for kind, data in items:
+                                if kind == "manifest":
+                                        res = next(mfresults)
+                                        for key in res[3]:
+                                                if key not in payloads:
+                                                        submit(res[0], key)
+                                        data = (res, data)
+                                pending.append((kind, data))
+                                while pending and ready(*pending[0]):
+                                        for err in report(*pending.popleft()):
+                                                yield err
+
+                        while pending:
+                                for err in report(*pending.popleft()):
+                                        yield err
+                except:
+                        if pool:
+                                pool.terminate()
+                                pool.join()
+                                pool = None
+                        raise
+                finally:
+                        if pool:
+                                pool.close()
+                                pool.join()
 
-                                progtrack.repo_verify_end_pkg(fmri)
+                if vstate:
+                        vstate.save()
                 progtrack.job_done(progtrack.JOB_REPO_VERIFY_REPO)
 
+        @staticmethod
+        def __gen_verify_results(pool, jobs, mfjobs):
+                """A generator that verifies the manifests described by
+                'mfjobs' using the worker processes in 'pool' and yields the
+                result for each in order.
+
+                Manifests are submitted in small batches, and only a few
+                batches ahead of the results consumed so far, so that the
+                payload jobs the caller submits for each result are queued
+                alongside the remaining manifests rather than after all of
+                them."""
+
+                size = max(1, min(16, len(mfjobs) // (jobs * 4)))
+                batches = (
+                    mfjobs[i:i + size] for i in range(0, len(mfjobs), size)
+                )
+                window = collections.deque()
+
+                def submit():
+                        batch = next(batches, None)
+                        if batch:
+                                window.append(pool.apply_async(
+                                    _verify_manifest_job, (batch,)))
+
+                for i in range(jobs * 2):
+                        submit()
+                while window:
+                        for res in window.popleft().get():
+                                yield res
+                        submit()
+
+        def __get_verify_state(self, policy=None):
+                """Return a _RepoVerifyState object for this repository store
+                or None if the store has no root."""
+
+                root = self.writable_root or self.root
+                if not root:
+                        return None
+                return _RepoVerifyState(os.path.join(root, "verify.dat"),
+                    policy=policy)
+
         def verify(self, pub=None, progtrack=None,
-            trust_anchor_dir=None, sig_required_names=None, use_crls=False):
+            trust_anchor_dir=None, sig_required_names=None, use_crls=False,
+            jobs=1, incremental=False, max_age=None):
                 """A generator which verifies the contents of the repository
                 store, checking for several different types of errors.
                 No modifying operations may be performed until complete.
 
                 'progtrack' is an optional ProgressTracker object.
 
+                'jobs' is the number of worker processes to use to verify
+                manifests and payloads.
+
+                'incremental' is an optional boolean indicating that content
+                recorded as successfully verified by a previous incremental
+                run, and that is unchanged since, should not be verified again.
+                Results are only recorded if 'incremental' is True.
+
+                'max_age' is an optional number of seconds after which
+                previously verified content is verified again even if
+                'incremental' is True.
+
                 'trust_anchor_dir' is set in the repository configuration and
                 corresponds to the image property of the same name.
 
@@ -2435,7 +3527,7 @@ class _RepoStore(object):
                         raise RepositoryUnsupportedOperationError()
 
                 if not progtrack:
-                        progtrack = progtrack.NullProgressTracker()
+                        progtrack = progress.NullProgressTracker()
 
                 # For signature verification, we need to setup a publisher
                 # meta_root, and build a dictionary of trust-anchors.
@@ -2470,8 +3562,19 @@ class _RepoStore(object):
 
                 self.__lock_rstore()
                 try:
+                        # Verification results are only recorded for, and
+                        # used by, incremental verification.
+                        vstate = None
+                        if incremental:
+                                vstate = self.__get_verify_state(
+                                    policy=[sorted(trust_anchors),
+                                    sorted(sig_required_names or []),
+                                    bool(use_crls)])
+                        if vstate:
+                                vstate.load()
                         for err in self.__gen_verify(progtrack, pub,
-                            trust_anchors, sig_required_names, use_crls):
+                            trust_anchors, sig_required_names, use_crls,
+                            jobs=jobs, vstate=vstate, max_age=max_age):
                                 yield err
                 except (Exception, EnvironmentError) as e:
                         import traceback
@@ -2603,6 +3706,17 @@ class _RepoStore(object):
 
                 progtrack.job_done(progtrack.JOB_REPO_FIX_REPO)
 
+                # Forget verification results for anything quarantined so
+                # that it is verified again should it be republished.
+                vstate = self.__get_verify_state()
+                if vstate and fixed_paths:
+                        mroot = self.manifest_root + os.path.sep
+                        vstate.discard(
+                            manifests=[p[len(mroot):] for p in fixed_paths
+                                if p.startswith(mroot)],
+                            payloads=[os.path.basename(p) for p in fixed_paths
+                                if not p.startswith(mroot)])
+
                 if broken_items:
                         self.rebuild()
 
@@ -2654,7 +3768,7 @@ class Repository(object):
         pkg(5) repository and an interface to manipulate it."""
 
         def __init__(self, allow_invalid=False, cfgpathname=None, create=False,
-            file_root=None, log_obj=None, mirror=False,
+            file_root=None, index_jobs=1, log_obj=None, mirror=False,
             properties=misc.EmptyDict, read_only=False, root=None,
             sort_file_max_size=indexer.SORT_FILE_MAX_SIZE, writable_root=None):
                 """Prepare the repository for use."""
@@ -2686,6 +3800,7 @@ class Repository(object):
                 # Initialize.
                 self.__cfgpathname = cfgpathname
                 self.__cfg = None
+                self.__index_jobs = index_jobs
                 self.__mirror = mirror
                 self.__read_only = read_only
                 self.__rstores = None
@@ -3017,6 +4132,7 @@ class Repository(object):
 
                 rstore = _RepoStore(allow_invalid=allow_invalid,
                     file_layout=file_layout, file_root=froot,
+                    index_jobs=self.__index_jobs,
                     log_obj=self.log_obj, mirror=self.mirror, pub=pub,
                     read_only=self.read_only, root=root,
                     sort_file_max_size=self.__sort_file_max_size,
@@ -3569,9 +4685,13 @@ class Repository(object):
                                 pubs.add(rstore.publisher)
                 return pubs
 
-        def refresh_index(self, pub=None):
+        def refresh_index(self, pub=None, jobs=None):
                 """ This function refreshes the search indexes if there any new
                 packages.
+
+                'jobs' is the number of worker processes to use to tokenize
+                manifests; if not provided, the repository's index_jobs is
+                used.
                 """
 
                 for rstore in self.rstores:
@@ -3579,7 +4699,7 @@ class Repository(object):
                                 continue
                         if pub and rstore.publisher and rstore.publisher != pub:
                                 continue
-                        rstore.refresh_index()
+                        rstore.refresh_index(jobs=jobs)
 
         def remove_packages(self, packages, progtrack=None, pub=None):
                 """Removes the specified packages from the repository.
@@ -3657,7 +4777,33 @@ class Repository(object):
                 rstore = self.get_trans_rstore(trans_id)
                 return rstore.add_file(trans_id, data=data, size=size)
 
-        def rebuild(self, build_catalog=True, build_index=False, pub=None):
+        def gc(self, dry_run=False, progtrack=None, pub=None):
+                """A generator that removes payload files that are not
+                referenced by any package in the repository and yields a tuple
+                of (name, pathname, size) for each.
+
+                'dry_run' is an optional boolean indicating that files should
+                only be reported and not removed.
+
+                'progtrack' is an optional ProgressTracker object.
+
+                'pub' is an optional publisher prefix to limit the operation
+                to."""
+
+                if pub:
+                        rstores = [self.get_pub_rstore(pub)]
+                else:
+                        rstores = [
+                            rstore for rstore in self.rstores
+                            if rstore.publisher
+                        ]
+                for rstore in rstores:
+                        for entry in rstore.gc(dry_run=dry_run,
+                            progtrack=progtrack):
+                                yield entry
+
+        def rebuild(self, build_catalog=True, build_index=False, pub=None,
+            jobs=1):
                 """Rebuilds the repository catalog and search indexes using the
                 package manifests currently in the repository.
 
@@ -3667,6 +4813,9 @@ class Repository(object):
 
                 'build_index' is an optional boolean value indicating whether
                 search indexes should be built.
+
+                'jobs' is an optional number of worker processes to load the
+                package manifests with.
                 """
 
                 for rstore in self.rstores:
@@ -3675,7 +4824,7 @@ class Repository(object):
                         if pub and rstore.publisher and rstore.publisher != pub:
                                 continue
                         rstore.rebuild(build_catalog=build_catalog,
-                            build_index=build_index)
+                            build_index=build_index, jobs=jobs)
 
         def reload(self):
                 """Reloads the repository state information."""
@@ -3746,12 +4895,24 @@ class Repository(object):
                 rstore.update_publisher(pub)
 
         def verify(self, pubs=[], allowed_checks=[],
-            force_dep_check=False, ignored_dep_files=[], progtrack=None):
+            force_dep_check=False, ignored_dep_files=[], progtrack=None,
+            jobs=1, incremental=False, max_age=None):
                 """A generator that verifies that repository content matches
                 expected state for all or specified publishers.
 
                 'progtrack' is an optional ProgressTracker object.
 
+                'jobs' is the number of worker processes to use to verify
+                package content.
+
+                'incremental' is an optional boolean indicating that package
+                content that was successfully verified by a previous run, and
+                that is unchanged since, should not be verified again.
+
+                'max_age' is an optional number of seconds after which
+                package content is verified again even if 'incremental' is
+                True.
+
                 'pubs' is an optional publisher list to limit the
                 operation to.
 
@@ -3791,7 +4952,8 @@ class Repository(object):
                         for verify_tuple in rstore.verify(progtrack=progtrack,
                             pub=pub, trust_anchor_dir=trust_anchor_dir,
                             sig_required_names=sig_required_names,
-                            use_crls=use_crls):
+                            use_crls=use_crls, jobs=jobs,
+                            incremental=incremental, max_age=max_age):
                                 yield verify_tuple
 
                 if VERIFY_DEPENDENCY in allowed_checks:
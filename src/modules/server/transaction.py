@@ -701,7 +701,23 @@ class Transaction(object):
                 src_mpath = os.path.join(self.dir, "manifest")
                 dest_mpath = self.rstore.manifest(self.fmri)
                 misc.makedirs(os.path.dirname(dest_mpath))
+
+                # Record the payload references of the new manifest before it
+                # is put in place, and drop those of any manifest it replaces
+                # only after it is gone so that repository garbage collection
+                # never sees a referenced payload as unreferenced.
+                old_m = None
+                if not self.rstore.read_only:
+                        new_m = pkg.manifest.Manifest()
+                        new_m.set_content(pathname=src_mpath)
+                        if os.path.exists(dest_mpath):
+                                old_m = pkg.manifest.Manifest()
+                                old_m.set_content(pathname=dest_mpath)
+                        self.rstore.update_refs(added=new_m)
+
                 portable.rename(src_mpath, dest_mpath)
+                if old_m:
+                        self.rstore.update_refs(removed=old_m)
 
                 # Move each file to file_root, with appropriate directory
                 # structure.
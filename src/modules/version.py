@@ -99,6 +99,11 @@ class DotSequence(list):
                 if len(self) == 0:
                         raise IllegalDotSequence("Empty DotSequence")
 
+        def __reduce__(self):
+                # __new__ requires the dotstring, which pickle would otherwise
+                # not supply when recreating the object.
+                return (self.__class__, (str(self),))
+
         def __str__(self):
                 return ".".join(map(str, self))
 
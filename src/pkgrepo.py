@@ -165,21 +165,24 @@ Subcommands:
      pkgrepo contents [-m] [-t action_type ...] -s repo_uri_or_path
          [--key ssl_key ... --cert ssl_cert ...] [pkg_fmri_pattern ...]
 
-     pkgrepo rebuild [-p publisher ...] -s repo_uri_or_path [--key ssl_key ...
-         --cert ssl_cert ...] [--no-catalog] [--no-index]
+     pkgrepo rebuild [-j jobs] [-p publisher ...] -s repo_uri_or_path
+         [--key ssl_key ... --cert ssl_cert ...] [--no-catalog] [--no-index]
 
-     pkgrepo refresh [-p publisher ...] -s repo_uri_or_path [--key ssl_key ...
-         --cert ssl_cert ...] [--no-catalog] [--no-index]
+     pkgrepo refresh [-j jobs] [-p publisher ...] -s repo_uri_or_path
+         [--key ssl_key ... --cert ssl_cert ...] [--no-catalog] [--no-index]
 
      pkgrepo remove [-n] [-p publisher ...] -s repo_uri_or_path
          pkg_fmri_pattern ...
 
+     pkgrepo gc [-n] [-p publisher ...] -s repo_uri_or_path
+
      pkgrepo set [-p publisher ...] -s repo_uri_or_path
          section/property[+|-]=[value] ... or
          section/property[+|-]=([value]) ...
 
-     pkgrepo verify [-d] [-p publisher ...] [-i ignored_dep_file ...]
-         [--disable verification ...] -s repo_uri_or_path
+     pkgrepo verify [-d] [-j jobs] [-p publisher ...]
+         [-i ignored_dep_file ...] [--disable verification ...]
+         [--incremental [--reverify-age days]] -s repo_uri_or_path
 
      pkgrepo fix [-v] [-p publisher ...] -s repo_uri_or_path
 
@@ -277,6 +280,63 @@ def subcmd_remove(conf, args):
         return EXIT_OK
 
 
+def subcmd_gc(conf, args):
+        """Remove payload files no longer referenced by any package in the
+        repository."""
+
+        subcommand = "gc"
+
+        opts, pargs = getopt.getopt(args, "np:s:")
+
+        dry_run = False
+        pubs = set()
+        for opt, arg in opts:
+                if opt == "-n":
+                        dry_run = True
+                elif opt == "-p":
+                        if not misc.valid_pub_prefix(arg):
+                                error(_("Invalid publisher prefix '{0}'").format(
+                                    arg), cmd=subcommand)
+                        pubs.add(arg)
+                elif opt == "-s":
+                        conf["repo_uri"] = parse_uri(arg)
+
+        if pargs:
+                usage(_("command does not take operands"), cmd=subcommand)
+
+        # Get repository object.
+        if not conf.get("repo_uri", None):
+                usage(_("A package repository location must be provided "
+                    "using -s."), cmd=subcommand)
+        repo = get_repo(conf, read_only=dry_run, subcommand=subcommand)
+
+        if "all" in pubs or not pubs:
+                pubs = set(repo.publishers)
+
+        progtrack = get_tracker()
+        for pub in sorted(pubs):
+                count = 0
+                total = 0
+                for name, path, size in repo.gc(dry_run=dry_run,
+                    progtrack=progtrack, pub=pub):
+                        count += 1
+                        total += size
+                        if dry_run:
+                                logger.info("\t{0}".format(path))
+
+                size = misc.bytes_to_str(total)
+                if dry_run:
+                        logger.info(_("{count:d} unreferenced file(s) "
+                            "({size}) would be removed for publisher "
+                            "{pub}.").format(**locals()))
+                else:
+                        logger.info(_("{count:d} unreferenced file(s) "
+                            "({size}) removed for publisher {pub}.").format(
+                            **locals()))
+
+        return EXIT_OK
+
+
 def get_repo(conf, allow_invalid=False, read_only=True, subcommand=None):
         """Return the repository object for current program configuration.
 
@@ -1180,7 +1240,8 @@ were found in the repository."""))
         return rval
 
 
-def __rebuild_local(subcommand, conf, pubs, build_catalog, build_index):
+def __rebuild_local(subcommand, conf, pubs, build_catalog, build_index,
+    jobs=1):
         """In an attempt to allow operations on potentially corrupt
         repositories, 'local' repositories (filesystem-basd ones) are handled
         separately."""
@@ -1205,7 +1266,7 @@ def __rebuild_local(subcommand, conf, pubs, build_catalog, build_index):
         logger.info("Initiating repository rebuild.")
         for pfx in found:
                 repo.rebuild(build_catalog=build_catalog,
-                    build_index=build_index, pub=pfx)
+                    build_index=build_index, pub=pfx, jobs=jobs)
 
         return rval
 
@@ -1243,12 +1304,21 @@ def subcmd_rebuild(conf, args):
         build_index = True
         key = None
         cert = None
+        jobs = 1
 
-        opts, pargs = getopt.getopt(args, "p:s:", ["no-catalog", "no-index",
+        opts, pargs = getopt.getopt(args, "j:p:s:", ["no-catalog", "no-index",
             "key=", "cert="])
         pubs = set()
         for opt, arg in opts:
-                if opt == "-p":
+                if opt == "-j":
+                        try:
+                                jobs = int(arg)
+                                if jobs < 1:
+                                        raise ValueError()
+                        except ValueError:
+                                usage(_("-j must be a positive integer"),
+                                    cmd=subcommand)
+                elif opt == "-p":
                         if not misc.valid_pub_prefix(arg):
                                 error(_("Invalid publisher prefix '{0}'").format(
                                     arg), cmd=subcommand)
@@ -1278,12 +1348,47 @@ def subcmd_rebuild(conf, args):
 
         if conf["repo_uri"].scheme == "file":
                 return __rebuild_local(subcommand, conf, pubs, build_catalog,
-                    build_index)
+                    build_index, jobs=jobs)
+
+        if jobs > 1:
+                usage(_("-j may only be used with file system based "
+                    "repositories"), cmd=subcommand)
 
         return __rebuild_remote(subcommand, conf, pubs, key, cert,
             build_catalog, build_index)
 
 
+def __refresh_local(subcommand, conf, pubs, add_content, refresh_index,
+    jobs):
+        """Refresh a 'local' repository (filesystem-based one) directly so
+        that the search indexes can be updated using multiple processes."""
+
+        repo = get_repo(conf, read_only=False, subcommand=subcommand)
+
+        rpubs = set(repo.publishers)
+        if not pubs:
+                found = rpubs
+        else:
+                found = rpubs & pubs
+        notfound = pubs - found
+
+        rval = EXIT_OK
+        if found and notfound:
+                rval = EXIT_PARTIAL
+        elif pubs and not found:
+                error(_("no matching publishers found"), cmd=subcommand)
+                return EXIT_OOPS
+
+        logger.info("Initiating repository refresh.")
+        for pfx in found:
+                if add_content:
+                        repo.add_content(pub=pfx)
+                if refresh_index:
+                        repo.refresh_index(pub=pfx, jobs=jobs)
+
+        return rval
+
+
 def subcmd_refresh(conf, args):
         """Refresh the repository's catalog and index data (as permitted)."""
 
@@ -1292,12 +1397,21 @@ def subcmd_refresh(conf, args):
         refresh_index = True
         key = None
         cert = None
+        jobs = 1
 
-        opts, pargs = getopt.getopt(args, "p:s:", ["no-catalog", "no-index",
+        opts, pargs = getopt.getopt(args, "j:p:s:", ["no-catalog", "no-index",
             "key=", "cert="])
         pubs = set()
         for opt, arg in opts:
-                if opt == "-p":
+                if opt == "-j":
+                        try:
+                                jobs = int(arg)
+                                if jobs < 1:
+                                        raise ValueError()
+                        except ValueError:
+                                usage(_("-j must be a positive integer"),
+                                    cmd=subcommand)
+                elif opt == "-p":
                         if not misc.valid_pub_prefix(arg):
                                 error(_("Invalid publisher prefix '{0}'").format(
                                     arg), cmd=subcommand)
@@ -1325,6 +1439,13 @@ def subcmd_refresh(conf, args):
                 usage(_("A package repository location must be provided "
                     "using -s."), cmd=subcommand)
 
+        if jobs > 1:
+                if conf["repo_uri"].scheme != "file":
+                        usage(_("-j may only be used with file system based "
+                            "repositories"), cmd=subcommand)
+                return __refresh_local(subcommand, conf, pubs, add_content,
+                    refresh_index, jobs)
+
         def do_refresh(xport, xpub):
                 if add_content and refresh_index:
                         xport.publish_refresh(xpub)
@@ -1648,10 +1769,14 @@ def subcmd_verify(conf, args):
         subcommand = "verify"
         __load_verify_msgs()
 
-        opts, pargs = getopt.getopt(args, "dp:s:i:", ["disable="])
+        opts, pargs = getopt.getopt(args, "dj:p:s:i:", ["disable=",
+            "incremental", "reverify-age="])
         allowed_checks = set(sr.verify_default_checks)
         force_dep_check = False
         ignored_dep_files = []
+        incremental = False
+        jobs = 1
+        max_age = None
         pubs = set()
         for opt, arg in opts:
                 if opt == "-s":
@@ -1663,6 +1788,14 @@ def subcmd_verify(conf, args):
                         pubs.add(arg)
                 elif opt == "-d":
                         force_dep_check = True
+                elif opt == "-j":
+                        try:
+                                jobs = int(arg)
+                                if jobs < 1:
+                                        raise ValueError()
+                        except ValueError:
+                                usage(_("-j must be a positive integer"),
+                                    cmd=subcommand)
                 elif opt == "--disable":
                         arg = arg.lower()
                         if arg in sr.verify_default_checks:
@@ -1674,10 +1807,24 @@ def subcmd_verify(conf, args):
                                     sr.verify_default_checks)), cmd=subcommand)
                 elif opt == "-i":
                         ignored_dep_files.append(arg)
+                elif opt == "--incremental":
+                        incremental = True
+                elif opt == "--reverify-age":
+                        try:
+                                max_age = float(arg) * 86400
+                                if max_age <= 0:
+                                        raise ValueError()
+                        except ValueError:
+                                usage(_("--reverify-age must be a positive "
+                                    "number of days"), cmd=subcommand)
 
         if pargs:
                 usage(_("command does not take operands"), cmd=subcommand)
 
+        if max_age and not incremental:
+                usage(_("--reverify-age may only be used with "
+                    "--incremental"), cmd=subcommand)
+
         repo_uri = conf.get("repo_uri", None)
         if not repo_uri:
                 usage(_("A package repository location must be provided "
@@ -1724,7 +1871,8 @@ def subcmd_verify(conf, args):
 
         for verify_tuple in repo.verify(pubs=found_pubs,
             allowed_checks=allowed_checks, force_dep_check=force_dep_check,
-            ignored_dep_files=ignored_dep_files, progtrack=progtrack):
+            ignored_dep_files=ignored_dep_files, progtrack=progtrack,
+            jobs=jobs, incremental=incremental, max_age=max_age):
                 report_error(verify_tuple)
 
         if bad_fmris:
@@ -32,8 +32,11 @@ import gettext
 import locale
 import os
 import shutil
+import simplejson as json
+import six
 import sys
 import tempfile
+import threading
 import traceback
 import warnings
 
@@ -46,17 +49,22 @@ import pkg.client.api_errors as apx
 import pkg.client.pkgdefs as pkgdefs
 import pkg.client.publisher as publisher
 import pkg.client.transport.transport as transport
+import pkg.digest as digest
+import pkg.file_layout.file_manager as file_manager
 import pkg.misc as misc
 import pkg.mogrify as mog
 import pkg.p5p
 import pkg.pkgsubprocess as subprocess
+import pkg.portable as portable
 import pkg.publish.transaction as trans
 import pkg.server.repository as sr
 import pkg.version as version
 
 from pkg.client import global_settings
 from pkg.misc import emsg, get_pkg_otw_size, msg, PipeError
+from pkg.pkggzip import PkgGzipFile
 from pkg.client.debugvalues import DebugValues
+from six.moves import queue
 from six.moves.urllib.parse import quote
 
 # Globals
@@ -98,7 +106,7 @@ def usage(usage_error=None, retcode=2):
         msg(_("""\
 Usage:
         pkgrecv [-aknrv] [-s src_uri] [-d (path|dest_uri)] [-c cache_dir]
-            [-m match] [--mog-file file_path ...] [--raw]
+            [-j jobs] [-m match] [--mog-file file_path ...] [--raw]
             [--key src_key --cert src_cert]
             [--dkey dest_key --dcert dest_cert]
             (fmri|pattern) ...
@@ -125,6 +133,16 @@ Options:
 
         -h              Display this usage message.
 
+        -j jobs         The maximum number of packages whose content is
+                        retrieved or stored at once, including the package
+                        being republished.  Content for later packages is
+                        retrieved while earlier ones are republished.  The
+                        default is 1, which retrieves and republishes each
+                        package in turn.  When used with -a, the number of
+                        threads used to read package content while the
+                        archive is written.  This option can not be combined
+                        with --clone or --raw.
+
         -k              Keep the retrieved package content compressed, ignored
                         when republishing.  Should not be used with pkgsend.
 
@@ -324,13 +342,262 @@ def get_sizes(mfst):
                                 getb += a.get_action_chain_csize()
         return getb, getf, sendb, sendcb
 
-def add_hashes_to_multi(mfst, multi):
+class KnownPayloads(object):
+        """Tracks the payloads that don't need to be retrieved during a run,
+        either because they were already retrieved earlier in the run or
+        because they are already present in the destination repository."""
+
+        def __init__(self, fmgr=None):
+                """'fmgr' is the optional FileManager object for the file store
+                of the destination repository."""
+
+                self.__fmgr = fmgr
+                self.__paths = {}
+                self.__stored = None
+
+        def __contains__(self, hashval):
+                if hashval in self.__paths:
+                        return True
+                if self.__stored is not None:
+                        return hashval in self.__stored
+                return self.lookup(hashval) is not None
+
+        def add(self, hashval, path=None):
+                """Record that the payload 'hashval' is available, and the
+                pathname of a local copy of it if known."""
+
+                self.__paths[hashval] = path
+
+        def lookup(self, hashval):
+                """Returns the pathname of a local copy of the payload
+                'hashval' or None if there isn't one."""
+
+                path = self.__paths.get(hashval)
+                if path is None and self.__fmgr:
+                        if self.__stored is not None and \
+                            hashval not in self.__stored:
+                                return None
+                        path = self.__fmgr.lookup(hashval)
+                        if path is not None:
+                                self.__paths[hashval] = path
+                return path
+
+        def seed(self):
+                """Record every payload in the destination's file store at
+                once.  This is cheaper than looking them up individually when
+                most of the store is likely to be consulted."""
+
+                if not self.__fmgr:
+                        return
+                self.__stored = set()
+                try:
+                        self.__stored.update(self.__fmgr.walk())
+                except file_manager.UnrecognizedFilePaths:
+                        # Anything not named by hash isn't a payload.
+                        pass
+
+def get_known_payloads(repo, pub):
+        """Returns a KnownPayloads object for the file store of the publisher
+        'pub' in the Repository 'repo'."""
+
+        try:
+                rstore = repo.get_pub_rstore(pub)
+        except sr.RepositoryUnknownPublisher:
+                return KnownPayloads()
+        return KnownPayloads(rstore.cache_store)
+
+def payload_hash(action):
+        """Returns the hash that the payload of 'action' is stored by in a
+        repository, which is its least-preferred hash."""
+
+        return digest.get_least_preferred_hash(action)[1]
+
+def open_stored_payload(path):
+        """Returns a file object for the uncompressed content of the payload
+        stored in a repository at 'path'."""
+
+        if PkgGzipFile.test_is_pkggzipfile(path):
+                return PkgGzipFile(path, "rb")
+        return open(path, "rb")
+
+def add_hashes_to_multi(mfst, multi, known=None, pkgdir=None, tracker=None):
         """Takes a manifest and a multi object and adds the hashes to the multi
-        object."""
+        object.
+
+        If 'known' is provided, it is a KnownPayloads object and payloads that
+        it contains are not added to the multi object.  If 'pkgdir' is also
+        provided, the local copies of those payloads are linked into it.  The
+        progress of those payloads is reported to 'tracker' as it would be for
+        cached files.  Signature actions are always added, as their payloads
+        include certificates that are handled separately."""
 
         for a in mfst.gen_actions():
-                if a.has_payload:
-                        multi.add_action(a)
+                if not a.has_payload:
+                        continue
+                if known is not None and a.name != "signature":
+                        hval = payload_hash(a)
+                        if hval in known:
+                                if pkgdir:
+                                        link_payload(known.lookup(hval),
+                                            os.path.join(pkgdir, hval))
+                                if tracker:
+                                        tracker.download_add_progress(1,
+                                            int(get_pkg_otw_size(a)),
+                                            cachehit=True)
+                                continue
+                multi.add_action(a)
+
+def link_payload(src, dest):
+        """Makes the payload at 'src' available at 'dest', linking it if
+        possible."""
+
+        if os.path.exists(dest):
+                return
+        misc.makedirs(os.path.dirname(dest))
+        try:
+                os.link(src, dest)
+        except EnvironmentError:
+                portable.copyfile(src, dest)
+
+def record_payloads(mfst, known, pkgdir=None):
+        """Record the payloads of the manifest 'mfst' in the KnownPayloads
+        object 'known' once they have been retrieved, along with the paths of
+        their copies in 'pkgdir' if provided.  Returns a list of the hashes of
+        the payloads recorded."""
+
+        hashes = []
+        for a in mfst.gen_actions():
+                if not a.has_payload or a.name == "signature":
+                        continue
+                hval = payload_hash(a)
+                if pkgdir:
+                        known.add(hval, os.path.join(pkgdir, hval))
+                else:
+                        known.add(hval)
+                hashes.append(hval)
+        return hashes
+
+def get_payload_hashes(mfst):
+        """Return the set of names under which the payloads of the manifest
+        'mfst', including any signature certificates, are retrieved."""
+
+        hashes = set()
+        for a in mfst.gen_actions():
+                if not a.has_payload:
+                        continue
+                hattr, hval, hfunc = digest.get_least_preferred_hash(a)
+                hashes.add(hval)
+                if a.name == "signature":
+                        hashes.update(a.get_chain_certs(least_preferred=True))
+        return hashes
+
+def remove_cached_payloads(hashes):
+        """Remove the payloads named in 'hashes' from the download cache."""
+
+        cache = file_manager.FileManager(cache_dir, False)
+        for h in hashes:
+                path = cache.lookup(h)
+                if not path:
+                        continue
+                try:
+                        portable.remove(path)
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise apx._convert_error(e)
+
+class CloneJournal(object):
+        """A persistent record of the packages that a clone operation has
+        finished retrieving into a repository store, used to resume an
+        interrupted clone where it stopped.
+
+        The journal starts with a header line, and each completed package is
+        then appended as a line of JSON containing its FMRI and the hashes of
+        its payloads, which the transport verified when retrieving them.
+        Entries are synced to disk as they are written, so an interruption
+        loses at most the entry being written, which is ignored when the
+        journal is loaded."""
+
+        VERSION = 1
+
+        def __init__(self, pathname):
+                self.pathname = pathname
+                self.__file = None
+
+        def load(self):
+                """Returns a dictionary mapping the FMRI strings of completed
+                packages to lists of the hashes of their payloads.  A missing
+                or unrecognized journal is treated as empty."""
+
+                done = {}
+                try:
+                        with open(self.pathname, "rb") as f:
+                                lines = f.readlines()
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
+                        return done
+
+                for i, l in enumerate(lines):
+                        try:
+                                entry = json.loads(misc.force_str(l))
+                        except ValueError:
+                                # Partially written entry.
+                                continue
+                        if not isinstance(entry, dict):
+                                continue
+                        if i == 0:
+                                if entry.get("version") != self.VERSION:
+                                        return {}
+                                continue
+                        if "fmri" in entry:
+                                done[entry["fmri"]] = entry.get("hashes", [])
+                return done
+
+        def open(self, done):
+                """Open the journal for writing, retaining the entries in
+                'done', a dictionary as returned by load()."""
+
+                fd, fn = tempfile.mkstemp(dir=os.path.dirname(self.pathname))
+                try:
+                        os.fchmod(fd, misc.PKG_FILE_MODE)
+                        with os.fdopen(fd, "wb") as f:
+                                f.write(misc.force_bytes(json.dumps({
+                                    "version": self.VERSION }) + "\n"))
+                                for pfmri, hashes in six.iteritems(done):
+                                        f.write(misc.force_bytes(json.dumps({
+                                            "fmri": pfmri,
+                                            "hashes": hashes }) + "\n"))
+                        portable.rename(fn, self.pathname)
+                except:
+                        if os.path.exists(fn):
+                                os.unlink(fn)
+                        raise
+                self.__file = open(self.pathname, "ab")
+
+        def add(self, pfmri, hashes):
+                """Record that package 'pfmri' and the payloads with the given
+                'hashes' have been retrieved."""
+
+                self.__file.write(misc.force_bytes(json.dumps({
+                    "fmri": str(pfmri), "hashes": hashes }) + "\n"))
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+
+        def close(self):
+                if self.__file:
+                        self.__file.close()
+                        self.__file = None
+
+        def remove(self):
+                """Close and remove the journal; this should be done once the
+                clone it records has completed."""
+
+                self.close()
+                try:
+                        portable.remove(self.pathname)
+                except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                                raise
 
 def prune(fmri_list, all_versions, all_timestamps):
         """Returns a filtered version of fmri_list based on the provided
@@ -407,6 +674,7 @@ def main_func():
         publishers = []
         clone = False
         verbose = False
+        jobs = 1
 
         temp_root = misc.config_temp_root()
 
@@ -421,7 +689,7 @@ def main_func():
         src_uri = os.environ.get("PKG_SRC", None)
 
         try:
-                opts, pargs = getopt.getopt(sys.argv[1:], "ac:D:d:hkm:np:rs:v",
+                opts, pargs = getopt.getopt(sys.argv[1:], "ac:D:d:hj:km:np:rs:v",
                     ["cert=", "key=", "dcert=", "dkey=", "mog-file=", "newest",
                     "raw", "debug=", "clone"])
         except getopt.GetoptError as e:
@@ -450,6 +718,14 @@ def main_func():
                         DebugValues.set_value(key, value)
                 elif opt == "-h":
                         usage(retcode=0)
+                elif opt == "-j":
+                        try:
+                                jobs = int(arg)
+                                if jobs < 1:
+                                        raise ValueError()
+                        except ValueError:
+                                usage(_("-j requires a positive integer "
+                                    "argument"))
                 elif opt == "-k":
                         keep_compressed = True
                 elif opt == "-m":
@@ -529,6 +805,9 @@ def main_func():
         if mog_files and clone:
                 usage(_("--mog-file can not be used with --clone.\n"))
 
+        if jobs > 1 and (clone or raw):
+                usage(_("-j can not be used with --clone or --raw.\n"))
+
         incoming_dir = tempfile.mkdtemp(dir=temp_root,
             prefix=global_settings.client_name + "-")
         tmpdirs.append(incoming_dir)
@@ -544,6 +823,13 @@ def main_func():
         # repository endpoints.
         dest_xport, dest_xport_cfg = transport.setup_transport()
         dest_xport_cfg.add_cache(cache_dir, readonly=False)
+        if jobs > 1:
+                # Publication removes the destination's incoming files after
+                # each package, so they must be kept apart from those of the
+                # retrievals in progress for later packages.
+                incoming_dir = tempfile.mkdtemp(dir=temp_root,
+                    prefix=global_settings.client_name + "-")
+                tmpdirs.append(incoming_dir)
         dest_xport_cfg.incoming_root = incoming_dir
 
         # Configure src publisher(s).
@@ -564,10 +850,10 @@ def main_func():
                 # of operation so gets its own routine.  Notably, it requires
                 # that all package data be retrieved before the archival process
                 # is started.
-                return archive_pkgs(*args)
+                return archive_pkgs(*args, jobs=jobs)
 
         # Normal package transfer allows operations on a per-package basis.
-        return transfer_pkgs(*args)
+        return transfer_pkgs(*args, jobs=jobs)
 
 def check_processed(any_matched, any_unmatched, total_processed):
         # Reduce unmatched patterns to those that were unmatched for all
@@ -749,8 +1035,10 @@ def _rm_temp_raw_files(fmri, xport_cfg, ignore_errors=False):
 
 def archive_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
     keep_compresed, raw, recursive, dry_run, verbose, dest_xport_cfg, src_uri,
-    dkey, dcert, mog_files):
-        """Retrieve source package data completely and then archive it."""
+    dkey, dcert, mog_files, jobs=1):
+        """Retrieve source package data completely and then archive it.  If
+        'jobs' is greater than 1, that many threads read package data while
+        the archive is written."""
 
         global cache_dir, download_start, xport, xport_cfg
         do_mog = False
@@ -909,17 +1197,21 @@ def archive_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                         total_processed = len(matches)
                         continue
 
+                # Payloads shared between packages are only retrieved once.
+                known = KnownPayloads()
                 for nf in matches:
                         tracker.download_start_pkg(nf)
                         pkgdir = xport_cfg.get_pkg_dir(nf)
                         mfile = xport.multi_file_ni(src_pub, pkgdir,
                             progtrack=tracker)
                         nm = fmappings[nf]
-                        add_hashes_to_multi(nm, mfile)
+                        add_hashes_to_multi(nm, mfile, known=known,
+                            pkgdir=pkgdir, tracker=tracker)
 
                         if mfile:
                                 download_start = True
                                 mfile.wait_files()
+                        record_payloads(nm, known, pkgdir)
 
                         if not dry_run:
                                 archive_list.append((nf, nm.pathname, pkgdir))
@@ -940,7 +1232,7 @@ def archive_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                 while archive_list:
                         pfmri, mpath, pkgdir = archive_list.pop()
                         pkg_arc.add_package(pfmri, mpath, pkgdir)
-                pkg_arc.close(progtrack=tracker)
+                pkg_arc.close(progtrack=tracker, jobs=jobs)
 
         # Dump all temporary data.
         cleanup()
@@ -968,6 +1260,7 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
         deleted_pkgs = False
         old_c_root = {}
         del_search_index = set()
+        journals = {}
 
         # Turn target into a valid URI.
         target = publisher.RepositoryURI(misc.parse_uri(target))
@@ -986,18 +1279,24 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                 abort(err=txt)
 
         def copy_catalog(src_cat_root, pub):
-                # Copy catalog files.
+                # Copy catalog files.  The new catalog is copied next to the
+                # current one first, so that the catalog is only ever
+                # switched by renaming directories within the store.
                 c_root = repo.get_pub_rstore(pub).catalog_root
                 rstore_root = repo.get_pub_rstore(pub).root
                 try:
-                        # We just use mkdtemp() to find ourselves a directory
-                        # which does not already exist. The created dir is not
+                        # We just use mkdtemp() to find ourselves directories
+                        # which do not already exist. The created dirs are not
                         # used.
+                        new_c_root = tempfile.mkdtemp(dir=rstore_root,
+                            prefix='catalog-')
+                        shutil.rmtree(new_c_root)
+                        shutil.copytree(src_cat_root, new_c_root)
                         old_c_root = tempfile.mkdtemp(dir=rstore_root,
                             prefix='catalog-')
                         shutil.rmtree(old_c_root)
-                        shutil.move(c_root, old_c_root)
-                        shutil.copytree(src_cat_root, c_root)
+                        portable.rename(c_root, old_c_root)
+                        portable.rename(new_c_root, c_root)
                 except Exception as e:
                         abort(err=_("Unable to copy catalog files: {0}").format(
                             e))
@@ -1104,6 +1403,42 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                 to_add_set = src_fmris - targ_fmris
                 to_rm = targ_fmris - src_fmris
 
+                # Packages that an earlier, interrupted clone finished
+                # retrieving are recorded in a journal in the target
+                # repository; they are skipped as long as their manifests and
+                # payloads are still present.
+                resumed = 0
+                if not dry_run:
+                        rstore = repo.get_pub_rstore(src_pub.prefix)
+                        journal = CloneJournal(os.path.join(rstore.root,
+                            "clone.journal"))
+                        done = journal.load()
+
+                        # Payloads already in the target repository, or
+                        # retrieved for an earlier package, aren't retrieved
+                        # again.
+                        known = get_known_payloads(repo, src_pub.prefix)
+                        if to_add_set:
+                                known.seed()
+
+                        completed = {}
+                        for f in list(to_add_set):
+                                hashes = done.get(str(f))
+                                if hashes is None or not os.path.exists(
+                                    rstore.manifest(f)) or \
+                                    not all(h in known for h in hashes):
+                                        continue
+                                to_add_set.remove(f)
+                                completed[str(f)] = hashes
+                        resumed = len(completed)
+                        journal.open(completed)
+                        journals[src_pub.prefix] = journal
+                        if resumed:
+                                msg(_("Resuming clone: {0:d} package(s) "
+                                    "already retrieved.").format(resumed))
+                                total_processed += resumed
+                                modified_pubs.add(src_pub.prefix)
+
                 for f in to_add_set:
                         to_add.append((f, intent))
 
@@ -1134,7 +1469,7 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
 
                 if len(to_add) == 0:
                         msg(_("No packages to add."))
-                        if deleted_pkgs:
+                        if deleted_pkgs or resumed:
                                 old_c_root[src_pub.prefix] = copy_catalog(
                                     src_cat_root, src_pub.prefix)
                         continue
@@ -1172,14 +1507,21 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                                 tracker.manifest_fetch_progress(completion=True)
                                 continue
 
-                        # Move manifest into dest repo.
-                        targ_path = os.path.join(
-                            repo.get_pub_rstore(src_pub.prefix).root, 'pkg')
+                        # Move manifest into dest repo.  The payloads it
+                        # references are recorded in the repository's payload
+                        # reference index first so that they are never
+                        # considered unreferenced while the manifest exists.
+                        # A manifest left in place by an interrupted clone was
+                        # recorded when it was moved there.
+                        rstore = repo.get_pub_rstore(src_pub.prefix)
+                        targ_path = os.path.join(rstore.root, 'pkg')
                         dp = m.fmri.get_dir_path()
                         dst_path = os.path.join(targ_path, dp)
                         src_path = os.path.join(src_basedir, dp, 'manifest')
                         dir_name = os.path.dirname(dst_path)
                         try:
+                                if not os.path.exists(dst_path):
+                                        rstore.update_refs(added=m)
                                 misc.makedirs(dir_name)
                                 shutil.move(src_path, dst_path)
                         except Exception as e:
@@ -1223,18 +1565,25 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                 tracker.download_set_goal(len(to_add), get_files, get_bytes)
 
                 # Retrieve package files.
+                journal = journals[src_pub.prefix]
+                stop_after = DebugValues.get_value("clone_stop_after")
                 for f, i in to_add:
                         tracker.download_start_pkg(f)
                         mfile = xport.multi_file_ni(src_pub, None,
                             progtrack=tracker)
                         m = get_manifest(f, xport_cfg)
-                        add_hashes_to_multi(m, mfile)
+                        add_hashes_to_multi(m, mfile, known=known,
+                            tracker=tracker)
 
                         if mfile:
                                 mfile.wait_files()
+                        journal.add(f, record_payloads(m, known))
 
                         tracker.download_end_pkg(f)
                         total_processed += 1
+                        if stop_after and total_processed >= int(stop_after):
+                                # Simulate an interrupted clone.
+                                abort(err=_("Clone interrupted."))
 
                 tracker.download_done
                 tracker.reset()
@@ -1262,6 +1611,15 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                         raise RuntimeError("cannot execute {0}: {1}".format(
                             args, e))
 
+        # The journals are no longer needed once the clone has been verified,
+        # and can't be trusted if verification failed.
+        for journal in journals.values():
+                try:
+                        journal.remove()
+                except EnvironmentError as e:
+                        error(_("Unable to remove clone journal: {0}").format(
+                            e))
+
         # Cleanup. If verification was ok, remove backup copy of old catalog.
         # If not, move old catalog back into place and remove messed up catalog.
         for pub in modified_pubs:
@@ -1305,14 +1663,117 @@ def clone_repo(pargs, target, list_newest, all_versions, all_timestamps,
                 return pkgdefs.EXIT_OOPS
         return pkgdefs.EXIT_OK
 
+def retrieve_pkg(src_pub, pfmri, mfst, keep_compressed, tracker, known=None,
+    link=False):
+        """Retrieve the content of the package 'pfmri' described by the
+        manifest 'mfst' from 'src_pub', and return the path of the directory
+        it was stored in.
+
+        'known' is an optional KnownPayloads object; payloads it contains are
+        not retrieved.  If 'link' is True, they are linked into the package's
+        directory instead, and the payloads retrieved are added to 'known'."""
+
+        global download_start
+
+        pkgdir = xport_cfg.get_pkg_dir(pfmri)
+        mfile = xport.multi_file_ni(src_pub, pkgdir, not keep_compressed,
+            tracker)
+        add_hashes_to_multi(mfst, mfile, known=known,
+            pkgdir=link and pkgdir or None, tracker=tracker)
+        if mfile:
+                download_start = True
+                mfile.wait_files()
+        if known is not None and link:
+                record_payloads(mfst, known, pkgdir)
+        return pkgdir
+
+def gen_retrieved_pkgs(src_pub, pkgs, fmappings, keep_compressed, tracker,
+    jobs=1, known=None, link=False):
+        """A generator function that retrieves the content of each package in
+        'pkgs', in order, and yields a tuple of (fmri, pkgdir) for each once
+        its content has been retrieved.  'fmappings' maps each package to its
+        manifest.  'known' is an optional dictionary of KnownPayloads objects
+        indexed by publisher prefix, used as described in retrieve_pkg() along
+        with 'link'.
+
+        If 'jobs' is greater than 1, content is retrieved by a separate thread
+        while the caller processes the packages already yielded.  The caller
+        is done with a package once it asks for the next one; until then, at
+        most 'jobs' packages, including the one being processed, are
+        retrieved or stored at once, which bounds the space used.
+
+        The thread consults 'known' without waiting for the packages yielded
+        before to be stored, so a payload they add to the destination may
+        still be retrieved again.  This only reduces how much retrieval is
+        avoided; it never causes a payload to be skipped."""
+
+        def retrieve_one(pfmri):
+                pknown = None
+                if known is not None:
+                        pknown = known.get(pfmri.publisher)
+                return retrieve_pkg(src_pub, pfmri, fmappings[pfmri],
+                    keep_compressed, tracker, known=pknown, link=link)
+
+        if jobs <= 1:
+                for pfmri in pkgs:
+                        tracker.republish_start_pkg(pfmri)
+                        yield pfmri, retrieve_one(pfmri)
+                return
+
+        results = queue.Queue()
+        slots = threading.Semaphore(jobs)
+        stop = threading.Event()
+
+        def retrieve():
+                try:
+                        for pfmri in pkgs:
+                                slots.acquire()
+                                if stop.is_set():
+                                        return
+                                results.put((pfmri, retrieve_one(pfmri),
+                                    None))
+                except:
+                        results.put((None, None, sys.exc_info()))
+
+        # The thread is a daemon so that it can't prevent an exit if the
+        # caller fails.
+        t = threading.Thread(target=retrieve, name="pkgrecv-retrieve")
+        t.daemon = True
+        t.start()
+        try:
+                for i in range(len(pkgs)):
+                        while True:
+                                # A timeout is used so that the wait can be
+                                # interrupted.
+                                try:
+                                        pfmri, pkgdir, exc_info = \
+                                            results.get(True, 1)
+                                        break
+                                except queue.Empty:
+                                        continue
+                        if exc_info:
+                                six.reraise(*exc_info)
+                        tracker.republish_start_pkg(pfmri)
+                        yield pfmri, pkgdir
+                        slots.release()
+                t.join()
+        finally:
+                stop.set()
+                slots.release()
+
 def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
     keep_compressed, raw, recursive, dry_run, verbose, dest_xport_cfg, src_uri,
-    dkey, dcert, mog_files):
+    dkey, dcert, mog_files, jobs=1):
         """Retrieve source package data and optionally republish it as each
         package is retrieved.
+
+        If 'jobs' is greater than 1, the content of later packages is
+        retrieved while earlier packages are republished.  Packages are
+        republished in the same order either way, and the catalog is only
+        updated once all of them have been.
         """
 
-        global cache_dir, download_start, xport, xport_cfg, dest_xport, targ_pub
+        global cache_dir, xport, xport_cfg, dest_xport, targ_pub
 
         any_unmatched = []
         any_matched = []
@@ -1398,6 +1859,20 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                 xport_cfg.pkg_root = basedir
                 dest_xport_cfg.pkg_root = basedir
 
+                # Payloads already in a filesystem-based destination don't
+                # need to be retrieved, and when retrieving raw package data,
+                # payloads retrieved for an earlier package are linked instead.
+                known = {}
+                dest_repo = None
+                if republish and target.startswith("file://"):
+                        try:
+                                dest_repo = sr.Repository(read_only=True,
+                                    root=publisher.RepositoryURI(
+                                    target).get_pathname())
+                        except sr.RepositoryError:
+                                # Problems are reported by publication.
+                                pass
+
                 matches = get_matches(src_pub, tracker, xport, pargs,
                     any_unmatched, any_matched, all_versions, all_timestamps,
                     recursive)
@@ -1469,6 +1944,10 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                                                     ssl_key=dkey,
                                                     ssl_cert=dcert)
                                         new_targ_pubs[nf.publisher] = newpub
+                                        if dest_repo:
+                                                known[nf.publisher] = \
+                                                    get_known_payloads(
+                                                    dest_repo, nf.publisher)
                                         newcat = fetch_catalog(newpub, tracker,
                                             dest_xport, True)
                                         new_targ_cats[nf.publisher] = newcat
@@ -1522,6 +2001,8 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                         # future use.
                         fmappings[nf] = nm
                         pkgs_to_get.append(nf)
+                        if not republish and nf.publisher not in known:
+                                known[nf.publisher] = KnownPayloads()
 
                         get_bytes += getb
                         get_files += getf
@@ -1568,17 +2049,13 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
 
                 processed = 0
                 pkgs_to_get = sorted(pkgs_to_get)
-                for nf in pkgs_to_get:
-                        tracker.republish_start_pkg(nf)
+                stop_after = DebugValues.get_value("recv_stop_after")
+                for i, (nf, pkgdir) in enumerate(gen_retrieved_pkgs(src_pub,
+                    pkgs_to_get, fmappings, keep_compressed, tracker,
+                    jobs=jobs, known=known, link=not republish)):
                         # Processing republish.
                         nm = fmappings[nf]
-                        pkgdir = xport_cfg.get_pkg_dir(nf)
-                        mfile = xport.multi_file_ni(src_pub, pkgdir,
-                            not keep_compressed, tracker)
-                        add_hashes_to_multi(nm, mfile)
-                        if mfile:
-                                download_start = True
-                                mfile.wait_files()
+                        pknown = known.get(nf.publisher)
 
                         if not republish:
                                 # Nothing more to do for this package.
@@ -1622,7 +2099,18 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                                                 # added to the manifest.
                                                 continue
 
-                                        if a.has_payload:
+                                        spath = None
+                                        if a.has_payload and pknown and \
+                                            a.name != "signature":
+                                                # Use the destination's copy
+                                                # of the payload if it has
+                                                # one.
+                                                spath = pknown.lookup(
+                                                    payload_hash(a))
+                                        if spath:
+                                                a.data = lambda: \
+                                                    open_stored_payload(spath)
+                                        elif a.has_payload:
                                                 fname = os.path.join(pkgdir,
                                                     a.hash)
 
@@ -1649,7 +2137,7 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                         try:
                                 shutil.rmtree(dest_xport_cfg.incoming_root)
                                 shutil.rmtree(pkgdir)
-                                if cache_dir in tmpdirs:
+                                if cache_dir in tmpdirs and jobs == 1:
                                         # If cache_dir is listed in tmpdirs,
                                         # then it's safe to dump cache contents.
                                         # Otherwise, it's a user cache directory
@@ -1658,10 +2146,25 @@ def transfer_pkgs(pargs, target, list_newest, all_versions, all_timestamps,
                                         misc.makedirs(cache_dir)
                         except EnvironmentError as e:
                                 raise apx._convert_error(e)
+                        if cache_dir in tmpdirs and jobs > 1:
+                                # Later packages are being retrieved into the
+                                # cache, so only this package's payloads that
+                                # none of them use are dumped.  Those are the
+                                # only packages the retrieval can have reached
+                                # until this one is finished.
+                                pending = set()
+                                for pf in pkgs_to_get[i + 1:i + jobs]:
+                                        pending.update(get_payload_hashes(
+                                            fmappings[pf]))
+                                remove_cached_payloads(
+                                    get_payload_hashes(nm) - pending)
                         misc.makedirs(dest_xport_cfg.incoming_root)
 
                         processed += 1
                         tracker.republish_end_pkg(nf)
+                        if stop_after and processed >= int(stop_after):
+                                # Simulate an interrupted transfer.
+                                abort(err=_("Transfer interrupted."))
 
                 tracker.republish_done()
                 tracker.reset()
@@ -1695,7 +2198,6 @@ if __name__ == "__main__":
 
         # Make all warnings be errors.
         warnings.simplefilter('error')
-        import six
         if six.PY3:
                 # disable ResourceWarning: unclosed file
                 warnings.filterwarnings("ignore", category=ResourceWarning)
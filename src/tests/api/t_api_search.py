@@ -1416,6 +1416,62 @@ class TestApiSearchBasicsP(TestApiSearchBasics):
 
                 self._run_degraded_local_tests(api_obj)
 
+        def test_035_binary_main_dict(self):
+                """Check that search gives the same results using the binary
+                main dictionary and, when it's absent, the text one."""
+
+                durl = self.dc.get_depot_url()
+                api_obj = self.image_create(durl)
+
+                self._api_install(api_obj, ["example_pkg"])
+
+                index_dir = os.path.join(self.img_path(), "var", "pkg",
+                    "cache", "index")
+                bin_path = os.path.join(index_dir, ss.BINARY_MAIN_FILE)
+                self.assertTrue(os.path.exists(bin_path))
+                self.assertTrue(os.path.exists(os.path.join(
+                    self._get_repo_index_dir(), ss.BINARY_MAIN_FILE)))
+                self._run_full_local_tests(api_obj)
+                self._run_full_remote_tests(api_obj)
+
+                portable.remove(bin_path)
+                api_obj.reset()
+                self._run_full_local_tests(api_obj)
+
+        def test_036_token_aux(self):
+                """Check that case insensitive and wildcard searches give the
+                same results with and without the auxiliary token indexes."""
+
+                durl = self.dc.get_depot_url()
+                api_obj = self.image_create(durl)
+
+                self._api_install(api_obj, ["example_pkg@1.0"])
+
+                index_dir = os.path.join(self.img_path(), "var", "pkg",
+                    "cache", "index")
+                aux_path = os.path.join(index_dir, ss.TOKEN_AUX_FILE)
+                self.assertTrue(os.path.exists(aux_path))
+
+                for aux in (True, False):
+                        self._search_op(api_obj, False, "fooo",
+                            self.res_local_foo)
+                        self._search_op(api_obj, False, "BaR",
+                            self.res_local_foo)
+                        self._search_op(api_obj, False, "fOo*",
+                            self.res_local_foo)
+                        self._search_op(api_obj, False, "*OoO",
+                            self.res_local_foo)
+                        self._search_op(api_obj, False, "FO*", set(), True)
+                        self._search_op(api_obj, False, "*OOO",
+                            self.res_local_foo, True)
+                        self._search_op(api_obj, False, "nosuchtoken", set())
+                        self._search_op(api_obj, False, "*nosuch*", set())
+                        self._search_op(api_obj, False, "example_pkg",
+                            self.res_local_pkg)
+                        if aux:
+                                portable.remove(aux_path)
+                                api_obj.reset()
+
         def test_040_repeated_install_uninstall(self):
                 """Install and uninstall a package. Checking search both
                 after each change to the image."""
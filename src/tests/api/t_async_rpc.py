@@ -112,12 +112,13 @@ class TestAsyncRPC(pkg5unittest.Pkg5TestCase):
                     "async_thread_error",
                     ac.result)
 
-        def __server(self, client_pipefd, server_pipefd, http_enc=True):
+        def __server(self, client_pipefd, server_pipefd, http_enc=True,
+            framing=False):
                 """Setup RPC Server."""
 
                 os.close(client_pipefd)
                 server = pkg.pipeutils.PipedRPCServer(server_pipefd,
-                    http_enc=http_enc)
+                    http_enc=http_enc, framing=framing)
                 server.register_introspection_functions()
                 server.register_function(self.__nop, "nop")
                 server.register_function(self.__add, "add")
@@ -125,7 +126,8 @@ class TestAsyncRPC(pkg5unittest.Pkg5TestCase):
                 server.register_function(self.__sleep, "sleep")
                 server.serve_forever()
 
-        def __server_setup(self, http_enc=True, use_proc=True):
+        def __server_setup(self, http_enc=True, use_proc=True,
+            client_framing=False, server_framing=False):
                 """Setup an rpc server."""
 
                 # create a pipe to communicate between the client and server
@@ -140,14 +142,15 @@ class TestAsyncRPC(pkg5unittest.Pkg5TestCase):
                 server_proc = alloc_server(
                     target=self.__server,
                     args=(client_pipefd, server_pipefd),
-                    kwargs={ "http_enc": http_enc })
+                    kwargs={ "http_enc": http_enc,
+                        "framing": server_framing })
                 server_proc.daemon = True
                 server_proc.start()
                 os.close(server_pipefd)
 
                 # Setup ourselves as the client
                 client_rpc = pkg.pipeutils.PipedServerProxy(client_pipefd,
-                    http_enc=http_enc)
+                    http_enc=http_enc, framing=client_framing)
 
                 return (server_proc, client_rpc)
 
@@ -253,6 +256,25 @@ class TestAsyncRPC(pkg5unittest.Pkg5TestCase):
                 self.__test_rpc_basics(use_proc=False)
                 self.__test_rpc_basics(http_enc=False, use_proc=False)
 
+        def test_rpc_framing(self):
+                # framing is only used if both ends support it, so make
+                # multiple calls to the same server with every combination.
+                for client_framing in (False, True):
+                        for server_framing in (False, True):
+                                server_proc, client_rpc = self.__server_setup(
+                                    client_framing=client_framing,
+                                    server_framing=server_framing)
+                                for i in range(3):
+                                        self.assertEqual(
+                                            client_rpc.add(x=i, y=2), i + 2)
+                                self.assertEqual(client_rpc.nop(), None)
+                                self.assertRaisesRegexp(
+                                    pkg.pipeutils.ProtocolError1,
+                                    "Invalid parameters.",
+                                    client_rpc.add, x=1)
+                                del client_rpc
+                                server_proc.join()
+
         def test_rpc_interruptions(self):
                 self.__test_rpc_interruptions(http_enc=True)
                 self.__test_rpc_interruptions(http_enc=False)
@@ -1021,6 +1021,68 @@ class TestP5P(pkg5unittest.SingleDepotTestCase):
                 arc.close()
                 os.unlink(arc_path)
 
+        def test_07_close_jobs(self):
+                """Verify that archives written using multiple jobs have the
+                same content and layout as those written serially."""
+
+                repo = self.get_repo(self.dc.get_repodir())
+
+                contents = []
+                for jobs in (1, 4):
+                        arc_path = os.path.join(self.test_root,
+                            "jobs.{0:d}.p5p".format(jobs))
+                        arc = pkg.p5p.Archive(arc_path, mode="w")
+                        for pfmri in (self.foo, self.signed, self.quux):
+                                arc.add_repo_package(pfmri, repo)
+                        arc.close(jobs=jobs)
+
+                        arc = ptf.PkgTarFile(name=arc_path, mode="r")
+                        content = []
+                        for m in arc.getmembers():
+                                data = None
+                                if m.isreg():
+                                        data = arc.extractfile(m).read()
+                                content.append((m.name, m.offset, m.size,
+                                    m.type, data))
+                        arc.close()
+                        contents.append(content)
+                        os.unlink(arc_path)
+
+                self.assertEqual(contents[0], contents[1])
+
+        def test_08_hash_lookup(self):
+                """Verify that package files can be found by hash alone,
+                including using an index shared between archive objects."""
+
+                repo = self.get_repo(self.dc.get_repodir())
+                arc_path = os.path.join(self.test_root, "hash_lookup.p5p")
+                arc = pkg.p5p.Archive(arc_path, mode="w")
+                arc.add_repo_package(self.foo, repo)
+                arc.add_repo_package(self.quux, repo)
+                arc.close()
+
+                arc = pkg.p5p.Archive(arc_path, mode="r")
+                sarc = pkg.p5p.Archive(arc_path, mode="r",
+                    archive_index=arc.get_index())
+                for pfmri in (self.foo, self.quux):
+                        m = arc.get_package_manifest(pfmri)
+                        for a in m.gen_actions():
+                                if not a.has_payload:
+                                        continue
+                                expected = arc.get_package_file(a.hash,
+                                    pub=pfmri.publisher).read()
+                                for obj in (arc, sarc):
+                                        fobj = obj.get_package_file(a.hash)
+                                        self.assertEqual(fobj.read(),
+                                            expected)
+                                        fobj.close()
+
+                self.assertRaises(pkg.p5p.UnknownArchiveFiles,
+                    arc.get_package_file, "0" * 40)
+                sarc.close()
+                arc.close()
+                os.unlink(arc_path)
+
 if __name__ == "__main__":
         unittest.main()
 
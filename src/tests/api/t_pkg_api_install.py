@@ -30,6 +30,7 @@ if __name__ == "__main__":
 import pkg5unittest
 
 import os
+import simplejson as json
 import time
 import sys
 import unittest
@@ -43,6 +44,7 @@ import pkg.portable as portable
 import stat
 import shutil
 
+from pkg.client import global_settings
 from pkg.client.debugvalues import DebugValues
 from six.moves.urllib.parse import urlunparse
 from six.moves.urllib.request import pathname2url
@@ -303,6 +305,114 @@ class TestPkgApiInstall(pkg5unittest.SingleDepotTestCase):
                 self.__do_uninstall(api_obj, ["foo"])
                 self.pkg("verify")
 
+        def test_solver_input_cache(self):
+                """Verify that the catalog data used by the solver is cached
+                in the image and reused while the catalog is unchanged."""
+
+                self.pkgsend_bulk(self.rurl, (self.foo10, self.foo11))
+                api_obj = self.image_create(self.rurl)
+                cache_file = os.path.join(api_obj.img.solver_cache_dir,
+                    "inputs.v3")
+
+                for pd in api_obj.gen_plan_install(["foo"], noexecute=True):
+                        continue
+                self.assertTrue(os.path.exists(cache_file))
+                self.assertTrue("Hits: 0 " in str(api_obj.img.imageplan))
+
+                # The data derived from the catalog is cached rather than the
+                # actions it was derived from.
+                with open(cache_file) as f:
+                        data = json.load(f)
+                self.assertTrue(any("foo@1.1" in k for k in data["states"]))
+                self.assertTrue("actions" not in data)
+
+                api_obj.reset()
+                for pd in api_obj.gen_plan_install(["foo"], noexecute=True):
+                        continue
+                self.assertTrue("Misses: 0 " in str(api_obj.img.imageplan))
+                api_obj.reset()
+
+                # Once the catalog changes, the cached data is discarded.
+                self.pkgsend_bulk(self.rurl, self.bar10)
+                api_obj.refresh(immediate=True)
+                for pd in api_obj.gen_plan_install(["foo"], noexecute=True):
+                        continue
+                self.assertTrue("Hits: 0 " in str(api_obj.img.imageplan))
+
+        def test_solver_input_cache_alt_sources(self):
+                """Verify that data cached by the solver for the image's known
+                catalog is not used once packages from alternate sources have
+                been merged into it."""
+
+                self.pkgsend_bulk(self.rurl, ("""
+                    open lib@0.5,5.11-0
+                    close""", """
+                    open lib@1.0,5.11-0
+                    close""", """
+                    open app@1.0,5.11-0
+                    add depend type=require fmri=pkg:/lib@1.0
+                    close"""))
+                self.image_create(self.rurl)
+                self.pkg("install -nv app")
+                self.assertTrue("1.0,5.11-0" in self.output)
+
+                alt_repo_dir = os.path.join(self.test_root, "alt_repo")
+                alt_repo_uri = urlunparse(("file", "",
+                    pathname2url(alt_repo_dir), "", "", ""))
+                self.create_repo(alt_repo_dir,
+                    properties={ "publisher": { "prefix": "test" } })
+                self.pkgsend_bulk(alt_repo_uri, ("""
+                    open lib@0.7,5.11-0
+                    close""", """
+                    open lib@2.0,5.11-0
+                    close"""))
+
+                # The merged packages change the versions of lib in the known
+                # catalog without changing its timestamps.
+                self.pkg("install -nv -g {0} app".format(alt_repo_uri))
+                self.assertTrue("2.0,5.11-0" in self.output)
+                self.assertTrue("0.7,5.11-0" not in self.output)
+
+        def test_solver_jobs(self):
+                """Verify that the solver plans the same update regardless of
+                the number of processes it is allowed to use once it evaluates
+                candidate solutions concurrently, and that the serial solver
+                plans a valid update as well."""
+
+                self.pkgsend_bulk(self.rurl, (self.foo10, self.foo11,
+                    self.foo12, self.bar10, self.bar11))
+                api_obj = self.image_create(self.rurl)
+                self.__do_install(api_obj, ["foo@1.0", "bar@1.0"])
+
+                def plan_update():
+                        for pd in api_obj.gen_plan_update(noexecute=True):
+                                continue
+                        changes = [
+                            (str(src.fmri), str(dest.fmri))
+                            for src, dest in api_obj.describe().get_changes()
+                        ]
+                        api_obj.reset()
+                        return changes
+
+                jobs = global_settings.PKG_SOLVER_JOBS
+                try:
+                        global_settings.PKG_SOLVER_JOBS = 1
+                        serial = plan_update()
+                        global_settings.PKG_SOLVER_JOBS = 2
+                        parallel = plan_update()
+                        global_settings.PKG_SOLVER_JOBS = 4
+                        self.assertEqual(plan_update(), parallel)
+                finally:
+                        global_settings.PKG_SOLVER_JOBS = jobs
+
+                # The serial solver may settle on a different, but equally
+                # valid, plan.
+                for changes in (serial, parallel):
+                        self.assertTrue(any(
+                            "bar@1.1" in dest for src, dest in changes))
+                        self.assertTrue(any(
+                            "foo@1.2" in dest for src, dest in changes))
+
         def test_basics_2(self):
                 """ Send package foo@1.1, containing a directory and a file,
                     install, search, and uninstall. """
@@ -33,6 +33,7 @@ import unittest
 import pkg.version as version
 import datetime
 import os
+import pickle
 import sys
 
 class TestVersion(pkg5unittest.Pkg5TestCase):
@@ -120,6 +121,14 @@ class TestVersion(pkg5unittest.Pkg5TestCase):
                 self.assertTrue(str(self.v17) == "0.2,5.11-1:20071029T131519Z")
                 self.assertTrue(str(self.v18) == "5,5")
 
+        def testpickle(self):
+                """Verify that versions can be passed to worker processes."""
+
+                for v in (self.v1, self.v12, self.v18):
+                        p = pickle.loads(pickle.dumps(v, 2))
+                        self.assertEqual(p, v)
+                        self.assertTrue(p.release is v.release)
+
         def testbogusversion1(self):
                 """ Test empty elements """
                 self.assertRaises(version.IllegalVersion,
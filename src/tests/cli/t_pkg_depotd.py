@@ -51,6 +51,7 @@ import pkg.misc as misc
 import pkg.server.repository as sr
 import pkg.p5i as p5i
 import re
+import simplejson as json
 import subprocess
 
 class TestPkgDepot(pkg5unittest.SingleDepotTestCase):
@@ -246,6 +247,38 @@ class TestPkgDepot(pkg5unittest.SingleDepotTestCase):
                     quote(plist[0])))
                 urlopen(repourl)
 
+        def test_search_cache(self):
+                """Verify that repeated searches are answered from the search
+                cache and that cached results are discarded when the search
+                index changes."""
+
+                durl = self.dc.get_depot_url()
+                self.pkgsend_bulk(durl, self.quux10, refresh_index=True)
+
+                def get_stats():
+                        status = json.loads(misc.force_str(urlopen(
+                            "{0}/status/0/".format(durl)).read()))
+                        return status["repository"]["publishers"]["test"][
+                            "search-cache"]
+
+                def search(token):
+                        return misc.force_str(urlopen("{0}/search/0/{1}".format(
+                            durl, token)).read())
+
+                start = get_stats()
+                res = search("cat")
+                self.assertTrue("quux" in res)
+                self.assertEqual(search("cat"), res)
+                stats = get_stats()
+                self.assertEqual(stats["misses"], start["misses"] + 1)
+                self.assertEqual(stats["hits"], start["hits"] + 1)
+                self.assertTrue(stats["entries"] > 0)
+
+                # Indexing a new package must not return stale results.
+                self.pkgsend_bulk(durl, self.info20, refresh_index=True)
+                res = search("cat")
+                self.assertTrue("quux" in res and "info" in res)
+
         def test_info(self):
                 """Testing information showed in /info/0."""
 
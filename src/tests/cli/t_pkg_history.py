@@ -590,6 +590,55 @@ class TestPkgHistory(pkg5unittest.ManyDepotTestCase):
                 env = { "LC_ALL": unicode_list[0] }
                 self.pkg("history", env_arg=env)
 
+        def test_15_history_index(self):
+                """Verify that the history index is kept up to date and is used
+                for short listings, and that operations missing from it are
+                still listed."""
+
+                hist = self.get_img_api_obj().img.history
+                self.pkg("history -H")
+                expected = self.output
+
+                # New operations are appended to the index.  If it doesn't
+                # exist, it is created with records for the operations that
+                # are already in the history directory.
+                if os.path.exists(hist.index_path):
+                        os.unlink(hist.index_path)
+                self.pkg("install nosuchpackage", exit=1)
+                latest = sorted(os.listdir(hist.path))[-1]
+                recs = hist.load_index()
+                self.assertEqual(sorted(recs), sorted(os.listdir(hist.path)))
+                self.assertEqual(recs[latest][3], "install")
+
+                # The records created for existing operations match their
+                # history files, and operations missing from the index are
+                # loaded from them, so the listing is unchanged.
+                self.pkg("history -H")
+                self.assertEqual(self.output.splitlines()[:-1],
+                    expected.splitlines())
+                self.pkg("history -H -o start,operation,client,outcome,"
+                    "be,time,finish,reason")
+                summary = self.output
+                os.unlink(hist.index_path)
+                self.pkg("history -H -o start,operation,client,outcome,"
+                    "be,time,finish,reason")
+                self.assertEqualDiff(summary, self.output)
+
+                # Short listings use the index instead of the history files,
+                # while other listings still load them.
+                self.pkg("install nosuchpackage", exit=1)
+                with open(hist.index_path, "r") as f:
+                        index = f.read()
+                with open(hist.index_path, "w") as f:
+                        f.write(index.replace("install", "indexed"))
+                self.pkg("history -H -n 1")
+                self.assertTrue("indexed" in self.output)
+                self.pkg("history -l -n 1")
+                self.assertTrue("install" in self.output)
+                self.assertTrue("indexed" not in self.output)
+                self.pkg("history -H -n 1 -o operation,command")
+                self.assertTrue("indexed" not in self.output)
+
 if __name__ == "__main__":
         unittest.main()
 
@@ -1127,6 +1127,43 @@ class TestPkgLinked1(TestPkgLinked):
                 self._pkg_child(0, [1, 2, 3], "audit-linked", rv=rv)
                 self._pkg_child_all(0, "audit-linked", rv=rv)
 
+        def test_audit_digest(self):
+                """Verify that updated children save a digest of their linked
+                image state, and that audits which consult it still notice
+                when a child diverges from its parent."""
+
+                self._imgs_create(2)
+
+                # install the same synced package into parent and child
+                self._pkg([0], "install -v {0}".format(self.p_sync1_name[1]))
+                self._attach_child(0, [1])
+                self._pkg([1], "install -v {0}".format(self.p_sync1_name[1]))
+
+                digest = "{0}/var/pkg/linked/linked_digest".format(
+                    self.i_path[1])
+                self.file_exists(digest)
+                self._pkg([1], "audit-linked")
+                self._pkg_child_all(0, "audit-linked")
+                self._pkg([0], "sync-linked -a", rv=EXIT_NOP)
+
+                # update the parent image while ignoring the child (there by
+                # putting it out of sync)
+                self._pkg([0], "install -I -v {0}".format(self.p_sync1_name[0]))
+                self._pkg([1], "audit-linked", rv=EXIT_DIVERGED)
+                self._pkg_child_all(0, "audit-linked", rv=EXIT_DIVERGED)
+
+                # an unreadable digest is ignored
+                self._ccmd("cp /dev/null {0}".format(digest))
+                self._pkg([1], "audit-linked", rv=EXIT_DIVERGED)
+                self._pkg_child_all(0, "audit-linked", rv=EXIT_DIVERGED)
+
+                # syncing the child saves a new digest
+                self._pkg([0], "sync-linked -a")
+                self.file_exists(digest)
+                self._pkg([1], "audit-linked")
+                self._pkg_child_all(0, "audit-linked")
+                self._pkg([0], "sync-linked -a", rv=EXIT_NOP)
+
 class TestPkgLinked2(TestPkgLinked):
         """Class used solely to split up the test suite for parallelization."""
 
@@ -2496,6 +2533,68 @@ class TestPkgLinkedRecurse(TestPkgLinked):
                 self._pkg([0, 1], "list network@1.0,5.11-0.2")
                 self._pkg([2], "list network", rv=EXIT_OOPS)
 
+        def test_recursive_stages_reuse_child(self):
+                """Verify that the plan, prepare, and execute stages of a
+                recursive operation are performed by the same "pkg remote"
+                process for each child."""
+
+                # create parent (0), push child (1)
+                self._imgs_create(2)
+                self._attach_child(0, [1])
+
+                self._pkg([0], "install -r {0}".format(self.foo1_list[0]),
+                    env_arg={"PKG_PKGREMOTE_DEBUG": "1"})
+                self.assertTrue("reusing RPC server" in
+                    self.output + self.errout)
+                self._pkg([1], "list {0}".format(self.foo1_list[0]))
+
+        def test_recursive_shared_catalogs(self):
+                """Verify that children using the same origins as their
+                parent refresh using the catalogs already retrieved by the
+                parent rather than contacting the origins again."""
+
+                # create parent (0), push child (1)
+                self._imgs_create(2)
+                self._attach_child(0, [1])
+                self._pkg([0], "install -v {0}".format(self.p_foo1_name[0]))
+
+                # publish a new package and only refresh the parent
+                self.pkgsend_bulk(self.rurl1, """
+                    open shared@1.0,5.11-0
+                    close """)
+                self._pkg([0], "refresh")
+                self._pkg([1], "list -af shared", rv=EXIT_OOPS)
+
+                # put the child out of sync with the parent so that syncing
+                # it recurses into the child and refreshes its catalogs.
+                self._pkg([0], "uninstall -I {0}".format(self.p_foo1_name[0]))
+
+                # make the origin unavailable; the child can only refresh
+                # using the parent's catalogs.
+                repodir = self.dcs[1].get_repodir()
+                shutil.move(repodir, repodir + ".moved")
+                try:
+                        self.pkg("-R {0} sync-linked -a -n".format(
+                            self.i_path[0]), exit=[EXIT_OK, EXIT_NOP])
+                finally:
+                        shutil.move(repodir + ".moved", repodir)
+                self._pkg([1], "list -af shared")
+
+                # rebuild the origin's catalog, publish to it, and only
+                # refresh the child; its catalog is now newer than the
+                # parent's, so it must not be replaced by the parent's copy.
+                self.dcs[1].stop()
+                self.pkgrepo("rebuild -s {0}".format(repodir))
+                self.dcs[1].start()
+                self.pkgsend_bulk(self.rurl1, """
+                    open newer@1.0,5.11-0
+                    close """)
+                self._pkg([1], "refresh")
+                self._pkg([0], "list -af newer", rv=EXIT_OOPS)
+                self.pkg("-R {0} sync-linked -a -n".format(self.i_path[0]),
+                    exit=[EXIT_OK, EXIT_NOP])
+                self._pkg([1], "list -af newer")
+
 
 class TestPkgLinkedIncorpDowngrade(TestPkgLinked):
         """Test that incorporated pkgs can be downgraded if incorporation is
@@ -631,6 +631,36 @@ adm:NP:6445::::::
                 self.pkg("search -s {0} '*'".format(durl))
                 self.pkg("search -l '*'", exit=1)
 
+        def test_remote_cache(self):
+                """Verify that remote search results are only cached when
+                requested and that refreshing the catalog invalidates them."""
+
+                durl = self.dc.get_depot_url()
+                self.pkgsend_bulk(durl, self.example_pkg10)
+                self.image_create(durl)
+                cache_dir = self.get_img_api_obj().img.search_cache_dir
+
+                self.pkg("search -H -p -o pkg.name '*'")
+                self.assertTrue(not os.path.exists(cache_dir))
+                self.pkg("search --cache -H -p -o pkg.name '*'")
+                self.assertEqualDiff("example_pkg\n", self.output)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+                # Until the catalog is refreshed, cached results are returned
+                # for the same query.
+                self.pkgsend_bulk(durl, self.fat_pkg10)
+                self.pkg("search --cache -H -p -o pkg.name '*'")
+                self.assertEqualDiff("example_pkg\n", self.output)
+                self.pkg("search -H -p -o pkg.name '*'")
+                self.assertEqual(sorted(self.output.split()),
+                    ["example_pkg", "fat"])
+
+                self.pkg("refresh")
+                self.pkg("search --cache -H -p -o pkg.name '*'")
+                self.assertEqual(sorted(self.output.split()),
+                    ["example_pkg", "fat"])
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
         def test_local_0(self):
                 """Install one package, and run the search suite."""
                 # Need to retain that -l works as expected
@@ -29,6 +29,7 @@ if __name__ == "__main__":
         testutils.setup_environment("../../../proto")
 import pkg5unittest
 
+import hashlib
 import os
 import simplejson as json
 import six
@@ -1415,6 +1416,150 @@ Estimated transfer size: 528.00 B
                 self.pkgrepo("verify -s {0} --disable dependency"
                     .format(self.dpath6))
 
+        def test_15_jobs(self):
+                """Verify that retrieving content while republishing produces
+                the same repository as republishing serially."""
+
+                self.pkgrecv(self.durl1, "-j 0 -d {0} '*'".format(
+                    self.durl2), exit=2)
+                self.pkgrecv(self.durl1, "-j 2 --clone -d {0}".format(
+                    self.dpath2), exit=2)
+                self.pkgrecv(self.durl1, "-j 2 --raw -d {0} '*'".format(
+                    self.tempdir), exit=2)
+
+                listings = []
+                for jobs in (1, 3):
+                        npath = tempfile.mkdtemp(dir=self.test_root)
+                        self.create_repo(npath, properties={ "publisher": {
+                            "prefix": "test1" } })
+                        self.pkgrecv(self.durl1, "-j {0:d} -d {1} '*'".format(
+                            jobs, npath))
+                        self.pkgrepo("verify -s {0} --disable dependency"
+                            .format(npath))
+                        self.pkgrepo("-s {0} list -F tsv".format(npath))
+                        listings.append(self.output)
+                self.assertEqualDiff(listings[0], listings[1])
+
+                # The download cache only keeps the content of the packages
+                # in progress.  Interrupt the transfer once bronze@1.0 has
+                # been republished; the payloads it doesn't share with
+                # bronze@2.0 have been dropped from the cache by then, while
+                # those it does are kept.
+                npath = tempfile.mkdtemp(dir=self.test_root)
+                self.create_repo(npath, properties={ "publisher": {
+                    "prefix": "test1" } })
+                self.pkgrecv(self.durl1, "-j 2 -D recv_stop_after=1 -d {0} "
+                    "bronze@1.0 bronze@2.0".format(npath), exit=1)
+                cache = self.errout.split("following directory:")[1].split()[0]
+                cached = set()
+                for dirpath, dirnames, filenames in os.walk(cache):
+                        cached.update(filenames)
+                shutil.rmtree(cache)
+                for fname, kept in (("tmp/bronzeA1", False),
+                    ("tmp/copyright2", False), ("tmp/sh", True)):
+                        with open(os.path.join(self.test_root, fname),
+                            "rb") as f:
+                                h = hashlib.sha1(f.read()).hexdigest()
+                        self.assertEqual(h in cached, kept)
+
+        def test_16_known_payloads(self):
+                """Verify that payloads already in the destination, or already
+                retrieved for another package, are reused correctly."""
+
+                bronze10 = fmri.PkgFmri(self.published[2], None)
+                bronze20 = fmri.PkgFmri(self.published[3], None)
+
+                # Republishing a package that shares payloads with one already
+                # in the destination repository must produce a valid package.
+                npath = tempfile.mkdtemp(dir=self.test_root)
+                self.create_repo(npath, properties={ "publisher": {
+                    "prefix": "test1" } })
+                self.pkgrecv(self.durl1, "-d {0} {1}".format(npath, bronze10))
+                self.pkgrecv(self.durl1, "-d {0} {1}".format(npath, bronze20))
+                self.pkgrepo("verify -s {0} --disable dependency".format(npath))
+                self.pkgrepo("-s {0} list -H bronze".format(npath))
+                self.assertEqual(len(self.output.splitlines()), 2)
+
+                # When retrieving raw package data, shared payloads are only
+                # retrieved once but are present for every package.
+                self.pkgrecv(self.durl1, "--raw -d {0} {1} {2}".format(
+                    self.tempdir, bronze10, bronze20))
+                inodes = {}
+                for f in (bronze10, bronze20):
+                        basedir = os.path.join(self.tempdir, f.get_dir_path())
+                        m = manifest.Manifest()
+                        m.set_content(pathname=os.path.join(basedir,
+                            "manifest"))
+                        for a in m.gen_actions_by_types(("file", "license")):
+                                st = os.stat(os.path.join(basedir, a.hash))
+                                inodes.setdefault(a.hash, []).append(
+                                    st.st_ino)
+                shared = [i for i in inodes.values() if len(i) > 1]
+                self.assertTrue(shared)
+                for i in shared:
+                        self.assertEqual(len(set(i)), 1)
+
+        def test_17_clone_resume(self):
+                """Verify that an interrupted clone resumes with the packages
+                it had not yet retrieved."""
+
+                journal = os.path.join(self.dpath2, "publisher", "test1",
+                    "clone.journal")
+
+                # Interrupt the clone after two packages; the catalog of the
+                # target repository must be unchanged.
+                self.pkgrecv(self.durl1, "--clone -D clone_stop_after=2 "
+                    "-d {0}".format(self.dpath2), exit=1)
+                self.assertTrue(os.path.exists(journal))
+                self.pkgrepo("-s {0} list -H".format(self.dpath2))
+                self.assertEqualDiff("", self.output)
+
+                self.pkgrecv(self.durl1, "--clone -d {0}".format(self.dpath2))
+                self.assertTrue("Resuming clone: 2 package(s)" in self.output)
+                self.assertFalse(os.path.exists(journal))
+
+                ret = subprocess.call(["/usr/bin/gdiff", "-Naur", "-x",
+                    "index", "-x", "trans", self.dpath1, self.dpath2])
+                self.assertTrue(ret==0)
+
+        def test_18_clone_gc(self):
+                """Verify that packages retrieved by clone are recorded in the
+                target repository's payload reference index, so that gc and
+                package removal keep the files they still use."""
+
+                # Clone in two runs so that packages retrieved by both a
+                # fresh and a resumed clone are covered.
+                self.pkgrecv(self.durl1, "--clone -D clone_stop_after=2 "
+                    "-d {0}".format(self.dpath2), exit=1)
+                self.pkgrecv(self.durl1, "--clone -d {0}".format(self.dpath2))
+
+                # Nothing in the clone is unreferenced.
+                self.pkgrepo("-s {0} gc".format(self.dpath2))
+                self.pkgrepo("-s {0} verify".format(self.dpath2))
+                ret = subprocess.call(["/usr/bin/gdiff", "-Naur", "-x",
+                    "index", "-x", "trans", "-x", "verify.dat", self.dpath1,
+                    self.dpath2])
+                self.assertTrue(ret==0)
+
+                # Files that bronze@1.0 shares with bronze@2.0 are kept when
+                # a clone removes it.
+                self.pkgrepo("-s {0} remove bronze@1.0".format(self.dpath1))
+                self.pkgrecv(self.durl1, "--clone -d {0}".format(self.dpath2))
+                self.pkgrepo("-s {0} gc".format(self.dpath2))
+                self.pkgrepo("-s {0} verify".format(self.dpath2))
+                ret = subprocess.call(["/usr/bin/gdiff", "-Naur", "-x",
+                    "index", "-x", "trans", "-x", "verify.dat", self.dpath1,
+                    self.dpath2])
+                self.assertTrue(ret==0)
+
+                # Once the last package using them is removed, they're gone.
+                self.pkgrepo("-s {0} remove bronze".format(self.dpath2))
+                self.pkgrepo("-s {0} gc".format(self.dpath2))
+                self.pkgrepo("-s {0} verify".format(self.dpath2))
+                for dirpath, dirnames, filenames in os.walk(os.path.join(
+                    self.dpath2, "publisher", "test1", "file")):
+                        self.assertEqual(filenames, [])
+
 class TestPkgrecvHTTPS(pkg5unittest.HTTPSTestClass):
 
         example_pkg10 = """
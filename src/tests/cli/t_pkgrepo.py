@@ -41,6 +41,7 @@ import pkg.misc as misc
 import pkg.server.repository as sr
 import pkg.client.api_errors as apx
 import pkg.p5p
+import pkg.search_storage as ss
 import shutil
 import simplejson as json
 import six
@@ -1108,6 +1109,40 @@ test1\t1\tonline\t2011-08-04T20:34:58Z
                 self.assertEqualDiff([pfmri],
                     [str(f) for f in repo.get_catalog("test").fmris()])
 
+        def test_04a_rebuild_parallel(self):
+                """Verify that pkgrepo rebuild produces the same catalog
+                whether manifests are loaded serially or in parallel."""
+
+                repo_path = self.dc.get_repodir()
+                self.pkgrepo("rebuild -j 0 -s {0}".format(repo_path), exit=2)
+                self.pkgrepo("rebuild -j 2 -s http://localhost:1", exit=2)
+
+                plist = self.pkgsend_bulk(repo_path, (self.amber10,
+                    self.amber20, self.tree10, self.truck10, self.zoo10))
+
+                # Add a corrupt manifest, which should be skipped either way.
+                repo = self.get_repo(repo_path, read_only=True)
+                mdir = os.path.dirname(repo.manifest(fmri.PkgFmri(plist[0])))
+                with open(os.path.join(mdir, "3.0%2C5.11-0%3A20110804T203458Z"),
+                    "w") as f:
+                        f.write("random junk")
+
+                def get_entries():
+                        repo = self.get_repo(repo_path, read_only=True)
+                        cat = repo.get_catalog("test")
+                        entries = []
+                        for f in cat.fmris(ordered=True):
+                                entries.append((str(f), cat.get_entry(f),
+                                    [str(a) for a in cat.get_entry_actions(f,
+                                    [cat.DEPENDENCY, cat.SUMMARY])]))
+                        return entries
+
+                self.pkgrepo("rebuild -s {0}".format(repo_path))
+                expected = get_entries()
+                self.assertEqual(len(expected), len(plist))
+                self.pkgrepo("rebuild -j 3 -s {0}".format(repo_path))
+                self.assertEqualDiff(expected, get_entries())
+
         def __test_refresh(self, repo_path, repo_uri):
                 """Private function to verify refresh subcommand behaviour."""
 
@@ -1233,6 +1268,159 @@ test1\t1\tonline\t2011-08-04T20:34:58Z
                 # refresh in update log.
                 self.assertEqualDiff(expected, returned)
 
+        def test_05a_refresh_parallel(self):
+                """Verify that pkgrepo refresh and rebuild produce the same
+                search results whether manifests are indexed serially or in
+                parallel."""
+
+                repo_path = self.dc.get_repodir()
+                self.pkgrepo("refresh -j 0 -s {0}".format(repo_path), exit=2)
+                self.pkgrepo("refresh -j 2 -s http://localhost:1", exit=2)
+
+                self.pkgsend_bulk(repo_path, (self.amber10, self.amber20,
+                    self.tree10, self.truck10, self.zoo10))
+
+                def get_results():
+                        repo = self.get_repo(repo_path, read_only=True)
+                        res = {}
+                        for term in ("amber", "tree", "*ruck*", "require",
+                            "test/*", "ZOO"):
+                                query = Query(term, False,
+                                    Query.RETURN_ACTIONS, None, None)
+                                res[term] = sorted(
+                                    str(e)
+                                    for e in list(repo.search([query]))[0]
+                                )
+                        return res
+
+                self.pkgrepo("rebuild --no-catalog -s {0}".format(repo_path))
+                expected = get_results()
+                self.assertTrue(expected["amber"])
+                self.assertTrue(expected["*ruck*"])
+
+                # Discard the index so that refresh indexes every package.
+                repo = self.get_repo(repo_path, read_only=True)
+                shutil.rmtree(repo.get_pub_rstore("test").index_root)
+                self.pkgrepo("refresh --no-catalog -j 3 -s {0}".format(
+                    repo_path))
+                self.assertEqualDiff(expected, get_results())
+
+                self.pkgrepo("rebuild --no-catalog -j 2 -s {0}".format(
+                    repo_path))
+                self.assertEqualDiff(expected, get_results())
+
+                # Given the packages in the same order, the index is the same
+                # however the tokens were divided among the sort files.
+                def get_index(jobs, sort_file_max_size):
+                        repo = sr.Repository(root=repo_path,
+                            sort_file_max_size=sort_file_max_size)
+                        repo.rebuild(build_catalog=False, build_index=True,
+                            jobs=jobs)
+                        index_root = repo.get_pub_rstore("test").index_root
+                        res = {}
+                        for name in ("main_dict.ascii.v2", "main_dict.bin.v1"):
+                                with open(os.path.join(index_root, name),
+                                    "rb") as f:
+                                        res[name] = f.read()
+                        return res
+
+                expected = get_index(1, 1024 * 1024)
+                self.assertEqual(expected, get_index(1, 512))
+                self.assertEqual(expected, get_index(3, 1024 * 1024))
+
+        def test_05b_refresh_delta(self):
+                """Verify that packages added to or removed from an existing
+                search index are found, or not found, both before and after
+                the index is compacted."""
+
+                repo_path = self.dc.get_repodir()
+                self.pkgsend_bulk(repo_path, (self.tree10, self.amber10))
+                self.pkgrepo("rebuild --no-catalog -s {0}".format(repo_path))
+
+                def get_pkgs(term):
+                        repo = self.get_repo(repo_path, read_only=True)
+                        query = Query(term, False, Query.RETURN_PACKAGES,
+                            None, None)
+                        return sorted(set(
+                            fmri.PkgFmri(str(e[2][0])).pkg_name
+                            for e in list(repo.search([query]))[0]
+                        ))
+
+                repo = self.get_repo(repo_path, read_only=True)
+                index_root = repo.get_pub_rstore("test").index_root
+                main_dict = os.path.join(index_root, ss.MAIN_FILE)
+                st = os.stat(main_dict)
+
+                # Packages added to an existing index are placed in a delta
+                # segment without rewriting the main dictionary.
+                self.pkgsend_bulk(repo_path, self.truck10)
+                self.pkgrepo("refresh --no-catalog -s {0}".format(repo_path))
+                self.assertTrue(os.path.exists(os.path.join(index_root,
+                    ss.DELTA_SEGMENTS_FILE)))
+                self.assertEqual(st.st_ino, os.stat(main_dict).st_ino)
+                self.assertEqualDiff(["truck"], get_pkgs("truck1"))
+                self.assertEqualDiff(["amber", "truck"], get_pkgs("amber"))
+
+                # Removed packages are recorded as tombstones instead of
+                # discarding the index.
+                self.pkgrepo("remove -s {0} amber".format(repo_path))
+                self.assertTrue(os.path.exists(os.path.join(index_root,
+                    ss.TOMBSTONE_FILE)))
+                self.assertEqualDiff(["truck"], get_pkgs("amber"))
+                self.assertEqualDiff(["tree"], get_pkgs("Leafy"))
+
+                # A refresh with nothing to index compacts the index.
+                self.pkgrepo("refresh --no-catalog -s {0}".format(repo_path))
+                self.assertFalse(os.path.exists(os.path.join(index_root,
+                    ss.DELTA_SEGMENTS_FILE)))
+                self.assertFalse(os.path.exists(os.path.join(index_root,
+                    ss.TOMBSTONE_FILE)))
+                self.assertEqualDiff([], [
+                    name for name in os.listdir(index_root)
+                    if name.startswith("delta.")
+                ])
+                self.assertEqualDiff(["truck"], get_pkgs("truck1"))
+                self.assertEqualDiff(["truck"], get_pkgs("amber"))
+                self.assertEqualDiff([], get_pkgs("resin"))
+                self.assertEqualDiff(["tree"], get_pkgs("Leafy"))
+
+        def test_05c_search_paging(self):
+                """Verify that repository searches return only the results
+                requested and that AND queries find the actions matching both
+                terms."""
+
+                repo_path = self.dc.get_repodir()
+                self.pkgsend_bulk(repo_path, (self.tree10, self.amber10,
+                    self.truck10))
+                self.pkgrepo("rebuild --no-catalog -s {0}".format(repo_path))
+                repo = self.get_repo(repo_path, read_only=True)
+
+                def search(text, num_to_return=None, start_point=None):
+                        query = Query(text, False, Query.RETURN_ACTIONS,
+                            num_to_return, start_point)
+                        return [
+                            (fmri.PkgFmri(str(e[2][0])).pkg_name, e[2][1],
+                                e[2][2])
+                            for e in list(repo.search([query]))[0]
+                        ]
+
+                results = search("*")
+                self.assertTrue(len(results) > 6)
+                self.assertEqualDiff(results[:2], search("*", 2))
+                self.assertEqualDiff(results[3:5], search("*", 2, 3))
+                self.assertEqualDiff(results[4:], search("*", None, 4))
+                self.assertEqualDiff([], search("*", 2, len(results)))
+
+                self.assertEqualDiff([("truck", "depend")], sorted(set(
+                    (pkg_name, l.split()[0])
+                    for pkg_name, fv, l in search("depend::* AND *amber*")
+                )))
+                self.assertEqualDiff(
+                    sorted(set(search("etc/truck1 AND *truck*"))),
+                    sorted(set(search("etc/truck1"))))
+                self.assertEqualDiff([],
+                    search("etc/truck1 AND Leafy"))
+
         def test_05_refresh(self):
                 """Verify pkgrepo refresh works as expected."""
 
@@ -3119,6 +3307,169 @@ test2	zoo		1.0	5.11	0	20110804T203458Z	pkg://test2/zoo@1.0,5.11-0:20110804T20345
                 if file_created:
                         os.remove(cert_path)
 
+        def test_verify_parallel(self):
+                """Test that verify using multiple jobs finds the same errors,
+                in the same order, as a serial verify."""
+
+                repo_path = self.dc.get_repodir()
+
+                # Bad option values are rejected.
+                self.pkgrepo("-s {0} verify -j 0".format(repo_path), exit=2)
+                self.pkgrepo("-s {0} verify -j foo".format(repo_path), exit=2)
+
+                fmris = self.pkgsend_bulk(repo_path, (self.tree10,
+                    self.amber10, self.amber20, self.truck10, self.truck20))
+                self.pkgrepo("-s {0} verify -j 4".format(repo_path), exit=0)
+
+                # tmp/truck1 is delivered by several packages; each of them
+                # must still be reported even though the payload itself is
+                # only verified once.
+                bad_hash_path = self.__inject_badhash("tmp/truck1")
+                bad_mf = self.__inject_badmanifest(fmris[1])
+
+                self.pkgrepo("-s {0} verify".format(repo_path), exit=1)
+                serial_output = self.output
+                self.pkgrepo("-s {0} verify -j 4".format(repo_path), exit=1)
+                self.assertEqual(serial_output, self.output)
+                self.assertTrue(bad_hash_path in self.output)
+                self.assertTrue(bad_mf in self.output)
+                self.assertEqual(
+                    self.output.count("ERROR: Invalid file hash"), 3)
+
+        def test_verify_incremental(self):
+                """Test that incremental verification only verifies content
+                that has changed or has not been verified recently."""
+
+                repo_path = self.dc.get_repodir()
+                self.pkgrepo("-s {0} verify --reverify-age 1".format(
+                    repo_path), exit=2)
+                self.pkgrepo("-s {0} verify --incremental "
+                    "--reverify-age 0".format(repo_path), exit=2)
+
+                # Only incremental verification records its results.
+                self.pkgsend_bulk(repo_path, (self.tree10, self.truck10))
+                vpath = os.path.join(repo_path, "publisher", "test",
+                    "verify.dat")
+                self.pkgrepo("-s {0} verify".format(repo_path))
+                self.assertFalse(os.path.exists(vpath))
+                self.pkgrepo("-s {0} verify --incremental".format(repo_path))
+                self.assertTrue(os.path.exists(vpath))
+
+                # Unchanged manifests are not read again.
+                mdir = os.path.join(repo_path, "publisher", "test", "pkg",
+                    "tree")
+                mpath = os.path.join(mdir, os.listdir(mdir)[0])
+                st = os.stat(mpath)
+                with open(mpath, "rb") as f:
+                        mdata = f.read()
+                with open(mpath, "r+b") as f:
+                        # Make the second action invalid.
+                        f.seek(mdata.index(b"\n") + 1)
+                        f.write(b"?")
+                os.utime(mpath, (st.st_atime, st.st_mtime))
+                self.pkgrepo("-s {0} verify --incremental".format(repo_path))
+                self.pkgrepo("-s {0} verify".format(repo_path), exit=1)
+                with open(mpath, "r+b") as f:
+                        f.write(mdata)
+                os.utime(mpath, (st.st_atime, st.st_mtime))
+
+                # Corrupt a file without changing its size or timestamps; an
+                # incremental verify trusts the previous result, while a
+                # full verify detects the damage.
+                fpath = self.__get_file_path("tmp/truck1")
+                st = os.stat(fpath)
+                with open(fpath, "r+b") as f:
+                        f.write(b"\0" * st.st_size)
+                os.utime(fpath, (st.st_atime, st.st_mtime))
+                self.pkgrepo("-s {0} verify --incremental".format(repo_path))
+                self.pkgrepo("-s {0} verify".format(repo_path), exit=1)
+
+                # The full verify did not record the damaged file, and so
+                # it is verified again.
+                self.pkgrepo("-s {0} verify --incremental".format(repo_path),
+                    exit=1)
+                self.assertTrue(fpath in self.output)
+
+                # Once repaired, content is verified again after its
+                # re-verify age has passed.
+                self.__repair_badhash("tmp/truck1")
+                self.pkgrepo("-s {0} verify --incremental".format(repo_path))
+                st = os.stat(fpath)
+                with open(fpath, "r+b") as f:
+                        f.write(b"\0" * st.st_size)
+                os.utime(fpath, (st.st_atime, st.st_mtime))
+                self.pkgrepo("-s {0} verify --incremental".format(repo_path))
+                time.sleep(1)
+                self.pkgrepo("-s {0} verify --incremental "
+                    "--reverify-age 0.00001".format(repo_path), exit=1)
+
+                # Quarantined content is forgotten by fix.
+                self.pkgrepo("-s {0} fix".format(repo_path))
+                with open(os.path.join(repo_path, "publisher", "test",
+                    "verify.dat"), "rb") as f:
+                        vstate = json.loads(misc.force_str(f.read()))
+                self.assertTrue(os.path.basename(fpath) not in
+                    vstate["payloads"])
+
+        def test_gc(self):
+                """Test that gc removes only files not referenced by any
+                package."""
+
+                repo_path = self.dc.get_repodir()
+                self.pkgrepo("-s {0} gc -n foo".format(repo_path), exit=2)
+                self.pkgsend_bulk(repo_path, (self.tree10, self.truck10))
+                fpath = self.__get_file_path("tmp/truck1")
+
+                # Nothing is unreferenced yet.
+                self.pkgrepo("-s {0} gc".format(repo_path))
+                self.assertTrue(os.path.exists(fpath))
+
+                # Add an orphaned file to the file root.
+                oname = "0" * 40
+                opath = os.path.join(repo_path, "publisher", "test", "file",
+                    oname[:2], oname)
+                misc.makedirs(os.path.dirname(opath))
+                shutil.copy(fpath, opath)
+
+                # A trial run lists but doesn't remove it.
+                self.pkgrepo("-s {0} gc -n".format(repo_path))
+                self.assertTrue(opath in self.output)
+                self.assertTrue(os.path.exists(opath))
+
+                self.pkgrepo("-s {0} gc -p test".format(repo_path))
+                self.assertFalse(os.path.exists(opath))
+                self.assertTrue(os.path.exists(fpath))
+                self.pkgrepo("-s {0} verify".format(repo_path))
+
+                # Files shared by packages are kept until the last package
+                # referencing them is removed.
+                self.pkgrepo("-s {0} remove truck".format(repo_path))
+                self.assertTrue(os.path.exists(fpath))
+                self.pkgrepo("-s {0} remove tree".format(repo_path))
+                self.assertFalse(os.path.exists(fpath))
+
+                # The index can be rebuilt.
+                self.pkgsend_bulk(repo_path, (self.tree10, self.truck10))
+                shutil.rmtree(os.path.join(repo_path, "publisher", "test",
+                    "refs"))
+                self.pkgrepo("-s {0} rebuild".format(repo_path))
+                self.pkgrepo("-s {0} gc".format(repo_path))
+                self.pkgrepo("-s {0} verify".format(repo_path))
+
+                # Manifests found by refresh are recorded in the index, so
+                # their files are kept when other packages are removed.
+                self.pkgrepo("-s {0} remove truck".format(repo_path))
+                src_repo = os.path.join(self.test_root, "gc_src")
+                self.create_repo(src_repo)
+                self.pkgsend_bulk(src_repo, self.truck10)
+                shutil.copytree(os.path.join(src_repo, "publisher", "test",
+                    "pkg", "truck"), os.path.join(repo_path, "publisher",
+                    "test", "pkg", "truck"))
+                self.pkgrepo("-s {0} refresh".format(repo_path))
+                self.pkgrepo("-s {0} remove tree".format(repo_path))
+                self.assertTrue(os.path.exists(fpath))
+                self.pkgrepo("-s {0} verify".format(repo_path))
+
         def __get_fhashes(self, repodir, pub):
                 """Returns a list of file hashes for the publisher
                 pub in a given repository."""
@@ -1145,6 +1145,63 @@ class TestP5pWsgi(pkg5unittest.SingleDepotTestCase):
                 # despite the missing p5p file, we should still get 400 errors
                 test_query_responses(queries_400, "400")
 
+        def test_file_content(self):
+                """Ensure that package files are served from the archive
+                correctly, whether or not the server provides a file wrapper
+                to send them directly."""
+
+                class FileWrapper(object):
+                        """A file wrapper that reads the file-like object it
+                        wraps, as servers that can't send file descriptors
+                        directly do."""
+
+                        def __init__(self, filelike, blksize=8192):
+                                self.filelike = filelike
+                                self.blksize = blksize
+
+                        def __iter__(self):
+                                while True:
+                                        data = self.filelike.read(
+                                            self.blksize)
+                                        if not data:
+                                                return
+                                        yield data
+
+                headers = {}
+                def start_response(status, response_headers, exc_info=None):
+                        self.http_status = status
+                        headers.update(response_headers)
+
+                fhash = "f890d49474e943dc07a766c21d2bf35d6e527e89"
+                archive = pkg.p5p.Archive(self.p5p_path)
+                expected = archive.get_package_file(fhash, pub="test").read()
+                archive.close()
+
+                hsh = "123abcdef"
+                environ = {
+                    "SYSREPO_RUNTIME_DIR": self.test_root,
+                    "PKG5_TEST_ENV": "True",
+                    hsh: self.p5p_path,
+                    "QUERY_STRING":
+                        "pub=test&hash={0}&path=file/1/{1}".format(hsh, fhash),
+                }
+                for wrapper in (None, FileWrapper):
+                        if wrapper:
+                                environ["wsgi.file_wrapper"] = wrapper
+                        headers.clear()
+                        result = self.sysrepo_p5p.application(environ,
+                            start_response)
+                        content = b"".join(result)
+                        if wrapper:
+                                self.assertTrue(isinstance(result, wrapper))
+                                result.filelike.close()
+                        else:
+                                result.close()
+                        self.assertTrue("200" in self.http_status)
+                        self.assertEqual(content, expected)
+                        self.assertEqual(headers["content-length"],
+                            str(len(expected)))
+
 
 if __name__ == "__main__":
         unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+#
+
+#
+# p5pbench - benchmark serving package files from a p5p archive
+#
+# An archive containing 'files' package files of 'size' bytes each is created
+# in a temporary directory, and every file in it is then read using each of
+# the following methods, the way the system repository serves them:
+#
+#     tarfile   through the file-like object returned by get_package_file(),
+#               as the system repository used to
+#     range     by reading the member's extent of the archive file directly
+#     sendfile  by sending the member's extent of the archive file to
+#               /dev/null using os.sendfile(), as mod_wsgi does when given a
+#               wsgi.file_wrapper (only if the platform supports it)
+#
+# The elapsed and CPU time of the fastest of 'runs' runs of each method is
+# reported along with the resulting throughput.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pkg.p5p
+
+BLOCK_SIZE = 128 * 1024
+
+def usage():
+        print("Usage: p5pbench.py [-f files] [-s size] [-r runs]",
+            file=sys.stderr)
+        sys.exit(2)
+
+def build_archive(root, nfiles, size):
+        """Creates an archive of 'nfiles' package files of 'size' bytes in
+        'root' and returns its path and the hashes of its files."""
+
+        src = os.path.join(root, "src")
+        os.mkdir(src)
+        arc_path = os.path.join(root, "bench.p5p")
+        arc = pkg.p5p.Archive(arc_path, mode="w")
+        hashes = []
+        for i in range(nfiles):
+                data = os.urandom(size)
+                fhash = hashlib.sha1(data).hexdigest()
+                with open(os.path.join(src, fhash), "wb") as f:
+                        f.write(data)
+                arc.add(os.path.join(src, fhash),
+                    arcname="publisher/bench/file/{0}/{1}".format(fhash[:2],
+                    fhash))
+                hashes.append(fhash)
+        arc.close()
+        shutil.rmtree(src)
+        return arc_path, hashes
+
+def read_tarfile(arc, arc_path, fhash, devnull):
+        fobj = arc.get_package_file(fhash, pub="bench")
+        while fobj.read(BLOCK_SIZE):
+                pass
+        fobj.close()
+
+def read_range(arc, arc_path, fhash, devnull):
+        offset, size = arc.get_package_file_extent(fhash, pub="bench")
+        with open(arc_path, "rb") as f:
+                f.seek(offset)
+                while size > 0:
+                        data = f.read(min(size, BLOCK_SIZE))
+                        if not data:
+                                break
+                        size -= len(data)
+
+def read_sendfile(arc, arc_path, fhash, devnull):
+        offset, size = arc.get_package_file_extent(fhash, pub="bench")
+        with open(arc_path, "rb") as f:
+                while size > 0:
+                        sent = os.sendfile(devnull.fileno(), f.fileno(),
+                            offset, size)
+                        if not sent:
+                                break
+                        offset += sent
+                        size -= sent
+
+def cpu_time():
+        """Returns the CPU time used by the process so far."""
+
+        t = os.times()
+        return t[0] + t[1]
+
+def bench(method, arc_path, hashes, runs):
+        """Returns the elapsed and CPU time of the fastest run of 'method'
+        over every file in the archive."""
+
+        best = None
+        with open(os.devnull, "wb") as devnull:
+                for i in range(runs):
+                        # As in the system repository, the archive is opened
+                        # once and its index shared by the objects used.
+                        arc = pkg.p5p.Archive(arc_path)
+                        arc.get_index()
+                        start = time.time()
+                        cpu = cpu_time()
+                        for fhash in hashes:
+                                method(arc, arc_path, fhash, devnull)
+                        res = (time.time() - start, cpu_time() - cpu)
+                        arc.close()
+                        if best is None or res[0] < best[0]:
+                                best = res
+        return best
+
+def main_func():
+        nfiles = 1000
+        size = 256 * 1024
+        runs = 3
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:], "f:r:s:")
+                for opt, arg in opts:
+                        if opt == "-f":
+                                nfiles = int(arg)
+                        elif opt == "-r":
+                                runs = int(arg)
+                        elif opt == "-s":
+                                size = int(arg)
+        except (getopt.GetoptError, ValueError):
+                usage()
+        if pargs or nfiles < 1 or runs < 1 or size < 0:
+                usage()
+
+        methods = [("tarfile", read_tarfile), ("range", read_range)]
+        if hasattr(os, "sendfile"):
+                methods.append(("sendfile", read_sendfile))
+
+        root = tempfile.mkdtemp(prefix="p5pbench.")
+        try:
+                arc_path, hashes = build_archive(root, nfiles, size)
+                total = nfiles * size / (1024 * 1024)
+                print("{0:d} files of {1:d} bytes ({2:.1f} MiB), best of "
+                    "{3:d} runs".format(nfiles, size, total, runs))
+                print("{0:<10} {1:>10} {2:>10} {3:>10}".format("method",
+                    "elapsed", "cpu", "MiB/s"))
+                for name, method in methods:
+                        elapsed, cpu = bench(method, arc_path, hashes, runs)
+                        print("{0:<10} {1:>10.3f} {2:>10.3f} {3:>10.1f}".format(
+                            name, elapsed, cpu, elapsed and total / elapsed))
+        finally:
+                shutil.rmtree(root, ignore_errors=True)
+        return 0
+
+if __name__ == "__main__":
+        try:
+                sys.exit(main_func())
+        except KeyboardInterrupt:
+                sys.exit(1)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
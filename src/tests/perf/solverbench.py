@@ -0,0 +1,383 @@
+#!/usr/bin/python
+#
+# CDDL HEADER START
+#
+# The contents of this file are subject to the terms of the
+# Common Development and Distribution License (the "License").
+# You may not use this file except in compliance with the License.
+#
+# You can obtain a copy of the license at usr/src/OPENSOLARIS.LICENSE
+# or http://www.opensolaris.org/os/licensing.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#
+# When distributing Covered Code, include this CDDL HEADER in each
+# file and include the License file at usr/src/OPENSOLARIS.LICENSE.
+# If applicable, add the following below this CDDL HEADER, with the
+# fields enclosed by brackets "[]" replaced with your own identifying
+# information: Portions Copyright [yyyy] [name of copyright owner]
+#
+# CDDL HEADER END
+#
+
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+#
+
+#
+# solverbench - benchmark the package solver against synthetic catalogs
+#
+# A catalog of the requested shape is generated in a temporary directory and
+# each operation is then solved repeatedly, every run in a separate process so
+# that memory usage and caches don't carry over between runs.  The results are
+# written as JSON so that they can be compared between builds.
+#
+# The generated catalog contains 'stems' leaf packages, each with 'versions'
+# versions.  Leaf packages depend on one or two other leaf packages of the same
+# version, some using require-any and conditional dependencies, and some using
+# dependencies tagged with one of 'variants' values of variant.arch.  The leaf
+# packages are incorporated by 'depth' layers of incorporations, each one
+# incorporating up to 'fanout' packages of the layer below, and the top layer
+# is required and incorporated by 'entire'.
+#
+# The "install" operation installs 'entire' and all leaf packages into an empty
+# image, and the "update" operation updates an image with the oldest version of
+# every package installed.
+#
+
+from __future__ import division
+from __future__ import print_function
+
+import getopt
+import os
+import random
+import resource
+import shutil
+import simplejson as json
+import sys
+import tempfile
+import time
+
+import pkg.catalog as catalog
+import pkg.client.pkg_solver as pkg_solver
+import pkg.client.progress as progress
+import pkg.fmri as fmri
+import pkg.manifest as manifest
+import pkg.misc as misc
+
+PUBLISHER = "bench"
+TIMESTAMP = "20160101T000000Z"
+
+def usage():
+        print("""\
+Usage: solverbench.py [-s stems] [-v versions] [-d depth] [-f fanout]
+    [-a require_any_pct] [-c conditional_pct] [-V variants] [-n runs]
+    [-j jobs] [-S seed] [-o output_file] [operation ...]
+
+Operations are "install" and "update"; both are run by default.""",
+            file=sys.stderr)
+        sys.exit(2)
+
+def mkfmri(stem, ver):
+        return fmri.PkgFmri("pkg://{0}/{1}@1.{2:d},5.11-0:{3}".format(
+            PUBLISHER, stem, ver, TIMESTAMP))
+
+def gen_packages(cfg):
+        """Yields (stem, version, lines) tuples describing each package in a
+        synthetic catalog with the shape described by 'cfg'."""
+
+        rand = random.Random(cfg["seed"])
+        stems = ["leaf/{0:d}".format(i) for i in range(cfg["stems"])]
+        arches = ["arch{0:d}".format(i) for i in range(cfg["variants"])]
+
+        # Fix the shape of the dependency graph so that every version of a
+        # package has the same kind of dependencies.
+        deps = {}
+        for i, stem in enumerate(stems):
+                if i + 1 >= len(stems):
+                        deps[stem] = []
+                        continue
+                nxt = stems[rand.randint(i + 1, len(stems) - 1)]
+                alt = stems[rand.randint(i + 1, len(stems) - 1)]
+                pct = rand.randint(1, 100)
+                if pct <= cfg["require_any"]:
+                        kind = "require-any"
+                elif pct <= cfg["require_any"] + cfg["conditional"]:
+                        kind = "conditional"
+                elif arches and rand.randint(0, 1):
+                        kind = "variant"
+                else:
+                        kind = "require"
+                deps[stem] = [(kind, nxt, alt, rand.choice(arches or [None]))]
+
+        for ver in range(1, cfg["versions"] + 1):
+                for stem in stems:
+                        lines = []
+                        if arches:
+                                lines.append("set name=variant.arch {0}".format(
+                                    " ".join("value=" + a for a in arches)))
+                        for kind, nxt, alt, arch in deps[stem]:
+                                if kind == "require-any":
+                                        lines.append("depend type=require-any "
+                                            "fmri={0}@1.{2:d} "
+                                            "fmri={1}@1.{2:d}".format(
+                                            nxt, alt, ver))
+                                elif kind == "conditional":
+                                        lines.append("depend type=conditional "
+                                            "fmri={0}@1.{2:d} "
+                                            "predicate={1}".format(
+                                            nxt, alt, ver))
+                                elif kind == "variant":
+                                        lines.append("depend type=require "
+                                            "fmri={0}@1.{1:d} "
+                                            "variant.arch={2}".format(
+                                            nxt, ver, arch))
+                                else:
+                                        lines.append("depend type=require "
+                                            "fmri={0}@1.{1:d}".format(nxt, ver))
+                        yield stem, ver, lines
+
+                layer = stems
+                for level in range(cfg["depth"]):
+                        incs = []
+                        for start in range(0, len(layer), cfg["fanout"]):
+                                inc = "incorporation/{0:d}/{1:d}".format(level,
+                                    start // cfg["fanout"])
+                                incs.append(inc)
+                                yield inc, ver, [
+                                    "depend type=incorporate "
+                                    "fmri={0}@1.{1:d}".format(p, ver)
+                                    for p in layer[start:start + cfg["fanout"]]
+                                ]
+                        layer = incs
+
+                lines = []
+                for inc in layer:
+                        lines.append("depend type=require fmri={0}".format(inc))
+                        lines.append("depend type=incorporate "
+                            "fmri={0}@1.{1:d}".format(inc, ver))
+                yield "entire", ver, lines
+
+def build_catalog(cfg, meta_root):
+        """Generates the synthetic catalog described by 'cfg' in 'meta_root'
+        and returns a dictionary mapping each package stem to a list of its
+        FMRIs, sorted from oldest to newest."""
+
+        cat = catalog.Catalog(meta_root=meta_root, log_updates=False)
+        versions = {}
+        for stem, ver, lines in gen_packages(cfg):
+                m = manifest.Manifest()
+                m.set_content(content="\n".join(lines) + "\n")
+                pfmri = mkfmri(stem, ver)
+                cat.add_package(pfmri, manifest=m)
+                versions.setdefault(stem, []).append(pfmri)
+        cat.finalize()
+        cat.save()
+        return versions
+
+def maxrss_kb():
+        """Returns the peak resident set size of the process in kilobytes, or
+        None if the system doesn't provide it."""
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if not rss:
+                return None
+        if sys.platform == "darwin":
+                # Reported in bytes rather than kilobytes.
+                rss //= 1024
+        return rss
+
+def solve(cfg, meta_root, versions, op):
+        """Performs a single solve for the operation 'op' and returns a
+        dictionary of the results."""
+
+        # The process is forked from one that generated the catalog, so its
+        # peak memory usage includes that of its parent; only the growth
+        # during the solve is reported.
+        base_rss = maxrss_kb()
+        cat = catalog.Catalog(meta_root=meta_root, read_only=True)
+        if op == "install":
+                installed = {}
+        else:
+                installed = dict(
+                    (stem, fmris[0])
+                    for stem, fmris in versions.items()
+                )
+
+        variants = {}
+        if cfg["variants"]:
+                variants["variant.arch"] = "arch0"
+
+        # The catalog is loaded on demand, so its load time is included in
+        # that of the solve.
+        start = time.time()
+        solver = pkg_solver.PkgSolver(cat, installed,
+            { PUBLISHER: (1, True, True) }, variants, set(), None,
+            progress.NullProgressTracker(), jobs=cfg["jobs"])
+        if op == "install":
+                proposed = dict(
+                    (stem, fmris)
+                    for stem, fmris in versions.items()
+                    if stem == "entire" or stem.startswith("leaf/")
+                )
+                solution = solver.solve_install([], proposed)[0]
+        else:
+                solution = solver.solve_update_all([])[0]
+        solve_time = time.time() - start
+
+        vmusage = misc.__getvmusage()
+        rss = maxrss_kb()
+        if rss is not None and base_rss is not None:
+                rss -= base_rss
+        stats = solver.get_stats()
+        return {
+            "solve": solve_time,
+            "solution_size": len(solution),
+            "state": stats["state"],
+            "variables": stats["variables"],
+            "clauses": stats["clauses"],
+            "iterations": stats["iterations"],
+            "subphases": dict(stats["timings"]),
+            "maxrss_kb": rss,
+            "vmsize_kb": vmusage and vmusage // 1024,
+        }
+
+def run(cfg, meta_root, versions, op):
+        """Performs the solve for the operation 'op' in a child process and
+        returns its results."""
+
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+                os.close(rfd)
+                try:
+                        res = solve(cfg, meta_root, versions, op)
+                except Exception as e:
+                        res = { "error": str(e) }
+                with os.fdopen(wfd, "w") as f:
+                        json.dump(res, f)
+                os._exit(0)
+
+        os.close(wfd)
+        with os.fdopen(rfd, "r") as f:
+                res = json.load(f)
+        os.waitpid(pid, 0)
+        return res
+
+def summarize(results):
+        """Returns the minimum, median and maximum solve times and the
+        largest growth in peak memory usage in 'results'."""
+
+        summary = {}
+        vals = sorted(r["solve"] for r in results if "solve" in r)
+        if vals:
+                summary["solve"] = {
+                    "min": vals[0],
+                    "median": vals[len(vals) // 2],
+                    "max": vals[-1],
+                }
+        rss = [
+            r["maxrss_kb"] for r in results
+            if r.get("maxrss_kb") is not None
+        ]
+        if rss:
+                summary["maxrss_kb"] = max(rss)
+        return summary
+
+def main_func():
+        cfg = {
+            "stems": 200,
+            "versions": 5,
+            "depth": 2,
+            "fanout": 10,
+            "require_any": 10,
+            "conditional": 10,
+            "variants": 2,
+            "runs": 5,
+            "jobs": 1,
+            "seed": 0,
+        }
+        output = None
+
+        try:
+                opts, pargs = getopt.getopt(sys.argv[1:],
+                    "a:c:d:f:j:n:o:s:S:v:V:")
+        except getopt.GetoptError as e:
+                print("solverbench: {0}".format(e), file=sys.stderr)
+                usage()
+
+        intopts = {
+            "-a": "require_any",
+            "-c": "conditional",
+            "-d": "depth",
+            "-f": "fanout",
+            "-j": "jobs",
+            "-n": "runs",
+            "-s": "stems",
+            "-S": "seed",
+            "-v": "versions",
+            "-V": "variants",
+        }
+        for opt, arg in opts:
+                if opt == "-o":
+                        output = arg
+                        continue
+                try:
+                        cfg[intopts[opt]] = int(arg)
+                except ValueError:
+                        print("solverbench: {0} requires an integer "
+                            "argument".format(opt), file=sys.stderr)
+                        usage()
+
+        if cfg["stems"] < 1 or cfg["versions"] < 1 or cfg["fanout"] < 1 or \
+            cfg["runs"] < 1 or cfg["jobs"] < 1:
+                usage()
+
+        ops = pargs or ["install", "update"]
+        for op in ops:
+                if op not in ("install", "update"):
+                        usage()
+
+        meta_root = tempfile.mkdtemp(prefix="solverbench.")
+        try:
+                start = time.time()
+                versions = build_catalog(cfg, meta_root)
+                report = {
+                    "config": cfg,
+                    "catalog": {
+                        "packages": sum(len(v) for v in versions.values()),
+                        "build": time.time() - start,
+                    },
+                    "python": sys.version.split()[0],
+                    "operations": {},
+                }
+
+                for op in ops:
+                        results = [
+                            run(cfg, meta_root, versions, op)
+                            for i in range(cfg["runs"])
+                        ]
+                        report["operations"][op] = {
+                            "runs": results,
+                            "summary": summarize(results),
+                        }
+        finally:
+                shutil.rmtree(meta_root, ignore_errors=True)
+
+        if output:
+                with open(output, "w") as f:
+                        json.dump(report, f, indent=2, sort_keys=True)
+                        f.write("\n")
+        else:
+                json.dump(report, sys.stdout, indent=2, sort_keys=True)
+                print()
+        return 0
+
+if __name__ == "__main__":
+        try:
+                sys.exit(main_func())
+        except KeyboardInterrupt:
+                sys.exit(1)
+
+# Vim hints
+# vim:ts=8:sw=8:et:fdm=marker
@@ -47,6 +47,10 @@ SERVER_BADREQUEST_STATUS = "{0} {1}".format(http_client.BAD_REQUEST,
 
 response_headers = [("content-type", "application/binary")]
 
+# The size of the blocks in which archive members are sent when the server
+# can't send them directly from the archive file.
+BLOCK_SIZE = 128 * 1024
+
 p5p_indices = {}
 
 # A lock to prevent two threads from rebuilding our catalog parts cache
@@ -84,6 +88,45 @@ class MissingArchiveException(Exception):
                 return "Missing p5p archive: {0}".format(self.path)
 
 
+class ArchiveMember(object):
+        """A read-only file-like object for the content of a p5p archive member,
+        which is a contiguous range of the archive file.
+
+        It is suitable for use with wsgi.file_wrapper: servers that can send
+        file descriptors directly, such as mod_wsgi, use fileno() and tell()
+        along with the Content-Length of the response, so that the content is
+        sent without being copied through Python.  Other servers read() it,
+        or iterate over it in blocks."""
+
+        def __init__(self, pathname, offset, size):
+                self.__file = open(pathname, "rb")
+                self.__file.seek(offset)
+                self.__remaining = size
+
+        def __iter__(self):
+                while True:
+                        data = self.read(BLOCK_SIZE)
+                        if not data:
+                                return
+                        yield data
+
+        def fileno(self):
+                return self.__file.fileno()
+
+        def tell(self):
+                return self.__file.tell()
+
+        def read(self, size=-1):
+                if size < 0 or size > self.__remaining:
+                        size = self.__remaining
+                data = self.__file.read(size)
+                self.__remaining -= len(data)
+                return data
+
+        def close(self):
+                self.__file.close()
+
+
 class SysrepoP5p(object):
         """An object to handle a request for p5p file contents from the
         system repository."""
@@ -94,6 +137,10 @@ class SysrepoP5p(object):
                 self.p5p_path = None
                 self.p5p = None
 
+                # Set when the response is to be handed to the server as is,
+                # so that it can send it directly.
+                self.direct = False
+
                 self.query = self.environ["QUERY_STRING"]
                 self.runtime_dir = self.environ["SYSREPO_RUNTIME_DIR"]
 
@@ -170,10 +217,29 @@ class SysrepoP5p(object):
                 """Process our file query."""
 
                 # use the basename of the path, which is the pkg(5) hash
-                self.start_response(SERVER_OK_STATUS, response_headers)
+                fhash = os.path.basename(path)
                 try:
-                        return self.p5p.get_package_file(os.path.basename(path),
+                        extent = self.p5p.get_package_file_extent(fhash,
                             pub=pub)
+                        if extent is None:
+                                self.start_response(SERVER_OK_STATUS,
+                                    response_headers)
+                                return self.p5p.get_package_file(fhash,
+                                    pub=pub)
+
+                        # Serve the member's content straight from the
+                        # archive file, allowing the server to send it
+                        # without copying it through Python if possible.
+                        offset, size = extent
+                        member = ArchiveMember(self.p5p_path, offset, size)
+                        self.start_response(SERVER_OK_STATUS,
+                            response_headers + [
+                            ("content-length", str(size))])
+                        file_wrapper = self.environ.get("wsgi.file_wrapper")
+                        if file_wrapper:
+                                self.direct = True
+                                return file_wrapper(member, BLOCK_SIZE)
+                        return member
                 except pkg.p5p.UnknownArchiveFiles as e:
                         self.log_exception(status=SERVER_NOTFOUND_STATUS)
                 except Exception as e:
@@ -418,6 +484,11 @@ class AppWrapper(object):
 
         def __call__(self, environ, start_response):
                 result, closeable = self.__application(environ, start_response)
+                if closeable.direct:
+                        # The result must be returned as is for the server to
+                        # recognize it, and doesn't need the archive.
+                        closeable.close()
+                        return result
                 return CloseGenerator(result, closeable)
 
 
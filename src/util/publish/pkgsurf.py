@@ -626,15 +626,21 @@ def do_reversion(pub, ref_pub, target_repo, ref_xport, changes, ignores):
                         # Retrieve manifest from ref repo and replace the one in
                         # the target repo. We don't have to adjust depndencies
                         # for these packages because they will not depend on
-                        # anything we'll reversion.
+                        # anything we'll reversion.  The repository's payload
+                        # reference index is updated so that it never misses a
+                        # reference while either manifest exists.
                         rmani = ref_xport.get_manifest(pfmri)
+                        omani = get_manifest(target_repo, pub, latest_pkgs[p])
+                        rstore = target_repo.get_pub_rstore(pub)
                         opath = target_repo.manifest(latest_pkgs[p], pub)
-                        os.remove(opath)
                         path = target_repo.manifest(pfmri, pub)
                         try:
                                 repo_modified = True
                                 repo_finished = False
+                                rstore.update_refs(added=rmani)
+                                os.remove(opath)
                                 portable.rename(rmani.pathname, path)
+                                rstore.update_refs(removed=omani)
                         except OSError as e:
                                 abort(err=_("Could not reversion manifest "
                                     "{path}: {err}").format(path=path,